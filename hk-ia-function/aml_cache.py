@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+AML 查詢結果快取
+以「標準化參數 + 資料集版本號」為鍵的 LRU + TTL 快取，放在 FirestoreAMLQuery 前面；
+任何寫入流程遞增版本號後，舊版本的快取項目即不再命中
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from aml_fuzzy import DEFAULT_THRESHOLD
+from aml_name_index import normalize_name
+from aml_nationality import nationality_code
+
+
+class VersionedLRUCache:
+    """有容量上限與存活時間的 LRU 快取（執行緒安全）"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (key, version) -> (到期時間, 值)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, version):
+        """回傳 (是否命中, 值)"""
+        full_key = (key, version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(full_key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[full_key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, version, value):
+        full_key = (key, version)
+        with self._lock:
+            self._entries[full_key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """清空所有項目（計數器保留）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class CachedAMLQuery:
+    """FirestoreAMLQuery 的快取包裝；未包裝的屬性與方法直接轉給原引擎"""
+
+    def __init__(self, engine, maxsize=1024, ttl=300):
+        self.engine = engine
+        self.cache = VersionedLRUCache(maxsize=maxsize, ttl=ttl)
+        self._seen_version = None
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def _cached(self, key, loader, is_ok):
+        version = self.engine.dataset_version
+        if version != self._seen_version:
+            # 版本變更後舊項目不會再命中，直接釋放記憶體
+            self._seen_version = version
+            self.cache.invalidate()
+
+        hit, value = self.cache.get(key, version)
+        if hit:
+            return value
+        value = loader()
+        if is_ok(value):
+            self.cache.set(key, version, value)
+        return value
+
+    def search_by_name(self, name, page=1, per_page=20, mode='substring', threshold=DEFAULT_THRESHOLD):
+        key = ('query', normalize_name(name), page, per_page, mode,
+               round(threshold, 4) if mode == 'fuzzy' else None)
+        return self._cached(
+            key,
+            lambda: self.engine.search_by_name(name, page, per_page, mode=mode, threshold=threshold),
+            lambda result: True
+        )
+
+    def get_profiles_paginated(self, page=1, per_page=50, nationality=None, cursor=None):
+        key = ('profiles', page, per_page,
+               nationality_code(nationality) if nationality else None, cursor or None)
+        return self._cached(
+            key,
+            lambda: self.engine.get_profiles_paginated(page, per_page, nationality, cursor=cursor),
+            lambda result: result.get('success', False)
+        )
+
+    def get_stats(self):
+        return self._cached(
+            ('stats',),
+            self.engine.get_stats,
+            lambda result: 'error' not in result
+        )
+
+    def get_nationality_facets(self):
+        return self._cached(
+            ('facets', 'nationality'),
+            self.engine.get_nationality_facets,
+            lambda result: result.get('success', False)
+        )
+
+    def invalidate(self):
+        """本行程剛完成寫入時立即清空快取，不等待版本號監聽回傳"""
+        self.cache.invalidate()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+分頁游標
+依 (year DESC, name, 記錄 ID) 排序的鍵集分頁位置，編碼為不透明的 next_cursor 字串；
+Firestore 與 SQLite 兩個查詢後端共用相同格式
+"""
+
+import json
+import base64
+
+
+def encode_cursor(year, name, record_id):
+    """將分頁位置編碼為不透明的 next_cursor 字串"""
+    raw = json.dumps([year, name, record_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解碼 next_cursor，回傳 (year, name, 記錄 ID)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        year, name, record_id = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError("無效的分頁游標")
+    return year, name, record_id
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+AML 名單匯出
+將 profiles 記錄逐筆轉換為 NDJSON 或 CSV，並可選擇以 gzip 串流壓縮；
+全部以產生器實作，記憶體用量與資料量無關
+"""
+
+import io
+import csv
+import json
+import zlib
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# CSV 欄位順序（NDJSON 則輸出完整記錄）
+CSV_FIELDS = (
+    'firestore_id', 'id', 'year', 'name', 'nationality', 'nationality_code',
+    'passport_no', 'source_pdf', 'source_url', 'created_at'
+)
+
+# 合併輸出的區塊大小，避免每筆記錄都產生一次網路寫入
+CHUNK_BYTES = 64 * 1024
+
+
+def ndjson_lines(records):
+    """每筆記錄輸出一行 JSON"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, default=str) + '\n'
+
+
+def csv_lines(records):
+    """輸出 CSV 標題列與每筆記錄（開頭加 BOM 讓 Excel 正確辨識 UTF-8）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    yield '\ufeff' + buffer.getvalue()
+    for record in records:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(['' if record.get(field) is None else record.get(field) for field in CSV_FIELDS])
+        yield buffer.getvalue()
+
+
+def encode_chunks(lines, chunk_bytes=CHUNK_BYTES):
+    """將文字行編碼為 UTF-8 並合併為約 chunk_bytes 大小的區塊"""
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzip_chunks(chunks, level=6):
+    """以串流方式 gzip 壓縮位元組區塊"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(records, fmt, gzip=False):
+    """依格式產生匯出內容的位元組串流"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}")
+    lines = ndjson_lines(records) if fmt == 'ndjson' else csv_lines(records)
+    chunks = encode_chunks(lines)
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+AML 姓名模糊比對
+以 Jaro-Winkler 相似度結合語音鍵（phonetic key）為詞元評分，查詢詞元與姓名詞元一對一配對：
+查詢中未配對的詞元與姓名中多出的詞元都會拉低分數；
+FuzzyIndex 以語音分桶與所需配對數找出所有可能達到門檻的記錄，不需與每一筆記錄逐一比較；
+索引與逐筆比對共用同一個評分函式，結果與分數完全一致
+"""
+
+import heapq
+import itertools
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from aml_name_index import normalize_name
+
+DEFAULT_THRESHOLD = 0.85
+
+# 詞元配對分數低於此值時不計入；須高於 JW_WEIGHT，FuzzyIndex 因此只需查語音分桶
+TOKEN_MATCH_FLOOR = 0.8
+
+# 逐筆檢查一筆記錄的詞元約為集合交集處理一個元素的成本倍數（決定 FuzzyIndex 產生候選的方式）
+_SCAN_COST = 10
+
+# 保守的浮點誤差容許值，只會多列入候選，不影響最終評分
+_EPSILON = 1e-9
+
+# FuzzyIndex 快取相近詞彙的查詢詞元數
+VOCABULARY_CACHE_SIZE = 128
+
+# 評分權重：Jaro-Winkler 與完整語音鍵一致；語音鍵不同的詞元最高只有 JW_WEIGHT 分
+JW_WEIGHT = 0.6
+PHONETIC_WEIGHT = 0.4
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Soundex 子音分組；母音與 H/W/Y 不編碼
+_SOUNDEX_CODES = {}
+for _letters, _code in (('BFPV', '1'), ('CGJKQSXZ', '2'), ('DT', '3'),
+                        ('L', '4'), ('MN', '5'), ('R', '6')):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+
+def tokenize(name):
+    """將姓名切分為標準化詞元"""
+    return _TOKEN_RE.findall(normalize_name(name))
+
+
+def _ascii_fold(token):
+    """移除變音符號並轉為大寫 ASCII（無法轉換的字元保留原樣）"""
+    decomposed = unicodedata.normalize('NFKD', token)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).upper()
+
+
+@lru_cache(maxsize=65536)
+def consonant_skeleton(token):
+    """子音骨架鍵：所有字母（含首字母）皆以 Soundex 分組編碼並合併重複
+
+    MOHAMMED / MUHAMMAD / MOHAMAD 皆為 "53"，QADIR / KADIR 皆為 "236"
+    """
+    folded = _ascii_fold(token)
+    codes = []
+    for ch in folded:
+        code = _SOUNDEX_CODES.get(ch)
+        if code is None:
+            if not ('A' <= ch <= 'Z'):
+                # 非拉丁字母（如中文）無法語音編碼，以原字串作為鍵
+                return folded
+            continue
+        if not codes or codes[-1] != code:
+            codes.append(code)
+    return ''.join(codes) or folded[:1]
+
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    """Jaro-Winkler 相似度（0.0 ~ 1.0）"""
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+
+    window = max(0, max(len_a, len_b) // 2 - 1)
+    matched_b = [False] * len_b
+    a_matches = []
+    for i, ch in enumerate(a):
+        lo, hi = max(0, i - window), min(len_b, i + window + 1)
+        j = b.find(ch, lo, hi)
+        while j != -1 and matched_b[j]:
+            j = b.find(ch, j + 1, hi)
+        if j != -1:
+            matched_b[j] = True
+            a_matches.append(ch)
+    matches = len(a_matches)
+    if not matches:
+        return 0.0
+
+    b_matches = [b[j] for j in range(len_b) if matched_b[j]]
+    transpositions = sum(x != y for x, y in zip(a_matches, b_matches)) // 2
+    jaro = (matches / len_a + matches / len_b + (matches - transpositions) / matches) / 3
+
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+@lru_cache(maxsize=65536)
+def token_similarity(a, b):
+    """詞元相似度：Jaro-Winkler 與語音鍵一致性的加權組合"""
+    if a == b:
+        return 1.0
+    score = JW_WEIGHT * jaro_winkler(a, b)
+    if consonant_skeleton(a) == consonant_skeleton(b):
+        score += PHONETIC_WEIGHT
+    return score
+
+
+def _unique_tokens(name):
+    """不重複的詞元（保留出現順序）"""
+    return tuple(dict.fromkeys(tokenize(name)))
+
+
+def matched_similarity(pairs, n, m):
+    """一對一配對的姓名相似度
+
+    pairs 為 [(詞元分數, 查詢詞元位置, 姓名詞元位置)]，只需包含不低於 TOKEN_MATCH_FLOOR 的配對；
+    依分數由高至低配對，每個詞元最多配對一次，回傳配對分數總和的兩倍除以雙方詞元數 n + m
+    """
+    used_query, used_name, matched = set(), set(), []
+    for score, i, j in sorted(pairs, reverse=True):
+        if score < TOKEN_MATCH_FLOOR:
+            break
+        if i in used_query or j in used_name:
+            continue
+        used_query.add(i)
+        used_name.add(j)
+        matched.append(score)
+    return 2 * math.fsum(matched) / (n + m)
+
+
+def tokens_similarity(query_tokens, name_tokens):
+    """姓名相似度：查詢詞元與姓名詞元一對一配對，雙方未配對的詞元都會拉低分數"""
+    if not query_tokens or not name_tokens:
+        return 0.0
+    name_tokens = list(name_tokens)
+    pairs = [(token_similarity(qt, nt), i, j)
+             for i, qt in enumerate(query_tokens) for j, nt in enumerate(name_tokens)]
+    return matched_similarity(pairs, len(query_tokens), len(name_tokens))
+
+
+def name_similarity(query, name):
+    """兩個姓名字串的相似度（0.0 ~ 1.0）"""
+    return tokens_similarity(_unique_tokens(query), _unique_tokens(name))
+
+
+# 字元多重集合位元遮罩：每個字元的第 k 次出現（k < _MASK_REPEATS）各佔一個位元，
+# 兩個遮罩交集的位元數即為共同字元數（Jaro 配對字元數的上界）；
+# 字元依出現順序配給連續的編號，拉丁字母姓名的遮罩只需約 100 個位元
+_MASK_REPEATS = 3
+_char_slots = {ch: i for i, ch in enumerate("abcdefghijklmnopqrstuvwxyz0123456789")}
+_char_slots_lock = threading.Lock()
+
+
+def _char_slot(ch):
+    slot = _char_slots.get(ch)
+    if slot is None:
+        with _char_slots_lock:
+            slot = _char_slots.setdefault(ch, len(_char_slots))
+    return slot
+
+
+def _char_mask(token):
+    """回傳 (長度, 遮罩, 超出 _MASK_REPEATS 的出現次數)，用於估計分數上界"""
+    mask = 0
+    extra = 0
+    seen = {}
+    for ch in token:
+        k = seen.get(ch, 0)
+        seen[ch] = k + 1
+        if k < _MASK_REPEATS:
+            mask |= 1 << (_char_slot(ch) * _MASK_REPEATS + k)
+        else:
+            extra += 1
+    return len(token), mask, extra
+
+
+def _repeated_skeletons(tokens):
+    """[(語音鍵, r)]：詞元中有 r 個（r >= 2）以上語音鍵相同"""
+    counts = Counter(consonant_skeleton(token) for token in tokens)
+    return [(key, r) for key, count in counts.items() for r in range(2, count + 1)]
+
+
+def _similar_vocabulary(qt, bucket):
+    """語音分桶中與查詢詞元可能配對的詞彙，回傳 {詞元: 分數上界}
+
+    上界以共同字元數估計 Jaro 配對字元數、以共同前綴估計 Winkler 加權，不計算 Jaro-Winkler；
+    bucket 為 [(詞元, _char_mask(詞元))]，桶內詞元的語音鍵都與查詢詞元相同
+    """
+    q_len, q_bits, q_extra = _char_mask(qt)
+    head = qt[:4]
+    bounds = {}
+    for token, (length, bits, extra) in bucket:
+        if token == qt:
+            bounds[token] = 1.0
+            continue
+        common = (q_bits & bits).bit_count() + min(q_extra, extra)
+        if not common:
+            continue
+        prefix = 0
+        for x, y in zip(head, token):
+            if x != y:
+                break
+            prefix += 1
+        jaro = (common / q_len + common / length + 1) / 3
+        bound = JW_WEIGHT * (jaro + prefix * 0.1 * (1 - jaro)) + PHONETIC_WEIGHT
+        if bound >= TOKEN_MATCH_FLOOR:
+            bounds[token] = min(bound, 1.0)
+    return bounds
+
+
+def _rank_candidates(query_tokens, similar, candidates, threshold, limit=None):
+    """為候選記錄 [(doc_id, 詞元)] 評分，similar 為各查詢詞元的相近詞彙 {詞元: 分數上界}
+
+    回傳 [(doc_id, score)]，依分數由高至低、文件 ID 排序；提供 limit 時只回傳前 limit 筆
+    """
+    n = len(query_tokens)
+    # vectors[詞元] = 與各查詢詞元的分數上界，不在 vectors 中的詞元無法配對
+    vectors = {}
+    for i, found in enumerate(similar):
+        for token, bound in found.items():
+            vectors.setdefault(token, [0.0] * n)[i] = bound
+    scored = []
+    for doc_id, tokens in candidates:
+        rows = [vectors.get(token) for token in tokens]
+        matched = [row for row in rows if row]
+        if not matched:
+            continue
+        # 每個配對的分數不超過所在列與所在行的最大值
+        bound = 2 * min(sum(map(max, zip(*matched))), sum(map(max, matched))) / (n + len(tokens))
+        if bound >= threshold - _EPSILON:
+            scored.append((bound, doc_id, tokens, rows))
+    # 依上界由高至低評分，有 limit 時上界低於目前第 limit 高分即可停止
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    results = []
+    top = []   # 目前最高的 limit 個分數（最小堆積）
+    for bound, doc_id, tokens, rows in scored:
+        if limit and len(top) >= limit and bound < top[0] - _EPSILON:
+            break
+        pairs = [(token_similarity(query_tokens[i], tokens[j]), i, j)
+                 for j, row in enumerate(rows) if row
+                 for i, value in enumerate(row) if value >= TOKEN_MATCH_FLOOR]
+        score = matched_similarity(pairs, n, len(tokens))
+        if score >= threshold:
+            results.append((doc_id, score))
+            if limit:
+                if len(top) < limit:
+                    heapq.heappush(top, score)
+                elif score > top[0]:
+                    heapq.heapreplace(top, score)
+
+    results.sort(key=lambda item: (-item[1], item[0]))
+    return results[:limit] if limit else results
+
+
+class FuzzyIndex:
+    """詞彙索引：語音鍵 -> 詞彙、詞彙 -> 文件、詞元數 -> 文件（執行緒安全）
+
+    search 回傳的記錄與分數和逐筆執行 name_similarity 完全相同。TOKEN_MATCH_FLOOR 高於 JW_WEIGHT，
+    只有語音鍵相同的詞元能配對；n 個查詢詞元與 m 個姓名詞元的記錄要達到門檻 T，
+    配對分數總和至少 T * (n + m) / 2，而每個配對最多 1 分，因此至少需要 k = ceil(T * (n + m) / 2)
+    個查詢詞元各自在記錄中找到可配對的詞元（k 超過 min(n, m) 的詞元數整批排除）。
+    候選記錄以詞元數分組，用集合交集找出涵蓋至少 k 個查詢詞元的記錄
+    （語音鍵相同的多個查詢詞元需要記錄中同樣多個不同的詞元，先以 _repeated_docs 縮小範圍）；
+    只在產生候選記錄時持鎖，評分在鎖外依分數上界由高至低進行，有 limit 時取得前 limit 筆即停止
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._doc_tokens = {}                 # doc_id -> 不重複的詞元 tuple
+        self._token_docs = defaultdict(set)   # 詞元 -> {doc_id}
+        self._size_docs = defaultdict(set)    # 詞元數 -> {doc_id}
+        self._repeated_docs = defaultdict(set)   # (語音鍵, r) -> 含 r 個以上該語音鍵詞元的 {doc_id}
+        self._buckets = defaultdict(dict)     # 語音鍵 -> {詞元: _char_mask(詞元)}
+        # 查詢詞元 -> (詞彙版本, _similar_vocabulary 結果)；常見姓名詞元（如 MOHAMMED）的分桶很大，
+        # 重複掃描是查詢的主要成本，詞彙增減時版本遞增使快取失效
+        self._vocabulary_version = 0
+        self._similar_cache = {}
+        # (查詢詞元數, 門檻) -> (記錄版本, {所需單位數: 記錄})；記錄增減時版本遞增使快取失效
+        self._docs_version = 0
+        self._plan_cache = {}
+
+    def load(self, documents):
+        """以 (doc_id, name) 清單重建整個索引"""
+        doc_tokens, token_docs, size_docs, buckets = {}, defaultdict(set), defaultdict(set), defaultdict(dict)
+        repeated_docs = defaultdict(set)
+        for doc_id, name in documents:
+            tokens = _unique_tokens(name)
+            doc_tokens[doc_id] = tokens
+            size_docs[len(tokens)].add(doc_id)
+            for repeated in _repeated_skeletons(tokens):
+                repeated_docs[repeated].add(doc_id)
+            for token in tokens:
+                if token not in token_docs:
+                    buckets[consonant_skeleton(token)][token] = _char_mask(token)
+                token_docs[token].add(doc_id)
+
+        with self._lock:
+            self._doc_tokens, self._token_docs, self._size_docs = doc_tokens, token_docs, size_docs
+            self._repeated_docs, self._buckets = repeated_docs, buckets
+            self._vocabulary_version += 1
+            self._docs_version += 1
+            self._similar_cache = {}
+
+    def upsert(self, doc_id, name):
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._docs_version += 1
+            tokens = _unique_tokens(name)
+            self._doc_tokens[doc_id] = tokens
+            self._size_docs[len(tokens)].add(doc_id)
+            for repeated in _repeated_skeletons(tokens):
+                self._repeated_docs[repeated].add(doc_id)
+            for token in tokens:
+                if token not in self._token_docs:
+                    self._buckets[consonant_skeleton(token)][token] = _char_mask(token)
+                    self._vocabulary_version += 1
+                self._token_docs[token].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._docs_version += 1
+
+    def _remove_locked(self, doc_id):
+        tokens = self._doc_tokens.pop(doc_id, None)
+        if tokens is None:
+            return
+        size = self._size_docs.get(len(tokens))
+        if size is not None:
+            size.discard(doc_id)
+            if not size:
+                del self._size_docs[len(tokens)]
+        for repeated in _repeated_skeletons(tokens):
+            docs = self._repeated_docs.get(repeated)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self._repeated_docs[repeated]
+        for token in tokens:
+            docs = self._token_docs.get(token)
+            if docs is None:
+                continue
+            docs.discard(doc_id)
+            if not docs:
+                del self._token_docs[token]
+                self._vocabulary_version += 1
+                key = consonant_skeleton(token)
+                del self._buckets[key][token]
+                if not self._buckets[key]:
+                    del self._buckets[key]
+
+    def _similar_locked(self, query_tokens):
+        """取出快取的相近詞彙；未命中的查詢詞元以 None 表示，並回傳其語音分桶的複本 {語音鍵: 詞彙}，留待鎖外計算"""
+        version = self._vocabulary_version
+        similar, buckets = [], {}
+        for qt in query_tokens:
+            entry = self._similar_cache.get(qt)
+            if entry is not None and entry[0] == version:
+                similar.append(entry[1])
+                continue
+            similar.append(None)
+            key = consonant_skeleton(qt)
+            if key not in buckets:
+                buckets[key] = list(self._buckets.get(key, {}).items())
+        return version, similar, buckets
+
+    def _cache_similar_locked(self, computed, version):
+        if version != self._vocabulary_version:
+            return
+        for qt, found in computed.items():
+            if len(self._similar_cache) >= VOCABULARY_CACHE_SIZE:
+                # 依放入順序淘汰最舊的項目
+                self._similar_cache.pop(next(iter(self._similar_cache)))
+            self._similar_cache[qt] = (version, found)
+
+    def _docs_with_locked(self, unit, within, postings):
+        """within 中含有 unit = (語音鍵, 相近詞彙, count) 至少 count 個不同相近詞彙的記錄
+
+        postings 為相近詞彙涵蓋的文件數總和
+        """
+        key, tokens, count = unit
+        if count > 1:
+            # 相近詞彙的語音鍵都是 key，先以 _repeated_docs 縮小範圍
+            within = within & self._repeated_docs.get((key, count), set())
+        elif len(within) * _SCAN_COST >= postings:
+            docs = set()
+            for token in tokens:
+                postings = self._token_docs.get(token)
+                if postings:
+                    docs |= postings & within
+            return docs
+        # within 已經很小時逐筆檢查其詞元，比處理相近詞彙的所有文件集合便宜
+        doc_tokens = self._doc_tokens
+        return {doc_id for doc_id in within
+                if sum(token in tokens for token in doc_tokens[doc_id]) >= count}
+
+    def _covering_locked(self, units, postings, k, within):
+        """within 中至少涵蓋 k 個單位的記錄
+
+        units 為 [(語音鍵, 相近詞彙, 所需詞元數)]，同一組查詢詞元的單位共用同一個語音鍵與相近詞彙，
+        所需詞元數較多的單位隱含較少的單位；postings 為各單位相近詞彙涵蓋的文件數總和
+        """
+        n = len(units)
+        if math.comb(n, k) > n:
+            # 組合過多（長查詢、低門檻）時改為逐筆計數
+            counts = Counter()
+            for unit, total in zip(units, postings):
+                counts.update(self._docs_with_locked(unit, within, total))
+            return {doc_id for doc_id, covered in counts.items() if covered >= k}
+
+        # 由涵蓋文件數最少的單位開始逐一取交集，共用相同前綴的交集結果；
+        # 同一組內所需詞元數多的單位排在前面，其後同組的單位不必再篩選
+        order = sorted(range(n), key=lambda i: (postings[i], -units[i][2]))
+        partial = {(): within}
+        survivors = set()
+        for combination in itertools.combinations(order, k):
+            for depth in range(1, k + 1):
+                prefix = combination[:depth]
+                docs = partial.get(prefix)
+                if docs is None:
+                    unit = units[prefix[-1]]
+                    docs = partial[prefix[:-1]]
+                    if not any(units[i][0] == unit[0] for i in prefix[:-1]):
+                        docs = self._docs_with_locked(unit, docs, postings[prefix[-1]])
+                    partial[prefix] = docs
+                if not docs:
+                    break
+            survivors |= docs
+        return survivors
+
+    def _plan_locked(self, n, threshold):
+        """{所需單位數 k: 記錄}：依詞元數 m 算出 k，k 超過 min(n, m) 的詞元數不列入"""
+        entry = self._plan_cache.get((n, threshold))
+        if entry is not None and entry[0] == self._docs_version:
+            return entry[1]
+        plan = defaultdict(set)
+        for size, docs in self._size_docs.items():
+            needed = max(1, math.ceil(threshold * (n + size) / 2 - _EPSILON))
+            if needed <= min(n, size):
+                plan[needed] |= docs
+        if len(self._plan_cache) >= VOCABULARY_CACHE_SIZE:
+            self._plan_cache.clear()
+        self._plan_cache[(n, threshold)] = (self._docs_version, plan)
+        return plan
+
+    def _candidates_locked(self, units, n, threshold):
+        """以集合運算產生涵蓋足夠單位的候選記錄，回傳 [(doc_id, 詞元)]"""
+        token_docs = self._token_docs
+        postings = [sum(len(token_docs.get(token, ())) for token in tokens) for _, tokens, _ in units]
+        survivors = set()
+        for needed, within in self._plan_locked(n, threshold).items():
+            survivors |= self._covering_locked(units, postings, needed, within)
+        doc_tokens = self._doc_tokens
+        return [(doc_id, doc_tokens[doc_id]) for doc_id in survivors]
+
+    def search(self, query, threshold=DEFAULT_THRESHOLD, limit=None):
+        """回傳 [(doc_id, score)]，依分數由高至低、文件 ID 排序；提供 limit 時只回傳前 limit 筆"""
+        return self.search_many([query], threshold, limit)[0]
+
+    def search_many(self, queries, threshold=DEFAULT_THRESHOLD, limit=None):
+        """批次查詢，回傳與 queries 對應的 search 結果清單
+
+        每個語音分桶只複製與掃描一次；語音鍵組合相同的查詢（如 MOHAMMED ALI 與 MUHAMMAD ALY）
+        合為一組，以各查詢相近詞彙的聯集只做一次集合運算產生共用的候選記錄，再逐一查詢評分
+        """
+        query_tokens = [_unique_tokens(query) for query in queries]
+        distinct = list(dict.fromkeys(qt for tokens in query_tokens for qt in tokens))
+
+        # 第一段持鎖：取出快取的相近詞彙，未命中的複製語音分桶後在鎖外計算
+        with self._lock:
+            version, found_list, buckets = self._similar_locked(distinct)
+        similar, computed = {}, {}
+        for qt, found in zip(distinct, found_list):
+            if found is None:
+                found = computed[qt] = _similar_vocabulary(qt, buckets[consonant_skeleton(qt)])
+            similar[qt] = found
+        with self._lock:
+            self._cache_similar_locked(computed, version)
+
+        groups = defaultdict(list)   # 查詢詞元的語音鍵組合 -> [查詢位置]
+        for position, tokens in enumerate(query_tokens):
+            if tokens:
+                groups[tuple(sorted(consonant_skeleton(qt) for qt in tokens))].append(position)
+
+        results = [[] for _ in queries]
+        for signature, positions in groups.items():
+            # 語音鍵相同的查詢詞元合為一組：出現 c 次的組需要記錄中 c 個不同的相近詞元才能全部配對，
+            # 拆成「至少 1 個」到「至少 c 個」共 c 個單位，記錄涵蓋的單位數即為可配對的查詢詞元數上限
+            vocabulary = defaultdict(list)
+            for position in positions:
+                for qt in query_tokens[position]:
+                    vocabulary[consonant_skeleton(qt)].append(similar[qt])
+            units = []
+            for key, found_list in vocabulary.items():
+                tokens = found_list[0] if len(found_list) == 1 else set().union(*found_list)
+                units.extend((key, tokens, count) for count in range(1, signature.count(key) + 1))
+
+            # 每組各持鎖一次產生候選記錄並複製其詞元，評分在鎖外進行
+            with self._lock:
+                candidates = self._candidates_locked(units, len(signature), threshold)
+            for position in positions:
+                tokens = query_tokens[position]
+                results[position] = _rank_candidates(tokens, [similar[qt] for qt in tokens],
+                                                     candidates, threshold, limit)
+        return results
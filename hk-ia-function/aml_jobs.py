@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+背景工作執行器
+/update 只負責提交工作並立即回傳工作 ID，實際更新在專用的背景執行緒中執行；
+同一時間只執行一個工作，執行中以相同參數再次提交時回傳同一個工作，不重複啟動；
+參數不同時不附加也不排隊，由呼叫端回報衝突
+"""
+
+import copy
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def _snapshot(job):
+    """回傳可直接序列化的工作狀態副本（移除內部計時欄位）"""
+    job = copy.deepcopy(job)
+    for stage in job["stages"]:
+        stage.pop("_started", None)
+    return job
+
+
+class BackgroundJobRunner:
+    """單一背景執行緒的工作佇列（執行緒安全）
+
+    work(params, report) 為實際執行的函式，回傳值存入工作的 result；
+    執行期間可呼叫 report(stage=..., **counts) 回報目前階段與計數
+    """
+
+    def __init__(self, work, name="background-job", history=50):
+        self._work = work
+        self._name = name
+        self._history = history
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()   # job_id -> 工作狀態
+        self._active_id = None
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def submit(self, **params):
+        """提交工作，回傳 (工作狀態快照, 結果)
+
+        結果為 "created"（新工作）、"attached"（參數相同，附加到執行中的工作）
+        或 "conflict"（已有參數不同的工作執行中，快照為該工作，本次提交未執行）
+        """
+        with self._lock:
+            if self._active_id is not None:
+                active = self._jobs[self._active_id]
+                return _snapshot(active), "attached" if active["params"] == params else "conflict"
+
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "stage": "queued",
+                "params": params,
+                "counts": {},
+                "stages": [],
+                "result": None,
+                "error": None,
+                "created_at": _now(),
+                "started_at": None,
+                "finished_at": None,
+                "duration_seconds": None
+            }
+            self._active_id = job_id
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_forever, name=self._name, daemon=True)
+                self._worker.start()
+            self._queue.put(job_id)
+            return _snapshot(self._jobs[job_id]), "created"
+
+    def get(self, job_id):
+        """工作狀態快照，找不到時回傳 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return _snapshot(job) if job is not None else None
+
+    def active(self):
+        """執行中（或排隊中）的工作快照"""
+        with self._lock:
+            return _snapshot(self._jobs[self._active_id]) if self._active_id else None
+
+    def _report(self, job_id, stage=None, **counts):
+        with self._lock:
+            job = self._jobs[job_id]
+            if stage and stage != job["stage"]:
+                now = time.monotonic()
+                if job["stages"]:
+                    last = job["stages"][-1]
+                    last["duration_seconds"] = round(now - last.pop("_started"), 3)
+                job["stages"].append({"name": stage, "started_at": _now(), "_started": now})
+                job["stage"] = stage
+            job["counts"].update(counts)
+
+    def _finish(self, job_id, started, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stages"] and "_started" in job["stages"][-1]:
+                last = job["stages"][-1]
+                last["duration_seconds"] = round(time.monotonic() - last.pop("_started"), 3)
+            job["status"] = status
+            job["stage"] = "done" if status == "succeeded" else status
+            job["result"] = result
+            job["error"] = error
+            job["finished_at"] = _now()
+            job["duration_seconds"] = round(time.monotonic() - started, 3)
+            self._active_id = None
+
+    def _run_forever(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs[job_id]
+                job["status"] = "running"
+                job["started_at"] = _now()
+                params = dict(job["params"])
+            started = time.monotonic()
+
+            def report(stage=None, **counts):
+                self._report(job_id, stage, **counts)
+
+            try:
+                result = self._work(params, report)
+            except Exception as e:
+                print(f"❌ 背景工作 {job_id} 失敗: {e}")
+                self._finish(job_id, started, "failed", error=str(e))
+            else:
+                succeeded = not (isinstance(result, dict) and result.get("success") is False)
+                self._finish(job_id, started, "succeeded" if succeeded else "failed", result=result,
+                             error=None if succeeded else (result.get("message") or result.get("error")))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+AML 姓名記憶體索引
+將 aml_profiles 集合快照保存在行程記憶體中，並以 n-gram 倒排索引加速子字串查詢
+"""
+
+import threading
+import unicodedata
+from collections import defaultdict
+
+from aml_nationality import nationality_code
+
+NGRAM_SIZE = 3
+
+
+def normalize_name(name):
+    """標準化姓名：NFKC、大小寫摺疊、合併空白"""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKC', str(name)).casefold()
+    return ' '.join(name.split())
+
+
+def name_ngrams(normalized, n=NGRAM_SIZE):
+    """取得已標準化字串的所有 n-gram（去重）"""
+    if len(normalized) < n:
+        return set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+
+def name_trigrams(name):
+    """計算寫入 Firestore 的 name_trigrams 欄位（排序後的三元組陣列）"""
+    return sorted(name_ngrams(normalize_name(name), 3))
+
+
+def profile_search_fields(name):
+    """寫入 aml_profiles 文件時需一併儲存的搜尋欄位"""
+    return {
+        'name_normalized': normalize_name(name),
+        'name_trigrams': name_trigrams(name),
+    }
+
+
+def profile_query_fields(data):
+    """由原始欄位推導、供查詢使用的所有欄位（姓名搜尋欄位與 nationality_code）"""
+    fields = profile_search_fields(data.get('name', ''))
+    fields['nationality_code'] = nationality_code(data.get('nationality'))
+    return fields
+
+
+def backfill_query_fields(db, collection_name, batch_size=500):
+    """為缺少或過期的文件補寫查詢欄位，回傳更新筆數
+
+    未經 migrate_aml_data.py 寫入的文件（例如 /update 更新器新增的記錄）不會有這些欄位，
+    國籍過濾與姓名搜尋都依賴它們，寫入後需執行一次
+    """
+    batch = db.batch()
+    pending = 0
+    updated = 0
+
+    for doc in db.collection(collection_name).stream():
+        data = doc.to_dict() or {}
+        fields = profile_query_fields(data)
+        if all(data.get(key) == value for key, value in fields.items()):
+            continue
+
+        batch.update(doc.reference, fields)
+        pending += 1
+        updated += 1
+
+        if pending >= batch_size:
+            batch.commit()
+            print(f"✅ 已補寫 {updated} 筆查詢欄位")
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+    return updated
+
+
+class NameIndex:
+    """以 n-gram 倒排索引為基礎的姓名子字串查詢索引（執行緒安全）"""
+
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self._lock = threading.Lock()
+        self._docs = {}        # doc_id -> 文件資料
+        self._names = {}       # doc_id -> 標準化姓名
+        self._postings = defaultdict(set)  # n-gram -> {doc_id}
+        self.ready = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def load(self, documents):
+        """以 (doc_id, data) 清單重建整個索引"""
+        docs, names, postings = {}, {}, defaultdict(set)
+        for doc_id, data in documents:
+            normalized = normalize_name(data.get('name', ''))
+            docs[doc_id] = data
+            names[doc_id] = normalized
+            for gram in name_ngrams(normalized, self.n):
+                postings[gram].add(doc_id)
+
+        with self._lock:
+            self._docs, self._names, self._postings = docs, names, postings
+            self.ready = True
+
+    def upsert(self, doc_id, data):
+        """新增或更新單筆文件"""
+        with self._lock:
+            self._remove_locked(doc_id)
+            normalized = normalize_name(data.get('name', ''))
+            self._docs[doc_id] = data
+            self._names[doc_id] = normalized
+            for gram in name_ngrams(normalized, self.n):
+                self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        """移除單筆文件"""
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id):
+        normalized = self._names.pop(doc_id, None)
+        self._docs.pop(doc_id, None)
+        if normalized is None:
+            return
+        for gram in name_ngrams(normalized, self.n):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def get(self, doc_id):
+        """依文件 ID 取得資料"""
+        with self._lock:
+            return self._docs.get(doc_id)
+
+    def items(self):
+        """目前索引內容的快照，回傳依文件 ID 排序的 (doc_id, data) 清單"""
+        with self._lock:
+            return sorted(self._docs.items())
+
+    def search(self, name):
+        """子字串查詢，回傳依文件 ID 排序的 (doc_id, data) 清單"""
+        query = normalize_name(name)
+        if not query:
+            return []
+
+        with self._lock:
+            grams = name_ngrams(query, self.n)
+            if grams:
+                # 由最小的倒排列表開始求交集，再以子字串比對排除誤判
+                postings = sorted((self._postings.get(g, ()) for g in grams), key=len)
+                if not postings[0]:
+                    return []
+                candidates = set(postings[0])
+                for posting in postings[1:]:
+                    candidates &= posting
+                    if not candidates:
+                        return []
+            else:
+                # 查詢字串短於 n-gram 長度時直接掃描記憶體中的姓名
+                candidates = self._names.keys()
+
+            matched = [doc_id for doc_id in candidates if query in self._names[doc_id]]
+            matched.sort()
+            return [(doc_id, self._docs[doc_id]) for doc_id in matched]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+國籍標準化
+將制裁名單 PDF 中各種寫法的國籍（Iraq / Iraqi / Syrian Arab Republic ...）
+轉換為標準代碼（ISO 3166-1 alpha-2），寫入 aml_profiles 的 nationality_code 欄位
+"""
+
+import re
+import unicodedata
+
+UNKNOWN_CODE = "UNKNOWN"
+
+# 標準代碼 -> (顯示名稱, 其他寫法)
+_COUNTRIES = {
+    "AF": ("Afghanistan", ("afghan",)),
+    "DZ": ("Algeria", ("algerian",)),
+    "AU": ("Australia", ("australian",)),
+    "AZ": ("Azerbaijan", ("azerbaijani",)),
+    "BH": ("Bahrain", ("bahraini",)),
+    "BD": ("Bangladesh", ("bangladeshi",)),
+    "BE": ("Belgium", ("belgian",)),
+    "BA": ("Bosnia and Herzegovina", ("bosnia", "bosnian")),
+    "CA": ("Canada", ("canadian",)),
+    "CF": ("Central African Republic", ()),
+    "TD": ("Chad", ("chadian",)),
+    "CN": ("China", ("chinese",)),
+    "CD": ("Democratic Republic of the Congo", ("democratic republic of congo", "drc")),
+    "CG": ("Congo", ("republic of the congo",)),
+    "DK": ("Denmark", ("danish",)),
+    "EG": ("Egypt", ("egyptian",)),
+    "ER": ("Eritrea", ("eritrean",)),
+    "ET": ("Ethiopia", ("ethiopian",)),
+    "FR": ("France", ("french",)),
+    "GE": ("Georgia", ("georgian",)),
+    "DE": ("Germany", ("german",)),
+    "IN": ("India", ("indian",)),
+    "ID": ("Indonesia", ("indonesian",)),
+    "IR": ("Iran", ("iran islamic republic of", "islamic republic of iran", "iranian")),
+    "IQ": ("Iraq", ("iraqi",)),
+    "IT": ("Italy", ("italian",)),
+    "JO": ("Jordan", ("jordanian",)),
+    "KZ": ("Kazakhstan", ("kazakh",)),
+    "KE": ("Kenya", ("kenyan",)),
+    "KP": ("Democratic People's Republic of Korea", (
+        "democratic people", "democratic peoples republic of korea", "north korea", "dprk")),
+    "KW": ("Kuwait", ("kuwaiti",)),
+    "KG": ("Kyrgyzstan", ("kyrgyz",)),
+    "LB": ("Lebanon", ("lebanese",)),
+    "LY": ("Libya", ("libyan", "libyan arab jamahiriya")),
+    "MY": ("Malaysia", ("malaysian",)),
+    "MV": ("Maldives", ("maldivian",)),
+    "ML": ("Mali", ("malian",)),
+    "MR": ("Mauritania", ("mauritanian",)),
+    "MA": ("Morocco", ("moroccan",)),
+    "NL": ("Netherlands", ("dutch",)),
+    "NE": ("Niger", ("nigerien",)),
+    "NG": ("Nigeria", ("nigerian",)),
+    "NO": ("Norway", ("norwegian",)),
+    "OM": ("Oman", ("omani",)),
+    "PK": ("Pakistan", ("pakistani",)),
+    "PS": ("State of Palestine", ("palestine", "palestinian")),
+    "PH": ("Philippines", ("filipino", "philippine")),
+    "QA": ("Qatar", ("qatari",)),
+    "RU": ("Russian Federation", ("russia", "russian")),
+    "SA": ("Saudi Arabia", ("saudi", "saudi arabian")),
+    "SO": ("Somalia", ("somali",)),
+    "ES": ("Spain", ("spanish",)),
+    "LK": ("Sri Lanka", ("sri lankan",)),
+    "SD": ("Sudan", ("sudanese",)),
+    "SS": ("South Sudan", ()),
+    "SE": ("Sweden", ("swedish",)),
+    "SY": ("Syrian Arab Republic", ("syria", "syrian")),
+    "TJ": ("Tajikistan", ("tajik",)),
+    "TZ": ("United Republic of Tanzania", ("tanzania", "tanzanian")),
+    "TT": ("Trinidad and Tobago", ("trinidadian",)),
+    "TN": ("Tunisia", ("tunisian",)),
+    "TR": ("Türkiye", ("turkey", "turkiye", "turkish")),
+    "TM": ("Turkmenistan", ("turkmen",)),
+    "UG": ("Uganda", ("ugandan",)),
+    "AE": ("United Arab Emirates", ("uae", "emirati")),
+    "GB": ("United Kingdom", ("united kingdom of great britain and northern ireland", "uk", "british")),
+    "US": ("United States", ("united states of america", "usa", "american")),
+    "UZ": ("Uzbekistan", ("uzbek",)),
+    "YE": ("Yemen", ("yemeni",)),
+}
+
+_UNKNOWN_VALUES = {"", "unknown", "na", "n a", "none", "not available"}
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+
+def _normalize_text(value):
+    """去除變音符號與標點、轉小寫並合併空白"""
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return " ".join(_NON_ALNUM_RE.sub(" ", stripped).split())
+
+
+_ALIASES = {}
+for _code, (_label, _variants) in _COUNTRIES.items():
+    for _variant in (_label,) + _variants:
+        _ALIASES[_normalize_text(_variant)] = _code
+
+
+def nationality_code(value):
+    """將原始國籍字串轉為標準代碼；無法辨識的國籍以標準化後的大寫字串作為代碼"""
+    if value is None:
+        return UNKNOWN_CODE
+    normalized = _normalize_text(value)
+    if normalized in _UNKNOWN_VALUES:
+        return UNKNOWN_CODE
+    if normalized in _ALIASES:
+        return _ALIASES[normalized]
+    # 也接受直接傳入代碼（例如 /profiles?nationality=IQ）
+    if normalized.upper() in _COUNTRIES:
+        return normalized.upper()
+    return normalized.upper().replace(" ", "_")
+
+
+def nationality_label(code):
+    """標準代碼的顯示名稱"""
+    if code in _COUNTRIES:
+        return _COUNTRIES[code][0]
+    if code == UNKNOWN_CODE:
+        return "Unknown"
+    return code.replace("_", " ").title()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+AML 統計摘要文件
+aml_stats/summary 保存總筆數、各年份與各國籍代碼的筆數，由寫入 aml_profiles 的流程在同一批次中累加，
+/stats 只需讀取這一份文件；執行 `python aml_stats.py --rebuild` 可從頭重算以修正誤差。
+摘要中的 version 為資料集版本號，每次寫入都會遞增，供查詢快取判斷失效
+"""
+
+import os
+import sys
+from datetime import datetime
+from google.cloud import firestore
+from aml_nationality import nationality_code, nationality_label
+
+STATS_COLLECTION = "aml_stats"
+SUMMARY_DOC = "summary"
+PROFILES_COLLECTION = "aml_profiles"
+
+
+def summary_ref(db):
+    """統計摘要文件參照"""
+    return db.collection(STATS_COLLECTION).document(SUMMARY_DOC)
+
+
+def record_profiles_added(batch, db, total, year_counts, nationality_counts=None):
+    """在寫入 profiles 的同一個 batch / transaction 中累加統計
+
+    total: 新增筆數；year_counts: {year: 該年新增筆數}；
+    nationality_counts: {nationality_code: 該國籍新增筆數}
+    """
+    if not total:
+        return
+    summary = {
+        'total_profiles': firestore.Increment(total),
+        'years': {str(year): firestore.Increment(count) for year, count in year_counts.items()},
+        'version': firestore.Increment(1),
+        'updated_at': datetime.utcnow().isoformat()
+    }
+    if nationality_counts:
+        summary['nationalities'] = {
+            code: firestore.Increment(count) for code, count in nationality_counts.items()
+        }
+    batch.set(summary_ref(db), summary, merge=True)
+
+
+def rebuild_stats(db, collection_name=PROFILES_COLLECTION):
+    """串流整個集合（只取統計所需欄位）重新計算統計摘要"""
+    year_counts = {}
+    nationality_counts = {}
+    total = 0
+    fields = ['year', 'nationality', 'nationality_code']
+    for doc in db.collection(collection_name).select(fields).stream():
+        total += 1
+        data = doc.to_dict() or {}
+        year = data.get('year')
+        if year:
+            year_counts[str(year)] = year_counts.get(str(year), 0) + 1
+        code = data.get('nationality_code') or nationality_code(data.get('nationality'))
+        nationality_counts[code] = nationality_counts.get(code, 0) + 1
+
+    summary = {
+        'total_profiles': total,
+        'years': year_counts,
+        'nationalities': nationality_counts,
+        'updated_at': datetime.utcnow().isoformat(),
+        'rebuilt_at': datetime.utcnow().isoformat()
+    }
+
+    # 覆寫摘要時保留並遞增資料集版本號
+    @firestore.transactional
+    def write_summary(transaction):
+        snapshot = summary_ref(db).get(transaction=transaction)
+        previous = (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+        summary['version'] = previous + 1
+        transaction.set(summary_ref(db), summary)
+
+    write_summary(db.transaction())
+    return summary
+
+
+def bump_dataset_version(db):
+    """只遞增資料集版本號（寫入 profiles 但未更新統計時使用）"""
+    summary_ref(db).set({
+        'version': firestore.Increment(1),
+        'updated_at': datetime.utcnow().isoformat()
+    }, merge=True)
+
+
+def summary_to_stats(summary):
+    """將摘要文件轉換為 /stats 回應格式"""
+    year_stats = []
+    for year, count in (summary.get('years') or {}).items():
+        if not count:
+            continue
+        year_stats.append({"year": int(year) if str(year).isdigit() else year, "count": count})
+    year_stats.sort(key=lambda item: str(item["year"]), reverse=True)
+
+    return {
+        "total_profiles": summary.get('total_profiles', 0),
+        "year_stats": year_stats
+    }
+
+
+def summary_to_facets(summary):
+    """將摘要文件轉換為 /facets/nationality 回應格式（依筆數由多至少）"""
+    facets = [
+        {"code": code, "label": nationality_label(code), "count": count}
+        for code, count in (summary.get('nationalities') or {}).items()
+        if count
+    ]
+    facets.sort(key=lambda item: (-item["count"], item["code"]))
+    return facets
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print("用法: python aml_stats.py --rebuild [--production]")
+        sys.exit(1)
+
+    if "--production" not in sys.argv[1:]:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = "127.0.0.1:8081"
+
+    client = firestore.Client(project="hk-insurance-crawler")
+    print("🔄 重新計算 AML 統計摘要...")
+    result = rebuild_stats(client)
+    print(f"✅ 完成：共 {result['total_profiles']} 筆記錄，{len(result['years'])} 個年份")
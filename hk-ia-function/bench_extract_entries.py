@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+extract_sanction_entries 微基準測試
+以 bench_data/circular_text_sample.txt 的通告文字為語料，
+比較改寫前後的輸出是否逐字相同，並量測每秒處理行數
+
+用法: python bench_extract_entries.py [重複次數]
+"""
+
+import os
+import sys
+import time
+from takepdf import extract_sanction_entries, finalize_entry
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data", "circular_text_sample.txt")
+
+
+def legacy_extract_sanction_entries(text):
+    """改寫前的 extract_sanction_entries（逐字保留，作為輸出與速度的比較基準）"""
+    import re
+    
+    entries = []
+    lines = text.split('\n')
+    current_entry = None
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        
+        # 檢查是否是新條目開始 (QDi.XXX 格式)
+        if re.match(r'^QDi\.\d+', line):
+            # 保存前一個條目
+            if current_entry:
+                entries.append(finalize_entry(current_entry))
+            
+            # 開始新條目
+            current_entry = {
+                'name': '',
+                'nationality': 'Unknown',
+                'passport_no': 'na',
+                'raw_text': line
+            }
+            
+            # 提取姓名 - 更靈活的模式
+            name_patterns = [
+                r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|$)',
+                r'Name:\s*1:\s*(\w+)\s*2:\s*(\w*)\s*3:\s*(\w*)\s*4:\s*(\w*)',
+                r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|$)'
+            ]
+            
+            for pattern in name_patterns:
+                name_match = re.search(pattern, line)
+                if name_match:
+                    if len(name_match.groups()) > 1:
+                        # 多個組的情況
+                        name_parts = [part.strip() for part in name_match.groups() if part and part.strip()]
+                        current_entry['name'] = ' '.join(name_parts)
+                    else:
+                        # 單個組的情況
+                        current_entry['name'] = name_match.group(1).strip()
+                    break
+        
+        elif current_entry:
+            # 繼續處理當前條目的其他資訊
+            current_entry['raw_text'] += ' ' + line
+            
+            # 如果姓名還沒找到，繼續嘗試
+            if not current_entry['name']:
+                name_patterns = [
+                    r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|Nationality:|$)',
+                    r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|Nationality:|$)'
+                ]
+                for pattern in name_patterns:
+                    name_match = re.search(pattern, line)
+                    if name_match:
+                        if len(name_match.groups()) > 1:
+                            name_parts = [part.strip() for part in name_match.groups() if part and part.strip()]
+                            current_entry['name'] = ' '.join(name_parts)
+                        else:
+                            current_entry['name'] = name_match.group(1).strip()
+                        break
+            
+            # 提取國籍
+            nationality_match = re.search(r'Nationality:\s*([A-Za-z\s]+?)(?:\s+Passport|\s+National|\s+Address|\s+Listed|$)', line)
+            if nationality_match:
+                current_entry['nationality'] = nationality_match.group(1).strip()
+            
+            # 提取護照號碼 (多種格式)
+            passport_patterns = [
+                r'Passport no:\s*([^\s]+(?:\s+number\s+[^\s]+)?)',
+                r'Passport number\s*([^\s]+)',
+                r'Passport:\s*([^\s]+)'
+            ]
+            for pattern in passport_patterns:
+                passport_match = re.search(pattern, line, re.IGNORECASE)
+                if passport_match:
+                    passport_value = passport_match.group(1).strip()
+                    if passport_value.lower() not in ['na', 'n/a', '']:
+                        current_entry['passport_no'] = passport_value
+                    break
+    
+    # 處理最後一個條目
+    if current_entry:
+        entries.append(finalize_entry(current_entry))
+    
+    return entries
+
+
+def bench(func, text, repeat):
+    """回傳最佳一輪的每秒行數"""
+    line_count = text.count('\n') + 1
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return line_count / best
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        text = f.read()
+    
+    # 依頁面切分與整份語料兩種輸入都需逐字相同
+    pages = text.split('\n\n')
+    for sample in [text] + pages:
+        expected = repr(legacy_extract_sanction_entries(sample))
+        actual = repr(extract_sanction_entries(sample))
+        if expected != actual:
+            print("❌ 輸出與改寫前不同")
+            sys.exit(1)
+    entries = extract_sanction_entries(text)
+    print(f"✅ 輸出逐字相同：{text.count(chr(10))} 行、{len(entries)} 個條目、{len(pages)} 個頁面樣本")
+    
+    before = bench(legacy_extract_sanction_entries, text, repeat)
+    after = bench(extract_sanction_entries, text, repeat)
+    print(f"📊 改寫前: {before:,.0f} 行/秒")
+    print(f"📊 改寫後: {after:,.0f} 行/秒")
+    print(f"🚀 加速 {after / before:.2f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+FuzzyIndex 模糊比對基準測試
+以合成的制裁名單姓名（常見姓名與音節組成的詞彙依 Zipf 分布出現，並加入拼寫變體）建立索引，
+量測 FuzzyIndex.search 的 p50 / p99 延遲，並與逐筆 name_similarity 評分比較召回率與分數
+
+用法: python bench_fuzzy_search.py [記錄數] [查詢數] [門檻] [每個查詢最多回傳筆數]
+"""
+
+import random
+import sys
+import time
+
+from aml_fuzzy import FuzzyIndex, name_similarity, DEFAULT_THRESHOLD
+
+# 最常見的姓名詞元，排在詞彙表最前面（Zipf 分布下出現次數最多）
+COMMON_TOKENS = (
+    "mohammed", "ahmed", "ali", "hassan", "hussein", "abdul", "abdullah", "omar", "khalid", "yusuf",
+    "ibrahim", "ismail", "mustafa", "saleh", "salem", "nasser", "hamid", "rashid", "karim", "tariq",
+    "qadir", "rahman", "aziz", "jamal", "faisal", "said", "bakr", "zubair", "anwar", "latif",
+    "haqqani", "mansour", "farouk", "sharif", "suleiman", "jaber", "hadi", "kamal", "walid", "sami",
+    "al", "bin", "abu", "el", "zadeh", "khan", "shah", "mirza", "baig", "qureshi",
+)
+
+_SYLLABLES = (
+    "ab", "ad", "al", "am", "an", "ar", "as", "az", "ba", "da", "di", "fa", "ga", "ha", "hu", "ja",
+    "ka", "ki", "la", "ma", "mi", "mu", "na", "ni", "ra", "ri", "sa", "sha", "si", "ta", "ti", "ul",
+    "wa", "ya", "yu", "za", "zi", "dir", "din", "man", "mir", "nur", "rah", "sul", "tan", "vic", "kov",
+)
+
+_VOWELS = "aeiou"
+
+
+def synthetic_vocabulary(size, seed=0):
+    """詞彙表：常見姓名詞元在前，其後為以音節組成的姓名詞元"""
+    rng = random.Random(seed)
+    vocabulary = list(COMMON_TOKENS)
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        token = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if token not in seen:
+            seen.add(token)
+            vocabulary.append(token)
+    return vocabulary
+
+
+def _variant(token, rng):
+    """產生拼寫變體：替換母音、重複或刪除字母"""
+    chars = list(token)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.5 and chars[i] in _VOWELS:
+            chars[i] = rng.choice(_VOWELS)
+        elif op < 0.75:
+            chars.insert(i, chars[i])
+        elif len(chars) > 3:
+            del chars[i]
+    return "".join(chars)
+
+
+def synthetic_names(count, vocabulary_size=5000, seed=1):
+    """合成姓名：詞元依 Zipf 分布抽樣，約兩成為拼寫變體"""
+    rng = random.Random(seed)
+    vocabulary = synthetic_vocabulary(vocabulary_size)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    names = []
+    for _ in range(count):
+        tokens = rng.choices(vocabulary, weights, k=rng.randint(2, 4))
+        tokens = [_variant(token, rng) if rng.random() < 0.2 else token for token in tokens]
+        names.append(" ".join(tokens).upper())
+    return names
+
+
+def synthetic_queries(names, count, seed=2):
+    """查詢：取既有姓名並對部分詞元加入拼寫變體"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        tokens = rng.choice(names).lower().split()
+        tokens = [_variant(token, rng) if rng.random() < 0.5 else token for token in tokens]
+        queries.append(" ".join(tokens))
+    return queries
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 145000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_THRESHOLD
+    limit = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    names = synthetic_names(count)
+    queries = synthetic_queries(names, query_count)
+
+    index = FuzzyIndex()
+    started = time.perf_counter()
+    index.load(enumerate(names))
+    print(f"📚 {count} 筆記錄，建立索引 {time.perf_counter() - started:.2f} 秒")
+
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(index.search(query, threshold, limit))
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"⏱️ {query_count} 個查詢（threshold={threshold}, limit={limit}）: "
+          f"p50 {percentile(latencies, 50):.1f} ms, p99 {percentile(latencies, 99):.1f} ms")
+
+    # 與逐筆評分比較（只檢查部分查詢，逐筆評分很慢）
+    checked = queries[:min(len(queries), 20)]
+    expected_total = found_total = mismatched = 0
+    for query, hits in zip(checked, results):
+        expected = sorted(((doc_id, score) for doc_id, name in enumerate(names)
+                           for score in (name_similarity(query, name),) if score >= threshold),
+                          key=lambda item: (-item[1], item[0]))
+        expected = dict(expected[:limit] if limit else expected)
+        found = dict(hits)
+        expected_total += len(expected)
+        found_total += len(expected.keys() & found.keys())
+        mismatched += len(expected.keys() ^ found.keys())
+        mismatched += sum(1 for doc_id in expected.keys() & found.keys() if found[doc_id] != expected[doc_id])
+    recall = found_total / expected_total if expected_total else 1.0
+    print(f"🎯 {len(checked)} 個查詢與逐筆評分比較: 召回率 {recall:.2%}（{found_total}/{expected_total}），"
+          f"結果或分數不一致 {mismatched} 筆")
+
+
+if __name__ == "__main__":
+    main()
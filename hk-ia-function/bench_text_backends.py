@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+PDF 文字擷取後端比較
+對 fixture 語料（預設 bench_data/pdfs/）逐一以各後端擷取文字並抽取制裁條目，
+回報每秒頁數、最大常駐記憶體（RSS），以及與 pdfplumber 結果不同的條目
+
+每個後端在獨立子行程中執行，記憶體量測互不影響
+
+用法: python bench_text_backends.py [PDF 檔案或目錄 ...]
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+from collections import Counter
+
+BASELINE_BACKEND = "pdfplumber"
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data", "pdfs")
+
+
+def collect_pdfs(paths):
+    """展開參數中的目錄，回傳排序後的 PDF 路徑"""
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdfs.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                        if name.lower().endswith(".pdf"))
+        else:
+            pdfs.append(path)
+    return pdfs
+
+
+def run_worker(backend, pdfs):
+    """子行程：以指定後端處理全部 PDF，將結果以 JSON 輸出到 stdout"""
+    from pdf_text import page_texts
+    from takepdf import extract_sanction_entries, pdf_page_count
+
+    files = {}
+    pages = 0
+    started = time.perf_counter()
+    for pdf_path in pdfs:
+        count = pdf_page_count(pdf_path)
+        entries = []
+        for text in page_texts(pdf_path, 0, count, backend=backend):
+            entries.extend(extract_sanction_entries(text))
+        pages += count
+        files[os.path.basename(pdf_path)] = [
+            [e["name"], e["nationality"], e["passport_no"]] for e in entries
+        ]
+    seconds = time.perf_counter() - started
+
+    json.dump({
+        "backend": backend,
+        "pages": pages,
+        "seconds": seconds,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "files": files
+    }, sys.stdout)
+
+
+def run_backend(backend, pdfs):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", backend, *pdfs],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"後端 {backend} 執行失敗:\n{proc.stderr}")
+    # takepdf 匯入時可能輸出提示訊息，結果固定在最後一行
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def entry_diff(baseline, other):
+    """以多重集合比較兩份條目清單，回傳 (缺少的條目, 多出的條目)"""
+    base = Counter(tuple(e) for e in baseline)
+    cand = Counter(tuple(e) for e in other)
+    return sorted((base - cand).elements()), sorted((cand - base).elements())
+
+
+def main(argv):
+    from pdf_text import TEXT_BACKENDS
+
+    pdfs = collect_pdfs(argv or [DEFAULT_CORPUS])
+    if not pdfs:
+        print("❌ 找不到 PDF 檔案")
+        return 1
+    print(f"📄 語料: {len(pdfs)} 個 PDF")
+
+    results = {backend: run_backend(backend, pdfs) for backend in TEXT_BACKENDS}
+    baseline = results[BASELINE_BACKEND]
+
+    print(f"\n{'後端':<12}{'頁數':>8}{'秒數':>10}{'頁/秒':>10}{'最大 RSS (MB)':>16}{'條目數':>10}")
+    for backend, result in results.items():
+        total_entries = sum(len(entries) for entries in result["files"].values())
+        print(f"{backend:<12}{result['pages']:>8}{result['seconds']:>10.2f}"
+              f"{result['pages'] / result['seconds']:>10.1f}"
+              f"{result['max_rss_kb'] / 1024:>16.1f}{total_entries:>10}")
+
+    identical = True
+    for backend, result in results.items():
+        if backend == BASELINE_BACKEND:
+            continue
+        for name, entries in baseline["files"].items():
+            missing, extra = entry_diff(entries, result["files"].get(name, []))
+            if not missing and not extra:
+                continue
+            identical = False
+            print(f"\n⚠️ {backend} 與 {BASELINE_BACKEND} 在 {name} 的條目不同")
+            for entry in missing[:10]:
+                print(f"   - {entry}")
+            for entry in extra[:10]:
+                print(f"   + {entry}")
+
+    if identical:
+        print(f"\n✅ 所有後端的條目都與 {BASELINE_BACKEND} 相同")
+    return 0 if identical else 2
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+        run_worker(sys.argv[2], sys.argv[3:])
+    else:
+        sys.exit(main(sys.argv[1:]))
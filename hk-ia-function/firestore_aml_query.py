@@ -6,10 +6,33 @@ Firestore 版本的 AML 查詢引擎
 import os
 from google.cloud import firestore
 from google.cloud.firestore import FieldFilter
+from google.cloud.firestore_v1.watch import ChangeType
+from aml_name_index import NameIndex, normalize_name, name_ngrams
+from aml_fuzzy import FuzzyIndex, name_similarity, DEFAULT_THRESHOLD
+from aml_stats import summary_ref, rebuild_stats, summary_to_stats, summary_to_facets
+from aml_nationality import nationality_code
+from aml_cursor import encode_cursor, decode_cursor as decode_cursor_values
 import math
 
+# 伺服器端三元組查詢時，最多以 count() 探測幾個三元組的選擇性
+TRIGRAM_PROBE_LIMIT = 6
+
+# 僅供搜尋使用、不回傳給前端的欄位
+SEARCH_ONLY_FIELDS = ('name_normalized', 'name_trigrams')
+
+# 匯出時每次向 Firestore 讀取的文件數
+EXPORT_CHUNK_SIZE = 1000
+
+# 模糊比對每個姓名最多回傳的記錄數（依分數由高至低）
+FUZZY_MAX_RESULTS = 500
+
+def decode_cursor(cursor):
+    """解碼 next_cursor，回傳可傳給 start_after() 的欄位值"""
+    year, name, doc_id = decode_cursor_values(cursor)
+    return {'year': year, 'name': name, '__name__': doc_id}
+
 class FirestoreAMLQuery:
-    def __init__(self, use_emulator=True):
+    def __init__(self, use_emulator=True, use_trigram_search=False):
         """初始化 Firestore AML 查詢引擎"""
         if use_emulator:
             os.environ["FIRESTORE_EMULATOR_HOST"] = "127.0.0.1:8081"
@@ -17,25 +40,98 @@ class FirestoreAMLQuery:
         self.db = firestore.Client(project="hk-insurance-crawler")
         self.collection_name = "aml_profiles"
         
-    def search_by_name(self, name, page=1, per_page=20):
-        """按姓名搜尋 AML 記錄"""
+        # 行程內姓名索引，由 start_name_index() 啟動的監聽器維護
+        self.name_index = NameIndex()
+        self.fuzzy_index = FuzzyIndex()
+        self._index_watch = None
+        
+        # aml_stats 摘要文件快照與資料集版本號，由 start_summary_watch() 啟動的監聽器維護
+        self.dataset_version = 0
+        self._summary = None
+        self._summary_watch = None
+        
+        # 文件已寫入 name_trigrams 欄位後才可啟用（見 migrate_aml_data.py --backfill-search-fields）
+        self.use_trigram_search = use_trigram_search
+        
+    def start_name_index(self):
+        """啟動集合監聽：首次快照建立索引，之後只套用增量變更"""
+        if self._index_watch is not None:
+            return
+        collection_ref = self.db.collection(self.collection_name)
+        self._index_watch = collection_ref.on_snapshot(self._on_profiles_snapshot)
+        
+    def stop_name_index(self):
+        """停止集合監聽"""
+        if self._index_watch is not None:
+            self._index_watch.unsubscribe()
+            self._index_watch = None
+        
+    def start_summary_watch(self):
+        """監聽 aml_stats 摘要文件，取得最新的資料集版本號與統計"""
+        if self._summary_watch is not None:
+            return
+        self._summary_watch = summary_ref(self.db).on_snapshot(self._on_summary_snapshot)
+        
+    @property
+    def version_known(self):
+        """是否已由監聽取得資料集版本號（ETag 依賴此版本號）"""
+        return self._summary is not None
+        
+    def _on_summary_snapshot(self, docs, changes, read_time):
+        """摘要文件監聽回呼（於背景執行緒執行）"""
+        for doc in docs:
+            if doc.exists:
+                summary = doc.to_dict()
+                self._summary = summary
+                self.dataset_version = summary.get('version', 0)
+        
+    def _on_profiles_snapshot(self, docs, changes, read_time):
+        """Firestore 監聽回呼（於背景執行緒執行）"""
+        if not self.name_index.ready:
+            documents = [(doc.id, self._doc_data(doc)) for doc in docs]
+            self.fuzzy_index.load((doc_id, data.get('name', '')) for doc_id, data in documents)
+            self.name_index.load(documents)
+            print(f"✅ 姓名索引建立完成: {len(self.name_index)} 筆記錄")
+            return
+        
+        for change in changes:
+            doc_id = change.document.id
+            if change.type == ChangeType.REMOVED:
+                self.name_index.remove(doc_id)
+                self.fuzzy_index.remove(doc_id)
+            else:
+                data = self._doc_data(change.document)
+                self.name_index.upsert(doc_id, data)
+                self.fuzzy_index.upsert(doc_id, data.get('name', ''))
+        
+    @staticmethod
+    def _doc_data(doc):
+        """轉換文件為回應格式（移除僅供搜尋用的欄位）"""
+        data = doc.to_dict() or {}
+        for field in SEARCH_ONLY_FIELDS:
+            data.pop(field, None)
+        if 'nationality_code' not in data:
+            # 尚未補寫查詢欄位的文件（見 backfill_query_fields），記憶體中的過濾與匯出仍可使用
+            data['nationality_code'] = nationality_code(data.get('nationality'))
+        data['firestore_id'] = doc.id
+        return data
+        
+    def search_by_name(self, name, page=1, per_page=20, mode='substring', threshold=DEFAULT_THRESHOLD):
+        """按姓名搜尋 AML 記錄
+        
+        mode='substring' 為子字串比對；mode='fuzzy' 為模糊／語音比對，
+        結果依 match_score 由高至低排序，只回傳分數不低於 threshold 的前 FUZZY_MAX_RESULTS 筆記錄
+        """
         try:
-            collection_ref = self.db.collection(self.collection_name)
-            
-            # Firestore 不支援 LIKE 查詢，需要使用不同策略
-            # 我們使用 array-contains 和前綴匹配的組合
-            
-            # 先獲取所有符合條件的記錄（簡化版本，實際應該使用索引）
-            all_docs = collection_ref.stream()
-            
-            # 客戶端過濾（注意：這不是最佳解決方案，但能正常工作）
-            matches = []
-            for doc in all_docs:
-                data = doc.to_dict()
-                if name.lower() in data.get('name', '').lower():
-                    # 添加文檔 ID
-                    data['firestore_id'] = doc.id
-                    matches.append(data)
+            if mode == 'fuzzy':
+                matches = self._fuzzy_search_by_name(name, threshold)
+            elif self.name_index.ready:
+                # 由記憶體索引查詢，不讀取任何 Firestore 文件
+                matches = [dict(data) for _, data in self.name_index.search(name)]
+            elif self.use_trigram_search and name_ngrams(normalize_name(name)):
+                matches = self._trigram_search_by_name(name)
+            else:
+                matches = self._scan_by_name(name)
             
             # 計算分頁
             total = len(matches)
@@ -58,51 +154,170 @@ class FirestoreAMLQuery:
         except Exception as e:
             raise Exception(f"Firestore 查詢失敗: {str(e)}")
     
-    def get_profiles_paginated(self, page=1, per_page=50, nationality=None):
-        """分頁獲取 AML 記錄"""
+    def search_many(self, names, mode='substring', threshold=DEFAULT_THRESHOLD, max_matches=20):
+        """批次篩查：所有姓名共用同一份快照比對，重複姓名只比對一次"""
+        name_index, fuzzy_index = self._snapshot_indexes(fuzzy=(mode == 'fuzzy'))
+        
+        keys = list(dict.fromkeys(key for key in map(normalize_name, names) if key))
+        hits_by_key = {}
+        if mode == 'fuzzy':
+            # 模糊比對整批交給 FuzzyIndex，語音鍵相同的姓名共用候選記錄的產生
+            for key, found in zip(keys, fuzzy_index.search_many(keys, threshold, FUZZY_MAX_RESULTS)):
+                hits = []
+                for doc_id, score in found:
+                    data = name_index.get(doc_id)
+                    if data is not None:
+                        data = dict(data)
+                        data['match_score'] = round(score, 4)
+                        hits.append(data)
+                hits_by_key[key] = hits
+        else:
+            for key in keys:
+                hits_by_key[key] = [data for _, data in name_index.search(key)]
+        
+        results = []
+        for name in names:
+            hits = hits_by_key.get(normalize_name(name), [])
+            results.append({
+                "name": name,
+                "found": len(hits) > 0,
+                "total": len(hits),
+                "matches": [dict(data) for data in hits[:max_matches]]
+            })
+        
+        return {
+            "success": True,
+            "mode": mode,
+            "total_names": len(results),
+            "matched_names": sum(1 for result in results if result["found"]),
+            "results": results
+        }
+    
+    def _snapshot_indexes(self, fuzzy=False):
+        """取得可用的記憶體索引；尚未就緒時以單次串流建立臨時索引"""
+        if self.name_index.ready:
+            return self.name_index, self.fuzzy_index
+        
+        documents = [(doc.id, self._doc_data(doc)) for doc in self.db.collection(self.collection_name).stream()]
+        name_index = NameIndex()
+        name_index.load(documents)
+        fuzzy_index = FuzzyIndex()
+        if fuzzy:
+            fuzzy_index.load((doc_id, data.get('name', '')) for doc_id, data in documents)
+        return name_index, fuzzy_index
+    
+    def _fuzzy_search_by_name(self, name, threshold):
+        """模糊比對：索引就緒時由語音分桶產生候選，否則串流整個集合逐筆評分"""
+        if self.name_index.ready:
+            matches = []
+            for doc_id, score in self.fuzzy_index.search(name, threshold, FUZZY_MAX_RESULTS):
+                data = self.name_index.get(doc_id)
+                if data is not None:
+                    data = dict(data)
+                    data['match_score'] = round(score, 4)
+                    matches.append(data)
+            return matches
+        
+        collection_ref = self.db.collection(self.collection_name)
+        matches = []
+        for doc in collection_ref.stream():
+            data = self._doc_data(doc)
+            score = name_similarity(name, data.get('name', ''))
+            if score >= threshold:
+                data['match_score'] = round(score, 4)
+                matches.append(data)
+        matches.sort(key=lambda data: (-data['match_score'], data['firestore_id']))
+        return matches[:FUZZY_MAX_RESULTS]
+    
+    def _trigram_search_by_name(self, name):
+        """以 name_trigrams 欄位在伺服器端縮小候選集合，再於本地驗證子字串"""
+        query = normalize_name(name)
+        collection_ref = self.db.collection(self.collection_name)
+        
+        # 以 count() 聚合找出命中文件最少的三元組（聚合查詢按索引項計費，遠低於讀取文件）
+        grams = sorted(name_ngrams(query))
+        step = max(1, len(grams) // TRIGRAM_PROBE_LIMIT)
+        best_gram, best_count = None, None
+        for gram in grams[::step][:TRIGRAM_PROBE_LIMIT]:
+            count_query = collection_ref.where(
+                filter=FieldFilter('name_trigrams', 'array_contains', gram)
+            ).count(alias='n')
+            count = count_query.get()[0][0].value
+            if best_count is None or count < best_count:
+                best_gram, best_count = gram, count
+            if count == 0:
+                return []
+        
+        candidates = collection_ref.where(
+            filter=FieldFilter('name_trigrams', 'array_contains', best_gram)
+        ).stream()
+        
+        matches = []
+        for doc in candidates:
+            data = self._doc_data(doc)
+            if query in normalize_name(data.get('name', '')):
+                matches.append(data)
+        return matches
+    
+    def _scan_by_name(self, name):
+        """索引尚未就緒時的備援：串流整個集合並於客戶端過濾"""
+        collection_ref = self.db.collection(self.collection_name)
+        
+        matches = []
+        for doc in collection_ref.stream():
+            data = self._doc_data(doc)
+            if name.lower() in data.get('name', '').lower():
+                matches.append(data)
+        return matches
+    
+    def get_profiles_paginated(self, page=1, per_page=50, nationality=None, cursor=None):
+        """分頁獲取 AML 記錄
+        
+        cursor 為前一頁回應中的 next_cursor；未提供時以 page 頁碼定位；
+        多讀取一筆判斷是否還有下一頁，has_next / next_cursor 不依賴頁碼；無效的 cursor 回傳 success=False；
+        nationality 先經 nationality_code() 標準化，再與文件的 nationality_code 完全比對
+        （例如 Iraq / Iraqi / IQ 皆對應 IQ），不再是國籍原文的部分字串比對
+        """
+        try:
+            start_after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return self._empty_profiles_page(page, per_page, str(e))
+        
         try:
             collection_ref = self.db.collection(self.collection_name)
             
-            # 構建查詢
-            query = collection_ref
-            
-            # 如果有國籍過濾條件
+            # 依 (year DESC, name, 文件 ID) 排序的游標分頁，每頁只讀取 per_page 筆
+            base_query = collection_ref
             if nationality:
-                # 使用客戶端過濾（Firestore 的字串匹配限制）
-                all_docs = collection_ref.stream()
-                filtered_docs = []
-                
-                for doc in all_docs:
-                    data = doc.to_dict()
-                    if nationality.lower() in data.get('nationality', '').lower():
-                        data['firestore_id'] = doc.id
-                        filtered_docs.append(data)
-                
-                # 計算分頁
-                total = len(filtered_docs)
-                total_pages = math.ceil(total / per_page) if total > 0 else 0
-                
-                # 分頁處理
-                start_idx = (page - 1) * per_page
-                end_idx = start_idx + per_page
-                page_docs = filtered_docs[start_idx:end_idx]
-                
-            else:
-                # 無過濾條件，直接分頁
-                # 先獲取總數（注意：這是昂貴的操作）
-                all_docs = list(collection_ref.stream())
-                total = len(all_docs)
-                total_pages = math.ceil(total / per_page) if total > 0 else 0
-                
-                # 分頁處理
-                start_idx = (page - 1) * per_page
-                end_idx = start_idx + per_page
-                page_docs = []
-                
-                for i, doc in enumerate(all_docs[start_idx:end_idx]):
-                    data = doc.to_dict()
-                    data['firestore_id'] = doc.id
-                    page_docs.append(data)
+                # 國籍過濾使用標準化代碼的等值查詢（需 nationality_code + year + name 複合索引）
+                base_query = collection_ref.where(
+                    filter=FieldFilter('nationality_code', '==', nationality_code(nationality))
+                )
+            
+            query = (base_query
+                     .order_by('year', direction=firestore.Query.DESCENDING)
+                     .order_by('name')
+                     .order_by('__name__'))
+            
+            if start_after:
+                query = query.start_after(start_after)
+            elif page > 1:
+                # 相容頁碼跳轉（offset 仍會計費略過的文件）
+                query = query.offset((page - 1) * per_page)
+            
+            # 多讀取一筆，有第 per_page + 1 筆時才有下一頁
+            docs = list(query.limit(per_page + 1).stream())
+            has_next = len(docs) > per_page
+            page_docs = [self._doc_data(doc) for doc in docs[:per_page]]
+            
+            # 總數使用 count() 聚合查詢，不讀取文件
+            total = base_query.count(alias='n').get()[0][0].value
+            total_pages = math.ceil(total / per_page) if total > 0 else 0
+            
+            next_cursor = None
+            if has_next:
+                last = page_docs[-1]
+                next_cursor = encode_cursor(last.get('year'), last.get('name'), last['firestore_id'])
             
             return {
                 "success": True,
@@ -110,47 +325,96 @@ class FirestoreAMLQuery:
                 "total_profiles": total,
                 "page": page,
                 "per_page": per_page,
-                "total_pages": total_pages
+                "total_pages": total_pages,
+                # 以游標定位時一定是從前一頁翻過來的
+                "has_prev": bool(cursor) or page > 1,
+                "has_next": has_next,
+                "next_cursor": next_cursor
+            }
+            
+        except Exception as e:
+            return self._empty_profiles_page(page, per_page, f"獲取資料失敗: {str(e)}")
+    
+    @staticmethod
+    def _empty_profiles_page(page, per_page, error):
+        """分頁查詢失敗時的回應"""
+        return {
+            "success": False,
+            "error": error,
+            "profiles": [],
+            "total_profiles": 0,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": 0,
+            "has_prev": False,
+            "has_next": False,
+            "next_cursor": None
+        }
+    
+    def iter_profiles(self, nationality=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """依文件 ID 順序逐筆產生所有記錄（供匯出使用）
+
+        姓名索引就緒時直接走記憶體快照，不讀取 Firestore；
+        否則以文件 ID 游標分段讀取，每段 chunk_size 筆，記憶體用量固定
+        """
+        code = nationality_code(nationality) if nationality else None
+        
+        if self.name_index.ready:
+            for doc_id, data in self.name_index.items():
+                if code is None or data.get('nationality_code') == code:
+                    yield data
+            return
+        
+        base_query = self.db.collection(self.collection_name)
+        if code is not None:
+            base_query = base_query.where(filter=FieldFilter('nationality_code', '==', code))
+        base_query = base_query.order_by('__name__').limit(chunk_size)
+        
+        last_doc = None
+        while True:
+            query = base_query.start_after(last_doc) if last_doc is not None else base_query
+            docs = list(query.stream())
+            for doc in docs:
+                yield self._doc_data(doc)
+            if len(docs) < chunk_size:
+                return
+            last_doc = docs[-1]
+    
+    def _load_summary(self):
+        """取得摘要文件：監聽中直接使用快照，否則讀取一次"""
+        if self._summary is not None:
+            return self._summary
+        snapshot = summary_ref(self.db).get()
+        return snapshot.to_dict() if snapshot.exists else None
+    
+    def get_nationality_facets(self):
+        """各國籍代碼的筆數（讀取 aml_stats 摘要文件）"""
+        try:
+            summary = self._load_summary()
+            if not summary or 'nationalities' not in summary:
+                summary = rebuild_stats(self.db, self.collection_name)
+            
+            return {
+                "success": True,
+                "facets": summary_to_facets(summary)
             }
             
         except Exception as e:
             return {
                 "success": False,
-                "error": f"獲取資料失敗: {str(e)}",
-                "profiles": [],
-                "total_profiles": 0,
-                "page": page,
-                "per_page": per_page,
-                "total_pages": 0
+                "error": f"國籍統計查詢失敗: {str(e)}",
+                "facets": []
             }
     
     def get_stats(self):
-        """獲取統計資訊 - 與前端格式匹配"""
+        """獲取統計資訊 - 與前端格式匹配（只讀取 aml_stats 摘要文件）"""
         try:
-            collection_ref = self.db.collection(self.collection_name)
-            docs = list(collection_ref.stream())
-            
-            total_profiles = len(docs)
-            
-            # 按年份統計
-            year_stats = {}
+            summary = self._load_summary()
+            if not summary:
+                # 摘要文件尚未建立：重算一次並寫回
+                summary = rebuild_stats(self.db, self.collection_name)
             
-            for doc in docs:
-                data = doc.to_dict()
-                year = data.get('year')
-                if year:
-                    year_stats[year] = year_stats.get(year, 0) + 1
-            
-            # 轉換為前端期望的格式
-            year_stats_list = [
-                {"year": year, "count": count} 
-                for year, count in sorted(year_stats.items(), reverse=True)
-            ]
-            
-            return {
-                "total_profiles": total_profiles,
-                "year_stats": year_stats_list
-            }
+            return summary_to_stats(summary)
             
         except Exception as e:
             return {
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Cloud Storage SQLite 資料庫的本機快取
+查詢只需讀取資料庫，不必每次都從 GCS 下載整個檔案：行程內保留一份本機副本，
+最多每 DB_CACHE_CHECK_SECONDS 秒比對一次 blob 的 generation / md5_hash，
+只有內容變更時才下載新版，並以 os.replace 原子替換；
+已開啟的連線仍讀取舊檔案，不會讀到下載到一半的內容
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from google.cloud import storage
+
+DB_CACHE_CHECK_SECONDS = float(os.environ.get("DB_CACHE_CHECK_SECONDS", 60))
+
+
+class GCSDBCache:
+    """單一 GCS 資料庫檔案的本機快取（執行緒安全）
+
+    prepare(path) 在替換前對新下載（或新建）的檔案執行，例如補齊表結構
+    """
+
+    def __init__(self, bucket_name, db_file, check_interval=DB_CACHE_CHECK_SECONDS, prepare=None):
+        self.bucket_name = bucket_name
+        self.db_file = db_file
+        self.check_interval = check_interval
+        self.local_path = os.path.join(tempfile.gettempdir(), f"cache-{os.path.basename(db_file)}")
+        self._prepare = prepare
+        self._client = None
+        self._refresh_lock = threading.Lock()
+        self._checked_at = None
+        self._invalidated = False
+        self.generation = None
+        self.md5_hash = None
+        self.checks = 0
+        self.reloads = 0
+
+    def path(self):
+        """回傳最新的本機資料庫路徑，需要時先比對並更新"""
+        if self._due():
+            if os.path.exists(self.local_path):
+                # 已有本機副本時其他執行緒不必等待，繼續讀取目前的版本
+                if self._refresh_lock.acquire(blocking=False):
+                    try:
+                        self._refresh()
+                    finally:
+                        self._refresh_lock.release()
+            else:
+                with self._refresh_lock:
+                    if self._due() or not os.path.exists(self.local_path):
+                        self._refresh()
+        return self.local_path
+
+    def invalidate(self):
+        """下次取用時立即比對 GCS（例如本行程剛上傳新版資料庫）"""
+        self._invalidated = True
+
+    def stats(self):
+        return {
+            "bucket": self.bucket_name,
+            "db_file": self.db_file,
+            "local_path": self.local_path,
+            "generation": self.generation,
+            "md5_hash": self.md5_hash,
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "check_interval": self.check_interval
+        }
+
+    def _due(self):
+        return (self._invalidated or self._checked_at is None
+                or time.monotonic() - self._checked_at >= self.check_interval)
+
+    def _bucket(self):
+        if self._client is None:
+            self._client = storage.Client()
+        return self._client.bucket(self.bucket_name)
+
+    def _refresh(self):
+        self.checks += 1
+        self._invalidated = False
+        self._checked_at = time.monotonic()
+        try:
+            blob = self._bucket().get_blob(self.db_file)
+        except Exception as e:
+            print(f"⚠️ 無法檢查 DB 版本，沿用本機副本: {e}")
+            if not os.path.exists(self.local_path):
+                # 尚未取得真正的資料庫，下次取用再試
+                self._invalidated = True
+            self._ensure_local()
+            return
+
+        if blob is None:
+            self._ensure_local()
+            return
+        if os.path.exists(self.local_path):
+            if blob.generation == self.generation:
+                return
+            if blob.md5_hash and blob.md5_hash == self.md5_hash:
+                # 重新上傳了相同內容，只更新版本號
+                self.generation = blob.generation
+                return
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.local_path), suffix=".tmp")
+        os.close(fd)
+        try:
+            blob.download_to_filename(tmp_path, if_generation_match=blob.generation)
+            if self._prepare is not None:
+                self._prepare(tmp_path)
+            os.replace(tmp_path, self.local_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            # 下載期間又有新版本上傳時，下次取用再試
+            self._invalidated = True
+            print(f"⚠️ 下載 DB 失敗，沿用本機副本: {e}")
+            self._ensure_local()
+            return
+
+        self.generation = blob.generation
+        self.md5_hash = blob.md5_hash
+        self.reloads += 1
+        print(f"✅ 已更新本機 DB 快取: {self.db_file}（generation {blob.generation}）")
+
+    def _ensure_local(self):
+        """GCS 沒有可用的資料庫且本機也沒有副本時，建立空資料庫"""
+        if os.path.exists(self.local_path):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.local_path), suffix=".tmp")
+        os.close(fd)
+        os.remove(tmp_path)
+        if self._prepare is not None:
+            self._prepare(tmp_path)
+        else:
+            open(tmp_path, "wb").close()
+        os.replace(tmp_path, self.local_path)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_db_cache(bucket_name, db_file, prepare=None):
+    """取得（或建立）行程內共用的資料庫快取"""
+    key = (bucket_name, db_file)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = GCSDBCache(bucket_name, db_file, prepare=prepare)
+        return _caches[key]
+
+
+def invalidate_db_cache(bucket_name, db_file):
+    """本行程上傳資料庫後呼叫，讓下次查詢立即取得新版"""
+    with _caches_lock:
+        cache = _caches.get((bucket_name, db_file))
+    if cache is not None:
+        cache.invalidate()
@@ -1,11 +1,22 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, make_response
-from takepdf import run_crawler, query_name, get_profiles_paginated, get_stats
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, make_response, Response
+from takepdf import run_crawler, query_name, get_profiles_paginated, get_stats, get_crawl_status
 from user_management_firestore import UserManager
 from create_admin import create_admin_if_not_exists
 from firestore_aml_query import FirestoreAMLQuery
+from aml_fuzzy import DEFAULT_THRESHOLD
+from aml_stats import rebuild_stats
+from aml_name_index import backfill_query_fields
+from aml_cache import CachedAMLQuery
+from aml_export import EXPORT_FORMATS, export_stream
+from aml_jobs import BackgroundJobRunner
+from aml_cursor import decode_cursor
 from firestore_aml_updater import get_updater
 import os
+import io
+import csv
 import json
+import hashlib
+from datetime import datetime
 import logging
 
 app = Flask(__name__)
@@ -19,13 +30,32 @@ app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# SQLite 爬蟲資料庫在 Cloud Storage 中的位置
+BUCKET_NAME = os.environ.get("BUCKET_NAME", "hk-ia-db")
+DB_FILE = os.environ.get("DB_FILE", "aml_profiles.db")
+
 # 🎉 Firestore 版本 - 自動檢測環境
 USE_EMULATOR = os.environ.get('FIRESTORE_EMULATOR_HOST') is not None
 print(f"🚀 初始化 Firestore 用戶管理器 ({'模擬器模式' if USE_EMULATOR else 'GCP生產模式'})...")
 user_manager = UserManager(use_emulator=USE_EMULATOR)
 
 print("🚀 初始化 Firestore AML 查詢引擎...")
-aml_query = FirestoreAMLQuery(use_emulator=USE_EMULATOR)
+aml_query = CachedAMLQuery(
+    FirestoreAMLQuery(
+        use_emulator=USE_EMULATOR,
+        use_trigram_search=os.environ.get('AML_TRIGRAM_SEARCH', '0') == '1'
+    ),
+    maxsize=int(os.environ.get('AML_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('AML_CACHE_TTL', 300))
+)
+
+# 監聽資料集版本號，寫入後快取立即失效
+aml_query.start_summary_watch()
+
+# 啟動姓名記憶體索引（設定 AML_NAME_INDEX=0 可停用，改回串流掃描）
+if os.environ.get('AML_NAME_INDEX', '1') != '0':
+    print("🚀 建立 AML 姓名記憶體索引...")
+    aml_query.start_name_index()
 
 # 確保管理員帳戶存在
 create_admin_if_not_exists(user_manager)
@@ -74,14 +104,41 @@ def require_admin():
     except Exception as e:
         return {'valid': False, 'message': f'權限檢查失敗: {str(e)}', 'code': 'ADMIN_CHECK_ERROR'}
 
+# 資料端點允許瀏覽器／CDN 快取的秒數，過期後以 If-None-Match 重新驗證
+HTTP_CACHE_MAX_AGE = int(os.environ.get('AML_HTTP_MAX_AGE', 60))
+
+def data_etag():
+    """由資料集版本號與請求參數計算強 ETag；版本號尚未取得時回傳 None"""
+    if not aml_query.version_known:
+        return None
+    raw = json.dumps(
+        [aml_query.dataset_version, request.path, sorted(request.args.items(multi=True))],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def set_cache_headers(response, etag):
+    """設定 ETag 與 Cache-Control"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={HTTP_CACHE_MAX_AGE}, must-revalidate'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    """If-None-Match 與目前 ETag 相符時回傳 304 回應（不查詢 Firestore），否則回傳 None"""
+    if etag and etag in request.if_none_match:
+        return set_cache_headers(make_response('', 304), etag)
+    return None
+
 @app.route("/")
 def home():
-    """主頁 - 直接顯示查詢頁面"""
+    """主頁 - 直接顯示查詢頁面（每次以 ETag 重新驗證）"""
     response = make_response(render_template("query.html"))
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    return response
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -216,30 +273,119 @@ def query():
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 20, type=int)
         
+        # 比對模式：substring（預設）或 fuzzy（模糊／語音比對）
+        mode = request.args.get("mode", "substring")
+        if mode not in ("substring", "fuzzy"):
+            return jsonify({"error": "mode 參數只接受 substring 或 fuzzy"}), 400
+        threshold = request.args.get("threshold", DEFAULT_THRESHOLD, type=float)
+        if not 0 < threshold <= 1:
+            return jsonify({"error": "threshold 參數需介於 0 與 1 之間"}), 400
+        
     except Exception as e:
         return jsonify({"error": f"參數處理失敗: {str(e)}"}), 400
     
+    etag = data_etag()
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
     try:
         # 🔥 使用 Firestore AML 查詢引擎
-        result = aml_query.search_by_name(name, page, per_page)
+        result = aml_query.search_by_name(name, page, per_page, mode=mode, threshold=threshold)
         
         # 確保響應使用正確的 Content-Type 和編碼
         response = make_response(jsonify(result))
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response, 200
+        return set_cache_headers(response, etag), 200
             
     except Exception as e:
         error_response = make_response(jsonify({"error": f"查詢失敗: {str(e)}"}))
         error_response.headers['Content-Type'] = 'application/json; charset=utf-8'
         return error_response, 500
 
+# 批次篩查單次請求的姓名上限
+BATCH_MAX_NAMES = 20000
+# 模糊比對每個姓名需掃描語音分桶，批次的姓名上限較低（14.5 萬筆記錄時每個姓名約 6 ms）
+FUZZY_BATCH_MAX_NAMES = 500
+# 批次篩查每個姓名最多回傳的比對結果數
+BATCH_MAX_MATCHES = 100
+
+def _parse_batch_names():
+    """解析批次篩查的姓名清單：JSON 陣列、{"names": [...]}、CSV 本文或上傳的 CSV 檔"""
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('names')
+        if not isinstance(data, list):
+            raise ValueError("JSON 內容需為姓名陣列或包含 names 陣列的物件")
+        return [str(name).strip() for name in data if str(name).strip()]
+    
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+    rows = [row for row in csv.reader(io.StringIO(text)) if row and any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    
+    # 有 name 欄位標題時取該欄，否則取第一欄
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = 0
+    if 'name' in header:
+        column = header.index('name')
+        rows = rows[1:]
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+@app.route("/query/batch", methods=["POST"])
+def query_batch():
+    """批次 AML 篩查 - 無需認證"""
+    try:
+        names = _parse_batch_names()
+        if not names:
+            return jsonify({"error": "缺少姓名清單"}), 400
+        if len(names) > BATCH_MAX_NAMES:
+            return jsonify({"error": f"單次最多篩查 {BATCH_MAX_NAMES} 個姓名"}), 400
+        
+        mode = request.args.get("mode", "substring")
+        if mode not in ("substring", "fuzzy"):
+            return jsonify({"error": "mode 參數只接受 substring 或 fuzzy"}), 400
+        if mode == "fuzzy" and len(names) > FUZZY_BATCH_MAX_NAMES:
+            return jsonify({"error": f"模糊比對單次最多篩查 {FUZZY_BATCH_MAX_NAMES} 個姓名，請分批提交"}), 400
+        threshold = request.args.get("threshold", DEFAULT_THRESHOLD, type=float)
+        if not 0 < threshold <= 1:
+            return jsonify({"error": "threshold 參數需介於 0 與 1 之間"}), 400
+        max_matches = request.args.get("max_matches", 20, type=int)
+        if not 1 <= max_matches <= BATCH_MAX_MATCHES:
+            return jsonify({"error": f"max_matches 參數需介於 1 與 {BATCH_MAX_MATCHES} 之間"}), 400
+        
+    except Exception as e:
+        return jsonify({"error": f"參數處理失敗: {str(e)}"}), 400
+    
+    try:
+        result = aml_query.search_many(names, mode=mode, threshold=threshold, max_matches=max_matches)
+        
+        response = make_response(jsonify(result))
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        return response, 200
+        
+    except Exception as e:
+        error_response = make_response(jsonify({"error": f"批次查詢失敗: {str(e)}"}))
+        error_response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        return error_response, 500
+
 @app.route("/stats", methods=["GET"])
 def get_stats():
     """獲取 AML 統計資訊 - 無需認證"""
+    etag = data_etag()
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
     try:
         # 🔥 使用 Firestore AML 查詢引擎獲取統計
         result = aml_query.get_stats()
-        return jsonify(result), 200
+        response = make_response(jsonify(result))
+        if 'error' not in result:
+            set_cache_headers(response, etag)
+        return response, 200
             
     except Exception as e:
         return jsonify({
@@ -248,36 +394,98 @@ def get_stats():
             "year_stats": []
         }), 500
 
+def run_update_job(params, report):
+    """背景執行 AML 制裁名單更新（由 update_jobs 的工作執行緒呼叫）"""
+    print("🚀 開始更新 AML 制裁名單資料...")
+    
+    # 🔥 使用 Firestore 版本的資料更新器 - 自動檢測環境
+    report(stage="updating")
+    updater = get_updater(use_emulator=USE_EMULATOR)
+    
+    year = params.get('year')
+    if year:
+        print(f"📅 指定更新年份: {year}")
+    
+    # 執行更新
+    result = updater.update_aml_data(year=year)
+    report(processed_files=result.get('processed_files', 0), new_records=result.get('new_records', 0))
+    
+    # 有新增記錄時補寫查詢欄位（更新器不寫 nationality_code / name_trigrams），再重算統計摘要
+    if result['success'] and result.get('new_records'):
+        report(stage="backfilling_query_fields")
+        backfilled = backfill_query_fields(aml_query.db, aml_query.collection_name)
+        report(backfilled_records=backfilled)
+        report(stage="rebuilding_stats")
+        rebuild_stats(aml_query.db, aml_query.collection_name)
+        aml_query.invalidate()
+    
+    return result
+
+# 更新工作在專用背景執行緒中執行，不佔用 gunicorn 的請求執行緒
+update_jobs = BackgroundJobRunner(run_update_job, name="aml-update")
+
 @app.route("/update", methods=["GET", "POST"])
 def update():
-    """更新 AML 制裁名單資料 - 無需認證"""
+    """提交 AML 制裁名單更新工作，立即回傳 202 與工作 ID - 無需認證
+    
+    已有相同參數的更新在執行時不重複啟動，直接回傳執行中的工作；
+    執行中的工作參數不同時回傳 409 與該工作，本次參數不會被執行
+    """
     try:
-        print("🚀 開始更新 AML 制裁名單資料...")
-        
-        # 🔥 使用 Firestore 版本的資料更新器 - 自動檢測環境
-        updater = get_updater(use_emulator=USE_EMULATOR)
-        
         # 獲取可選的年份參數
         year = request.args.get('year', type=int)
-        if year:
-            print(f"📅 指定更新年份: {year}")
+        job, outcome = update_jobs.submit(year=year)
         
-        # 執行更新
-        result = updater.update_aml_data(year=year)
+        if outcome == "conflict":
+            return jsonify({
+                "success": False,
+                "message": "已有參數不同的更新工作執行中，請待其完成後再提交",
+                "job_id": job['job_id'],
+                "status": job['status'],
+                "stage": job['stage'],
+                "params": job['params'],
+                "ignored_params": {"year": year},
+                "status_url": url_for('update_status', job_id=job['job_id'])
+            }), 409
         
-        if result['success']:
-            return jsonify(result), 200
-        else:
-            return jsonify(result), 500
+        response = jsonify({
+            "success": True,
+            "job_id": job['job_id'],
+            "status": job['status'],
+            "stage": job['stage'],
+            "attached": outcome == "attached",
+            "status_url": url_for('update_status', job_id=job['job_id'])
+        })
+        response.headers['Location'] = url_for('update_status', job_id=job['job_id'])
+        return response, 202
         
     except Exception as e:
         return jsonify({
             "success": False, 
-            "message": f"更新失敗: {str(e)}",
+            "message": f"更新工作提交失敗: {str(e)}",
             "processed_files": 0,
             "new_records": 0
         }), 500
 
+@app.route("/update/<job_id>", methods=["GET"])
+def update_status(job_id):
+    """查詢更新工作的階段、計數與耗時 - 無需認證"""
+    job = update_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "找不到此更新工作"}), 404
+    
+    response = jsonify({"success": True, **job})
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200
+
+@app.route("/crawl/status", methods=["GET"])
+def crawl_status():
+    """PDF 爬取工作進度 - 無需認證"""
+    try:
+        return jsonify(get_crawl_status(BUCKET_NAME, DB_FILE)), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": f"獲取爬取進度失敗: {str(e)}"}), 500
+
 @app.route("/profiles", methods=["GET"])
 def get_profiles():
     """分頁獲取 AML 制裁名單資料 - 無需認證"""
@@ -285,13 +493,31 @@ def get_profiles():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 50))
         nationality = request.args.get('nationality', '').strip()
+        cursor = request.args.get('cursor', '').strip() or None
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({
+                    "success": False,
+                    "error": str(e),
+                    "profiles": [],
+                    "total_profiles": 0
+                }), 400
+        
+        etag = data_etag()
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
         # 🔥 使用 Firestore AML 查詢引擎
-        result = aml_query.get_profiles_paginated(page, per_page, nationality)
+        result = aml_query.get_profiles_paginated(page, per_page, nationality, cursor=cursor)
         
         # 確保響應使用正確的 Content-Type 和編碼
         response = make_response(jsonify(result))
         response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        if result.get('success'):
+            set_cache_headers(response, etag)
         return response, 200
             
     except Exception as e:
@@ -305,6 +531,43 @@ def get_profiles():
         error_response.headers['Content-Type'] = 'application/json; charset=utf-8'
         return error_response, 500
 
+@app.route("/facets/nationality", methods=["GET"])
+def get_nationality_facets():
+    """各國籍代碼與筆數 - 無需認證"""
+    etag = data_etag()
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    result = aml_query.get_nationality_facets()
+    
+    response = make_response(jsonify(result))
+    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    if not result['success']:
+        return response, 500
+    return set_cache_headers(response, etag), 200
+
+@app.route("/export", methods=["GET"])
+def export_profiles():
+    """串流匯出完整制裁名單（NDJSON 或 CSV，可 gzip）- 無需認證"""
+    fmt = request.args.get('format', 'ndjson').strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "format 參數只接受 ndjson 或 csv"}), 400
+    nationality = request.args.get('nationality', '').strip() or None
+    use_gzip = 'gzip' in request.accept_encodings
+    
+    # 記錄由產生器逐段讀取並逐段送出，不在記憶體中累積整份名單
+    records = aml_query.iter_profiles(nationality=nationality)
+    response = Response(export_stream(records, fmt, gzip=use_gzip), content_type=EXPORT_FORMATS[fmt])
+    
+    filename = f"aml_profiles_{datetime.utcnow().strftime('%Y%m%d')}.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route("/admin", methods=["GET"])
 def admin_panel():
     """管理員面板"""
@@ -327,6 +590,19 @@ def admin_get_users():
     else:
         return jsonify(result), 500
 
+@app.route("/admin/cache", methods=["GET"])
+def admin_cache_stats():
+    """查詢快取命中統計（管理員功能）"""
+    admin_check = require_admin()
+    if not admin_check.get('valid'):
+        return jsonify(admin_check), 403
+    
+    return jsonify({
+        "success": True,
+        "dataset_version": aml_query.dataset_version,
+        "cache": aml_query.cache.stats()
+    }), 200
+
 if __name__ == "__main__":
     print("🎉 Firestore 版本啟動完成!")
     app.run(host="0.0.0.0", port=8000, debug=False)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+PDF 原始檔與擷取文字的內容定址儲存
+以 SHA-256 為鍵保存下載過的通告 PDF，供日後重新解析而不必再向 IA 網站下載。
+由環境變數 PDF_STORE 選擇位置：
+  本機目錄            PDF_STORE=/var/cache/aml-pdfs
+  Cloud Storage      PDF_STORE=gs://bucket-name/pdfs
+未設定時不保存原始檔
+
+擷取後的頁面文字（gzip 壓縮）另存於 PDF_TEXT_STORE，格式同上；
+未設定時與 PDF_STORE 共用同一位置，兩者都未設定時使用呼叫端提供的預設本機目錄
+"""
+
+import os
+import shutil
+import tempfile
+
+
+PDF_SUFFIX = ".pdf"
+TEXT_SUFFIX = ".txt.gz"
+
+
+def _blob_name(sha256, suffix=PDF_SUFFIX):
+    """以雜湊前兩碼分目錄，避免單一目錄檔案過多"""
+    return f"{sha256[:2]}/{sha256}{suffix}"
+
+
+class LocalPDFStore:
+    """本機目錄儲存"""
+
+    def __init__(self, root, suffix=PDF_SUFFIX):
+        self.root = root
+        self.suffix = suffix
+
+    def _path(self, sha256):
+        return os.path.join(self.root, _blob_name(sha256, self.suffix))
+
+    def exists(self, sha256):
+        return os.path.exists(self._path(sha256))
+
+    def put(self, sha256, pdf_path):
+        """保存 PDF（已存在時略過）；先寫入暫存檔再改名，避免留下不完整的檔案"""
+        target = self._path(sha256)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(pdf_path, tmp_path)
+        os.replace(tmp_path, target)
+
+    def fetch(self, sha256, dest_path):
+        """取出 PDF 到 dest_path，不存在時回傳 False"""
+        source = self._path(sha256)
+        if not os.path.exists(source):
+            return False
+        shutil.copyfile(source, dest_path)
+        return True
+
+    def put_bytes(self, sha256, data):
+        """保存（覆寫）位元組內容，同樣先寫入暫存檔再改名"""
+        target = self._path(sha256)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+
+    def get_bytes(self, sha256):
+        """讀取位元組內容，不存在時回傳 None"""
+        try:
+            with open(self._path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class GCSPDFStore:
+    """Cloud Storage 儲存"""
+
+    def __init__(self, bucket_name, prefix="", suffix=PDF_SUFFIX):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+        self.suffix = suffix
+
+    def _blob(self, sha256):
+        name = _blob_name(sha256, self.suffix)
+        return self.bucket.blob(f"{self.prefix}/{name}" if self.prefix else name)
+
+    def exists(self, sha256):
+        return self._blob(sha256).exists()
+
+    def put(self, sha256, pdf_path):
+        """保存 PDF；以 if_generation_match=0 讓已存在的物件不被覆寫"""
+        from google.api_core.exceptions import PreconditionFailed
+        try:
+            self._blob(sha256).upload_from_filename(
+                pdf_path, content_type="application/pdf", if_generation_match=0
+            )
+        except PreconditionFailed:
+            pass
+
+    def fetch(self, sha256, dest_path):
+        from google.api_core.exceptions import NotFound
+        try:
+            self._blob(sha256).download_to_filename(dest_path)
+            return True
+        except NotFound:
+            return False
+
+    def put_bytes(self, sha256, data):
+        self._blob(sha256).upload_from_string(data, content_type="application/gzip")
+
+    def get_bytes(self, sha256):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self._blob(sha256).download_as_bytes()
+        except NotFound:
+            return None
+
+
+def _open_store(location, suffix):
+    if location.startswith("gs://"):
+        bucket_name, _, prefix = location[len("gs://"):].partition("/")
+        return GCSPDFStore(bucket_name, prefix, suffix)
+    return LocalPDFStore(location, suffix)
+
+
+_store = None
+_text_store = None
+_text_store_location = None
+
+
+def get_pdf_store():
+    """依 PDF_STORE 環境變數建立（並快取）儲存，未設定時回傳 None"""
+    global _store
+    location = os.environ.get("PDF_STORE", "").strip()
+    if not location:
+        return None
+    if _store is None:
+        _store = _open_store(location, PDF_SUFFIX)
+        print(f"🗄️ PDF 原始檔儲存: {location}")
+    return _store
+
+
+def get_text_store(default_location=None):
+    """依 PDF_TEXT_STORE（未設定時沿用 PDF_STORE）建立（並快取）文字儲存
+
+    兩者都未設定時使用 default_location，仍沒有時回傳 None
+    """
+    global _text_store, _text_store_location
+    location = (os.environ.get("PDF_TEXT_STORE", "").strip()
+                or os.environ.get("PDF_STORE", "").strip()
+                or default_location)
+    if not location:
+        return None
+    if _text_store is None or location != _text_store_location:
+        _text_store = _open_store(location, TEXT_SUFFIX)
+        _text_store_location = location
+        print(f"🗄️ PDF 文字快取: {location}")
+    return _text_store
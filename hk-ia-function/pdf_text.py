@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+PDF 文字擷取後端
+extract_sanction_entries 只需要依行序取得文字，不需要完整的版面分析；
+每個後端以相同介面逐頁產生文字，由環境變數 PDF_TEXT_BACKEND 選擇：
+  pdfplumber  逐字元版面分析（預設，與既有結果相同）
+  pdfminer    pdfminer 文字轉換器，關閉文字框排序等進階版面分析，速度較快
+可用 bench_text_backends.py 比較各後端的速度、記憶體與條目差異
+
+擷取結果可依 PDF 內容雜湊以 gzip JSON 保存到文字快取（pdf_store.get_text_store），
+修改條目抽取規則後只需重新抽取快取文字，不必重新下載與解析 PDF
+"""
+
+import io
+import os
+import gzip
+import json
+
+import pdfplumber
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+DEFAULT_TEXT_BACKEND = os.environ.get("PDF_TEXT_BACKEND", "pdfplumber")
+
+
+def pdfplumber_page_texts(pdf_path, start, stop):
+    """以 pdfplumber 逐頁擷取 [start, stop) 頁的文字，處理完每頁即釋放頁面快取"""
+    with pdfplumber.open(pdf_path, pages=range(start + 1, stop + 1)) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            page.close()
+            yield text
+
+
+# 只保留分行所需的版面分析：不排序文字框、不偵測直書、不分析圖形內文字
+_LIGHT_LAPARAMS = LAParams(boxes_flow=None, detect_vertical=False, all_texts=False)
+
+
+def pdfminer_page_texts(pdf_path, start, stop):
+    """以 pdfminer 文字轉換器逐頁擷取 [start, stop) 頁的文字"""
+    resource_manager = PDFResourceManager(caching=True)
+    buffer = io.StringIO()
+    device = TextConverter(resource_manager, buffer, laparams=_LIGHT_LAPARAMS)
+    interpreter = PDFPageInterpreter(resource_manager, device)
+    try:
+        with open(pdf_path, "rb") as f:
+            for page in PDFPage.get_pages(f, pagenos=set(range(start, stop))):
+                interpreter.process_page(page)
+                text = buffer.getvalue().rstrip("\f")
+                buffer.seek(0)
+                buffer.truncate(0)
+                yield text
+    finally:
+        device.close()
+
+
+TEXT_BACKENDS = {
+    "pdfplumber": pdfplumber_page_texts,
+    "pdfminer": pdfminer_page_texts,
+}
+
+
+def page_texts(pdf_path, start, stop, backend=None):
+    """以指定（或預設）後端逐頁產生 [start, stop) 頁的文字"""
+    name = backend or DEFAULT_TEXT_BACKEND
+    if name not in TEXT_BACKENDS:
+        raise ValueError(f"未知的 PDF 文字擷取後端: {name}（可用: {', '.join(TEXT_BACKENDS)}）")
+    return TEXT_BACKENDS[name](pdf_path, start, stop)
+
+
+def save_page_texts(store, sha256, pages, backend=None):
+    """將逐頁文字壓縮後存入文字快取"""
+    payload = {"backend": backend or DEFAULT_TEXT_BACKEND, "pages": list(pages)}
+    store.put_bytes(sha256, gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+
+
+def load_page_texts(store, sha256):
+    """從文字快取讀取逐頁文字，不存在時回傳 None"""
+    data = store.get_bytes(sha256)
+    if data is None:
+        return None
+    return json.loads(gzip.decompress(data).decode("utf-8"))["pages"]
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+SQLite 連線管理
+每個資料庫檔案共用一組連線：每個執行緒重複使用自己的唯讀連線（不必每次重新連線、
+頁面快取保持溫熱），所有寫入經由唯一的寫入連線並以鎖序列化；
+可就地修改的資料庫使用 WAL 模式，讀取不會被寫入阻塞
+
+只會整檔替換、不會就地修改的檔案（例如 gcs_db_cache 的本機副本）以 immutable=True 開啟：
+讀取不需加鎖也不建立 -wal/-shm，檔案被替換後各執行緒會自動改開新檔案；
+閒置執行緒仍開著的舊版本連線在 SQLITE_READER_STALE_SECONDS 秒後由管理器關閉，
+避免已刪除的舊檔案因仍被開啟而一直佔用磁碟空間
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 讀取連線的記憶體對映大小與每條連線的頁面快取（KiB），可由環境變數調整
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_KIB = int(os.environ.get("SQLITE_CACHE_KIB", 8 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+# 檔案被替換後，舊版本的唯讀連線保留多久（秒）才關閉；保留期間仍在使用它的查詢可以完成
+SQLITE_READER_STALE_SECONDS = float(os.environ.get("SQLITE_READER_STALE_SECONDS", 60))
+
+
+def configure_writer(conn):
+    """寫入連線的設定：WAL 模式讓讀取與寫入並行"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def open_reader(db_path, immutable=False, check_same_thread=True):
+    """開啟唯讀連線"""
+    uri = f"file:{os.path.abspath(db_path)}?mode=ro" + ("&immutable=1" if immutable else "")
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+    if not immutable:
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def checkpoint(db_path):
+    """將 WAL 內容寫回主檔案並清空 WAL（上傳資料庫檔案前呼叫）"""
+    if not os.path.exists(f"{db_path}-wal"):
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+class SQLiteConnections:
+    """單一資料庫檔案的連線管理（執行緒安全）
+
+    reader() 取得的連線由管理器擁有，呼叫端不要關閉；
+    resolve(build) 另外回傳依檔案版本快取的 build(conn) 結果（例如資料表結構與組好的 SQL）；
+    writer() 為 context manager，區塊正常結束時提交，發生例外時回滾
+    """
+
+    def __init__(self, db_path, immutable=False):
+        self.db_path = db_path
+        self.immutable = immutable
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._resolved = {}   # (檔案版本, build) -> 結果
+        self._resolved_lock = threading.Lock()
+        # 所有執行緒的唯讀連線 -> [檔案版本, 成為舊版本的時間或 None]
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        self._sweep_at = None   # 下一次有舊版本連線可以關閉的時間（monotonic）
+
+    def reader(self):
+        """目前執行緒的唯讀連線；檔案被替換（inode 改變）時重新開啟"""
+        if self._sweep_at is not None and time.monotonic() >= self._sweep_at:
+            self._close_stale_readers()
+        st = os.stat(self.db_path)
+        identity = (st.st_dev, st.st_ino)
+        conn = getattr(self._local, "conn", None)
+        # 連線可能已被當作舊版本關閉（其 inode 之後可能被新檔案重用），因此也確認仍在登記中
+        if conn is not None and self._local.identity == identity and conn in self._readers:
+            return conn
+        if conn is not None:
+            with self._readers_lock:
+                self._readers.pop(conn, None)
+            conn.close()
+        # 連線可能由其他執行緒關閉，因此不限制只能在建立的執行緒使用
+        conn = open_reader(self.db_path, self.immutable, check_same_thread=False)
+        self._register_reader(conn, identity)
+        self._local.conn = conn
+        self._local.identity = identity
+        return conn
+
+    def _register_reader(self, conn, identity):
+        """登記新連線，並把其他檔案版本的連線標記為舊版本"""
+        now = time.monotonic()
+        with self._readers_lock:
+            for entry in self._readers.values():
+                if entry[0] != identity and entry[1] is None:
+                    entry[1] = now
+                    if self._sweep_at is None:
+                        self._sweep_at = now + SQLITE_READER_STALE_SECONDS
+            self._readers[conn] = [identity, None]
+
+    def _close_stale_readers(self):
+        """關閉成為舊版本超過 SQLITE_READER_STALE_SECONDS 秒的連線（包含閒置執行緒的連線）"""
+        now = time.monotonic()
+        with self._readers_lock:
+            expired = [conn for conn, (_, since) in self._readers.items()
+                       if since is not None and now - since >= SQLITE_READER_STALE_SECONDS]
+            for conn in expired:
+                del self._readers[conn]
+            pending = [since for _, since in self._readers.values() if since is not None]
+            self._sweep_at = min(pending) + SQLITE_READER_STALE_SECONDS if pending else None
+        for conn in expired:
+            conn.close()
+
+    def resolve(self, build):
+        """回傳 (唯讀連線, build(conn))；同一檔案版本只執行一次 build，檔案被替換後重新執行"""
+        conn = self.reader()
+        key = (self._local.identity, build)
+        value = self._resolved.get(key)
+        if value is None:
+            value = build(conn)
+            with self._resolved_lock:
+                # 只保留目前檔案版本的結果
+                for stale in [k for k in self._resolved if k[0] != key[0]]:
+                    del self._resolved[stale]
+                self._resolved[key] = value
+        return conn, value
+
+    @contextmanager
+    def writer(self):
+        """取得唯一的寫入連線；同一時間只有一個執行緒寫入"""
+        if self.immutable:
+            raise RuntimeError(f"{self.db_path} 以唯讀（immutable）模式管理，不能寫入")
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = configure_writer(sqlite3.connect(self.db_path, check_same_thread=False))
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def checkpoint(self):
+        """將 WAL 內容寫回主檔案"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """關閉寫入連線與所有唯讀連線；之後取用時重新開啟"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            readers = list(self._readers)
+            self._readers.clear()
+            self._sweep_at = None
+        for conn in readers:
+            conn.close()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connections(db_path, immutable=False):
+    """取得（或建立）行程內共用的連線管理器"""
+    key = (os.path.abspath(db_path), immutable)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = SQLiteConnections(db_path, immutable)
+        return _managers[key]
+
+
+def close_connections(db_path):
+    """關閉並移除該檔案的連線管理器（檔案即將被整檔替換、移動或刪除時呼叫）"""
+    path = os.path.abspath(db_path)
+    with _managers_lock:
+        managers = [_managers.pop(key) for key in list(_managers) if key[0] == path]
+    for manager in managers:
+        manager.close()
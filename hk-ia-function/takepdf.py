@@ -1,19 +1,81 @@
 from google.cloud import storage
-import os, tempfile, sqlite3, requests, pdfplumber, random, string
+import os, sys, re, json, functools, hashlib, tempfile, sqlite3, requests, random, string, threading, multiprocessing, queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
+from pdf_store import get_pdf_store, get_text_store
+from gcs_db_cache import get_db_cache, invalidate_db_cache
+from aml_cursor import encode_cursor, decode_cursor
+from sqlite_connections import get_connections, close_connections, checkpoint
+from pdf_text import page_texts, save_page_texts, load_page_texts
 
 IA_INDEX_URL = "https://www.ia.org.hk/en/legislative_framework/circulars/antimoney_laundering/circulars_on_anti-money_laundering_matters.html"
 IA_BASE_URL = "https://www.ia.org.hk/en/legislative_framework/circulars/antimoney_laundering/"
 
 # ---------- DB 基礎 ----------
-def _connect(db_path):
-    return sqlite3.connect(db_path)
+def _query_conn(bucket_name, db_file):
+    """唯讀查詢連線與該 DB 版本的資料表結構，回傳 (conn, schema)
+
+    連線由每個執行緒重複使用，GCS 快取副本只會整檔替換，以 immutable 模式開啟；
+    schema 每個 DB 版本只解析一次（見 _profiles_schema）
+    """
+    manager = get_connections(cached_db_path(bucket_name, db_file), immutable=True)
+    return manager.resolve(_profiles_schema)
+
+def _profiles_schema(conn):
+    """解析查詢用的資料表結構並組好固定的 SQL
+
+    新版本用 aml_profiles，舊版本用 profiles；查詢熱路徑只使用這裡的結果，不再查詢 sqlite_master
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    table = 'aml_profiles' if 'aml_profiles' in tables else 'profiles'
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    has_source_fields = 'source_pdf' in columns and 'source_url' in columns
+    select_columns = "rowid, name, nationality, passport_no, year"
+    if has_source_fields:
+        select_columns += ", source_pdf, source_url"
+    return {
+        'table': table,
+        'has_source_fields': has_source_fields,
+        'select_columns': select_columns,
+        'name_fts': 'profiles_fts' in tables,
+        'profile_counts': table == 'profiles' and 'profile_counts' in tables,
+        'count_sql': f"SELECT COUNT(*) FROM {table}",
+        'year_stats_sql': f"SELECT year, COUNT(*) as count FROM {table} GROUP BY year ORDER BY year DESC",
+        'nationality_stats_sql': f"SELECT nationality, COUNT(*) as count FROM {table} GROUP BY nationality ORDER BY count DESC LIMIT 10",
+        'latest_year_sql': f"SELECT MAX(year) FROM {table}"
+    }
+
+@functools.lru_cache(maxsize=128)
+def _page_sql(table, select_columns, conditions):
+    """分頁查詢 SQL；相同條件組合回傳同一字串，讓連線的預備語句快取重複使用"""
+    clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return f"""
+            SELECT {select_columns}
+            FROM {table}{clause}
+            ORDER BY year DESC, name, rowid
+            LIMIT ? OFFSET ?
+            """
 
 def ensure_db_exists(local_path):
+    """建立或補齊表結構；也作為 gcs_db_cache 的 prepare，對隨即被移動的新下載檔案執行"""
     first_time = not os.path.exists(local_path)
-    conn = _connect(local_path)
+    with get_connections(local_path).writer() as conn:
+        _ensure_schema(conn)
+    # 檔案可能隨即被移動或整檔替換，不保留連線
+    close_connections(local_path)
+    if first_time:
+        print("✅ 建立新 DB 與表結構完成")
+
+def _ensure_schema(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS profiles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,8 +88,10 @@ def ensure_db_exists(local_path):
             created_at TEXT
         )
     """)
+    _ensure_column(conn, "profiles", "year", "INTEGER")
     _ensure_column(conn, "profiles", "nationality", "TEXT")
     _ensure_column(conn, "profiles", "passport_no", "TEXT")
+    _ensure_column(conn, "profiles", "source_pdf", "TEXT")
     _ensure_column(conn, "profiles", "source_url", "TEXT")
     _ensure_column(conn, "profiles", "created_at", "TEXT")
     conn.execute("""
@@ -39,22 +103,194 @@ def ensure_db_exists(local_path):
             processed_at TEXT
         )
     """)
-    conn.commit()
-    conn.close()
-    if first_time:
-        print("✅ 建立新 DB 與表結構完成")
+    # 舊版 processed_files 可能只有 source_pdf 或只有 source_url，補齊後以 source_pdf 為準
+    _ensure_column(conn, "processed_files", "file_path", "TEXT")
+    _ensure_column(conn, "processed_files", "source_url", "TEXT")
+    if _ensure_column(conn, "processed_files", "source_pdf", "TEXT"):
+        conn.execute("UPDATE processed_files SET source_pdf = source_url WHERE source_pdf IS NULL")
+    _ensure_column(conn, "processed_files", "processed_at", "TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            links TEXT,
+            fetched_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER,
+            entries_count INTEGER,
+            first_url TEXT,
+            created_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_urls (
+            source_url TEXT PRIMARY KEY,
+            sha256 TEXT,
+            year INTEGER,
+            linked_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pdf_urls_sha256 ON pdf_urls(sha256)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT,
+            years TEXT,
+            message TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crawl_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            kind TEXT,
+            year INTEGER,
+            url TEXT,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            updated_at TEXT,
+            UNIQUE (job_id, kind, year, url)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pdf_progress (
+            source_url TEXT PRIMARY KEY,
+            page_count INTEGER,
+            next_page INTEGER,
+            updated_at TEXT
+        )
+    """)
+    # 分頁排序（year DESC, name）與國籍過濾使用的索引；rowid 隱含在索引末端，可作為鍵集分頁的最後一鍵
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_profiles_year_name ON profiles(year DESC, name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_profiles_nationality_year_name ON profiles(nationality, year DESC, name)")
+    _ensure_profile_counts(conn)
+    _ensure_name_fts(conn)
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (name,)).fetchone() is not None
+
+def _ensure_profile_counts(conn):
+    """以觸發器維護各國籍的筆數，分頁查詢不必每次 COUNT(*) 全表
+
+    國籍為 NULL 的記錄計入空字串；第一次建立時由既有資料回填
+    """
+    existed = _has_table(conn, "profile_counts")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS profile_counts (
+            nationality TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profile_counts_ai AFTER INSERT ON profiles BEGIN
+            INSERT INTO profile_counts (nationality, count) VALUES (IFNULL(new.nationality, ''), 1)
+            ON CONFLICT (nationality) DO UPDATE SET count = count + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profile_counts_ad AFTER DELETE ON profiles BEGIN
+            UPDATE profile_counts SET count = count - 1 WHERE nationality = IFNULL(old.nationality, '');
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profile_counts_au AFTER UPDATE OF nationality ON profiles BEGIN
+            UPDATE profile_counts SET count = count - 1 WHERE nationality = IFNULL(old.nationality, '');
+            INSERT INTO profile_counts (nationality, count) VALUES (IFNULL(new.nationality, ''), 1)
+            ON CONFLICT (nationality) DO UPDATE SET count = count + 1;
+        END
+    """)
+    if not existed:
+        conn.execute("""
+            INSERT INTO profile_counts (nationality, count)
+            SELECT IFNULL(nationality, ''), COUNT(*) FROM profiles GROUP BY IFNULL(nationality, '')
+        """)
+
+def counted_profiles(conn, nationality=None):
+    """由 profile_counts 取得總筆數（或指定國籍的筆數）"""
+    if nationality:
+        row = conn.execute("SELECT count FROM profile_counts WHERE nationality=?", (nationality,)).fetchone()
+        return row[0] if row else 0
+    return conn.execute("SELECT IFNULL(SUM(count), 0) FROM profile_counts").fetchone()[0]
+
+def _ensure_name_fts(conn):
+    """建立 profiles.name 的 FTS5 trigram 索引，以觸發器與 profiles 保持同步
+
+    索引為外部內容表（不重複儲存姓名）；既有資料庫第一次建立時以 rebuild 回填。
+    case_sensitive 0 讓 FTS 表上的 LIKE '%x%' 使用索引，語意與原本的 LIKE 相同；
+    SQLite 不支援 FTS5 / trigram 時略過，查詢退回全表 LIKE
+    """
+    existed = _has_table(conn, "profiles_fts")
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5(
+                name, content='profiles', content_rowid='id', tokenize='trigram case_sensitive 0'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ SQLite 不支援 FTS5 trigram，姓名搜尋使用全表掃描: {e}")
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profiles_fts_ai AFTER INSERT ON profiles BEGIN
+            INSERT INTO profiles_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profiles_fts_ad AFTER DELETE ON profiles BEGIN
+            INSERT INTO profiles_fts (profiles_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS profiles_fts_au AFTER UPDATE OF name ON profiles BEGIN
+            INSERT INTO profiles_fts (profiles_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO profiles_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    """)
+    if not existed:
+        conn.execute("INSERT INTO profiles_fts (profiles_fts) VALUES ('rebuild')")
+        print("✅ 已建立姓名全文索引並回填既有資料")
+
+# trigram 索引需要搜尋字串中至少有 3 個連續的非萬用字元，否則在 FTS 表上反而是全表掃描
+_FTS_SEARCHABLE_RE = re.compile(r'[^%_]{3}')
+
+def _use_name_fts(schema, term):
+    """此搜尋字串是否能使用姓名全文索引"""
+    return schema['name_fts'] and bool(_FTS_SEARCHABLE_RE.search(term))
 
 def _ensure_column(conn, table, column, type_sql):
+    """欄位不存在時新增，回傳是否有新增"""
     cur = conn.execute(f"PRAGMA table_info({table})")
     cols = [row[1] for row in cur.fetchall()]
     if column not in cols:
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_sql}")
+        return True
+    return False
+
+# 未設定 PDF_TEXT_STORE / PDF_STORE 時，逐頁文字快取放在 DB 所在目錄下的這個子目錄
+TEXT_STORE_DIRNAME = "pdf_text_cache"
+
+def default_text_store_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), TEXT_STORE_DIRNAME)
 
 def download_db(bucket_name, db_file):
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(db_file)
     local_path = os.path.join(tempfile.gettempdir(), db_file)
+    # 先前執行的連線與殘留的 WAL 不屬於新下載的檔案，不能套用到新檔案上
+    close_connections(local_path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(local_path + suffix):
+            os.remove(local_path + suffix)
     try:
         blob.download_to_filename(local_path)
         print(f"✅ 已下載 DB: {local_path}")
@@ -69,289 +305,959 @@ def upload_db(bucket_name, db_file, local_path):
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(db_file)
+    # WAL 中尚未寫回主檔案的內容需先寫回，上傳的檔案才完整
+    checkpoint(local_path)
     blob.upload_from_filename(local_path)
+    invalidate_db_cache(bucket_name, db_file)
     print(f"✅ 已上傳 DB 到 {bucket_name}/{db_file}")
 
+def cached_db_path(bucket_name, db_file):
+    """唯讀查詢使用的本機 DB 路徑（行程內快取，只在 GCS 版本變更時重新下載）"""
+    return get_db_cache(bucket_name, db_file, prepare=ensure_db_exists).path()
+
 # ---------- 真實爬蟲 ----------
-def fetch_pdfs_for_year(year):
-    """從年份導覽頁找到該年度的 PDF 連結"""
-    print(f"🔍 抓取 {year} 年 PDF 連結...")
-    # 先抓年份導覽頁
-    index_resp = requests.get(IA_INDEX_URL, timeout=30)
-    index_resp.raise_for_status()
-    index_soup = BeautifulSoup(index_resp.text, "html.parser")
-
-    # 找到該年度的子頁面連結
-    year_link = None
-    for a in index_soup.find_all("a", href=True):
-        href = a["href"]
+def fetch_page_links(conn, url):
+    """以條件式請求取得頁面中所有連結的絕對網址，回傳 (links, changed)
+
+    http_cache 記錄每個網址上次的 ETag、Last-Modified、內容雜湊與解析出的連結；
+    伺服器回應 304 或內容雜湊未變時 changed 為 False，直接沿用上次的連結而不重新解析 HTML
+    """
+    cached = conn.execute(
+        "SELECT etag, last_modified, content_hash, links FROM http_cache WHERE url=?", (url,)
+    ).fetchone()
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+
+    resp = _http_session().get(url, headers=headers, timeout=30)
+    if resp.status_code == 304 and cached:
+        return json.loads(cached[3]), False
+    resp.raise_for_status()
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    content_hash = hashlib.sha256(resp.content).hexdigest()
+    if cached and cached[2] == content_hash:
+        links, changed = json.loads(cached[3]), False
+    else:
+        soup = BeautifulSoup(resp.text, "html.parser")
+        links = [urljoin(url, a["href"]) for a in soup.find_all("a", href=True)]
+        changed = True
+
+    if not cached or (etag, last_modified, content_hash) != tuple(cached[:3]):
+        conn.execute("""
+            INSERT OR REPLACE INTO http_cache (url, etag, last_modified, content_hash, links, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (url, etag, last_modified, content_hash, json.dumps(links), _now()))
+        conn.commit()
+    return links, changed
+
+def year_page_url(index_links, year):
+    """年份導覽頁中該年度子頁面的網址"""
+    for href in index_links:
         if f"circulars_on_anti-money_laundering_matters_{year}" in href and href.endswith(".html"):
-            year_link = urljoin(IA_BASE_URL, href)
-            break
+            return href
+    # 備用方案：直接用年份 URL 格式
+    year_link = f"{IA_BASE_URL}circulars_on_anti-money_laundering_matters_{year}.html"
+    print(f"🔄 主頁面未找到年份連結，使用備用 URL: {year_link}")
+    return year_link
 
-    if not year_link:
-        # 備用方案：直接用年份 URL 格式
-        year_link = f"{IA_BASE_URL}circulars_on_anti-money_laundering_matters_{year}.html"
-        print(f"🔄 主頁面未找到年份連結，使用備用 URL: {year_link}")
+def fetch_pdfs_for_year(year, conn):
+    """從年份導覽頁找到該年度的 PDF 連結，回傳 (pdf_links, changed)
+
+    changed 為 False 代表年度頁面自上次抓取後沒有變更
+    """
+    print(f"🔍 抓取 {year} 年 PDF 連結...")
+    # 先抓年份導覽頁，找到該年度的子頁面連結
+    index_links, _ = fetch_page_links(conn, IA_INDEX_URL)
+    year_link = year_page_url(index_links, year)
 
     # 進入年度頁面找 PDF
-    year_resp = requests.get(year_link, timeout=30)
-    year_resp.raise_for_status()
-    year_soup = BeautifulSoup(year_resp.text, "html.parser")
-
-    pdf_links = []
-    for a in year_soup.find_all("a", href=True):
-        href = a["href"]
-        if href.lower().endswith(".pdf"):
-            full_pdf_url = urljoin(year_link, href)
-            pdf_links.append(full_pdf_url)
-
-    print(f"📄 {year} 年找到 {len(pdf_links)} 個 PDF")
-    return pdf_links
-
-def process_pdfs(pdf_urls, db_path, year):
-    conn = _connect(db_path)
-    processed_count = 0
+    year_links, changed = fetch_page_links(conn, year_link)
+    pdf_links = [href for href in year_links if href.lower().endswith(".pdf")]
+
+    print(f"📄 {year} 年找到 {len(pdf_links)} 個 PDF{'' if changed else '（頁面未變更）'}")
+    return pdf_links, changed
+
+# ---------- 下載 ----------
+# 同時下載的 PDF 數量與對同一主機的連線上限
+DOWNLOAD_WORKERS = int(os.environ.get("PDF_DOWNLOAD_WORKERS", 4))
+PER_HOST_LIMIT = int(os.environ.get("PDF_PER_HOST_LIMIT", 2))
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+
+def _http_session():
+    """共用的 HTTP session：連線池重用 + 失敗時指數退避重試"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=1,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+                respect_retry_after_header=True
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4,
+                                  pool_maxsize=max(DOWNLOAD_WORKERS, PER_HOST_LIMIT))
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def _host_slot(url):
+    """取得該主機的併發上限信號量"""
+    host = urlparse(url).netloc
+    with _session_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_slots[host]
+
+def download_pdf(url):
+    """串流下載 PDF 到臨時檔案，同時計算 SHA-256，回傳 (檔案路徑, sha256)"""
+    print(f"⬇️ 下載 PDF: {os.path.basename(url)}")
+    fd, pdf_path = tempfile.mkstemp(prefix="temp_", suffix=".pdf")
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f, _host_slot(url):
+            with _http_session().get(url, timeout=60, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=65536):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+    except Exception:
+        _remove_temp(pdf_path)
+        raise
+    return pdf_path, digest.hexdigest()
+
+def _remove_temp(pdf_path):
+    if pdf_path and os.path.exists(pdf_path):
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
+
+# ---------- 解析 ----------
+# 解析用的行程數（文字擷取為 CPU 密集，<= 1 時在下載執行緒內直接解析）與每個工作單位的頁數
+PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 10))
+
+def entry_tuples(texts):
+    """從逐頁文字抽取有效條目，回傳 (name, nationality, passport_no) 元組清單"""
+    results = []
+    for text in texts:
+        for entry in extract_sanction_entries(text):
+            if entry['name'] and entry['name'] != 'Unknown' and len(entry['name']) > 3:
+                results.append((entry['name'], entry['nationality'], entry['passport_no']))
+    return results
+
+def parse_page_range(pdf_path, start, stop, backend=None, keep_text=False):
+    """解析 PDF 的 [start, stop) 頁，回傳 (條目元組清單, 逐頁文字或 None)
+
+    文字由 pdf_text 的擷取後端逐頁產生（預設依 PDF_TEXT_BACKEND）；每個區段重新開啟文件，
+    記憶體用量只與區段大小有關；可於解析行程中執行，只回傳精簡元組以降低跨行程傳輸成本，
+    需要寫入文字快取時才以 keep_text 一併回傳頁面文字
+    """
+    texts = list(page_texts(pdf_path, start, stop, backend))
+    return entry_tuples(texts), (texts if keep_text else None)
+
+def pdf_page_count(pdf_path):
+    """讀取 PDF 頁數（不解析頁面內容）
+
+    優先讀取頁面樹的 /Count（可能是間接物件）；缺少或無效時改為逐一列舉頁面計數
+    """
+    with open(pdf_path, "rb") as f:
+        document = PDFDocument(PDFParser(f))
+        try:
+            count = resolve1(resolve1(document.catalog["Pages"])["Count"])
+            if isinstance(count, int) and count >= 0:
+                return count
+        except (KeyError, TypeError):
+            pass
+        return sum(1 for _ in PDFPage.create_pages(document))
+
+def parse_pdf(url, pdf_path, parse_pool=None, start_page=0, keep_text=False):
+    """由 start_page 開始依頁序逐段解析 PDF，產生 (page_count, 區段結束頁, 條目元組清單, 逐頁文字或 None)
+
+    提供 parse_pool 時將頁面切成 PAGES_PER_TASK 頁一組分派給解析行程，仍依頁序產生結果
+    """
+    page_count = pdf_page_count(pdf_path)
+    if start_page:
+        print(f"📖 PDF 共 {page_count} 頁，從第 {start_page + 1} 頁繼續")
+    else:
+        print(f"📖 PDF 共 {page_count} 頁")
     
-    print(f"📊 開始處理 {len(pdf_urls)} 個 PDF 檔案")
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count))
+              for start in range(start_page, page_count, PAGES_PER_TASK)]
     
-    for i, url in enumerate(pdf_urls):
-        print(f"� 處理 PDF {i+1}/{len(pdf_urls)}: {os.path.basename(url)}")
-        
-        # 每個 PDF 單獨處理，立即存入 DB 並釋放記憶體
-        if process_single_pdf(url, conn, year):
-            processed_count += 1
-            # 立即提交到資料庫
-            conn.commit()
-            print(f"✅ PDF {i+1} 處理完成，已存入 DB")
-        else:
-            print(f"⏩ PDF {i+1} 跳過或失敗")
-        
-        # 每 5 個 PDF 後強制垃圾回收
-        if (i + 1) % 5 == 0:
-            import gc
-            gc.collect()
-            print(f"🧹 已清理記憶體 (處理了 {i+1} 個 PDF)")
+    if parse_pool is None:
+        for start, stop in ranges:
+            yield (page_count, stop, *parse_page_range(pdf_path, start, stop, keep_text=keep_text))
+        return
     
-    conn.close()
-    print(f"🎉 全部完成！共成功處理 {processed_count} 個 PDF")
-    return processed_count
+    futures = [(stop, parse_pool.submit(parse_page_range, pdf_path, start, stop, keep_text=keep_text))
+               for start, stop in ranges]
+    try:
+        for stop, future in futures:
+            yield (page_count, stop, *future.result())
+    finally:
+        for _, future in futures:
+            future.cancel()
 
-def process_single_pdf(url, conn, year):
-    """處理單個 PDF 檔案，立即存入 DB 並釋放記憶體"""
-    # 檢查是否已處理過 - 兼容舊資料庫結構
+def create_parse_pool():
+    """建立解析行程池；PARSE_WORKERS <= 1 時回傳 None
+
+    使用 spawn 啟動子行程，避免在有背景執行緒（gRPC、下載執行緒）的行程中 fork
+    """
+    if PARSE_WORKERS <= 1:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=PARSE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        max_tasks_per_child=50
+    )
+
+def parse_pool_usable(parse_pool):
+    """解析行程池是否仍可使用；子行程異常結束（如記憶體不足被終止）後整個行程池都會失效"""
     try:
-        cur = conn.execute("SELECT 1 FROM processed_files WHERE source_pdf=?", (url,))
-    except sqlite3.OperationalError:
-        # 如果舊欄位不存在，嘗試新欄位結構
-        try:
-            cur = conn.execute("SELECT 1 FROM processed_files WHERE source_url=?", (url,))
-        except sqlite3.OperationalError:
-            # 如果表格不存在，建立新表格
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS processed_files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    file_path TEXT,
-                    source_pdf TEXT,
-                    source_url TEXT,
-                    processed_at TEXT
-                )
-            """)
-            conn.commit()
-            cur = conn.execute("SELECT 1 FROM processed_files WHERE source_url=?", (url,))
-    
-    if cur.fetchone():
-        print(f"⏩ 已處理過，跳過: {os.path.basename(url)}")
+        parse_pool.submit(int).result()
+    except BrokenProcessPool:
         return False
+    return True
+
+def fetch_and_parse(url, emit, claim_hash, parse_pool=None, checkpoint=None, text_store=None):
+    """下載並逐段解析單個 PDF（於工作執行緒執行，不接觸 DB）
 
-    pdf_path = None
+    結果以 emit() 依序回報給寫入者：
+      ('duplicate', url, sha256)                      內容與已知 PDF 相同，只需連結網址
+      ('reset', url)                                  檢查點失效，需清除先前寫入的部分條目
+      ('range', url, page_count, next_page, entries)  一個頁面區段的條目
+      ('done', url, entries_count, sha256, size)      結束；失敗時 entries_count 為 None
+    claim_hash(sha256) 回傳 False 代表相同內容已處理過（或正由其他執行緒處理）；
+    checkpoint 為 pdf_progress 中的 (page_count, next_page)；
+    提供 text_store 時，解析完成後將逐頁文字存入快取供 reprocess 使用
+    """
+    entries_count = None
+    pdf_path = sha256 = None
+    size = 0
     try:
-        # 使用串流下載，減少記憶體使用
-        print(f"⬇️ 下載 PDF: {os.path.basename(url)}")
-        r = requests.get(url, timeout=60, stream=True)
-        r.raise_for_status()
+        pdf_path, sha256 = download_pdf(url)
+        if not claim_hash(sha256):
+            print(f"♻️ 內容與已處理的 PDF 相同，跳過解析: {os.path.basename(url)}")
+            emit(('duplicate', url, sha256))
+            return
         
-        pdf_path = os.path.join(tempfile.gettempdir(), f"temp_{os.getpid()}_{os.path.basename(url)}")
+        size = os.path.getsize(pdf_path)
+        store = get_pdf_store()
+        if store is not None:
+            store.put(sha256, pdf_path)
         
-        # 串流寫入檔案
-        with open(pdf_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        print(f"🔍 解析 PDF: {os.path.basename(url)}")
         
-        # 立即釋放下載物件
-        r.close()
-        del r
+        start_page = 0
+        if checkpoint:
+            # 頁數不同代表來源檔案已變更，從頭重新解析
+            if checkpoint[0] == pdf_page_count(pdf_path):
+                start_page = checkpoint[1]
+            else:
+                emit(('reset', url))
         
+        # 從檢查點繼續時，先補上已略過頁面的文字（只擷取文字，不重新寫入條目）
+        texts = list(page_texts(pdf_path, 0, start_page)) if text_store is not None and start_page else []
+        count = 0
+        for page_count, next_page, entries, range_texts in parse_pdf(
+                url, pdf_path, parse_pool, start_page, keep_text=text_store is not None):
+            emit(('range', url, page_count, next_page, entries))
+            count += len(entries)
+            if range_texts is not None:
+                texts.extend(range_texts)
+        entries_count = count
+        
+        if text_store is not None:
+            try:
+                save_page_texts(text_store, sha256, texts)
+            except Exception as e:
+                print(f"⚠️ 文字快取寫入失敗 {os.path.basename(url)}: {e}")
     except Exception as e:
-        print(f"❌ 下載失敗 {os.path.basename(url)}: {e}")
+        stage = "下載失敗" if pdf_path is None else "PDF 解析錯誤"
+        print(f"❌ {stage} {os.path.basename(url)}: {e}")
+    finally:
+        _remove_temp(pdf_path)
+    emit(('done', url, entries_count, sha256, size))
+
+# ---------- 寫入 ----------
+def is_processed(conn, url):
+    """檢查是否已處理過（表結構已由 ensure_db_exists 補齊）"""
+    return conn.execute("SELECT 1 FROM processed_files WHERE source_pdf=?", (url,)).fetchone() is not None
+
+def known_hashes(conn):
+    """已解析過的 PDF 內容雜湊"""
+    return {row[0] for row in conn.execute("SELECT sha256 FROM pdf_blobs")}
+
+def link_pdf_url(conn, url, sha256, year):
+    """記錄網址對應的 PDF 內容"""
+    conn.execute("""
+        INSERT OR REPLACE INTO pdf_urls (source_url, sha256, year, linked_at)
+        VALUES (?, ?, ?, ?)
+    """, (url, sha256, year, _now()))
+
+def load_checkpoint(conn, url):
+    """讀取中斷解析的檢查點，回傳 (page_count, next_page) 或 None"""
+    return conn.execute(
+        "SELECT page_count, next_page FROM pdf_progress WHERE source_url=?", (url,)
+    ).fetchone()
+
+def save_pdf_entries(conn, url, year, entries):
+    """寫入條目（entries 為 (name, nationality, passport_no) 元組清單），同一預備語句批次執行"""
+    created_at = _now()
+    conn.executemany("""
+        INSERT INTO profiles (year, name, nationality, passport_no, source_pdf, source_url, created_at) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(year, name, nationality, passport_no, url, url, created_at)
+          for name, nationality, passport_no in entries])
+
+def mark_pdf_processed(conn, url):
+    """記錄已處理的檔案"""
+    conn.execute("INSERT INTO processed_files (source_pdf, source_url, processed_at) VALUES (?, ?, ?)", (url, url, _now()))
+    conn.execute("DELETE FROM pdf_progress WHERE source_url=?", (url,))
+
+def write_result(conn, year, item):
+    """寫入 fetch_and_parse 回報的一筆結果（只由單一寫入者呼叫）
+
+    每個頁面區段的條目與檢查點在同一個交易中提交，中斷後可從下一個區段繼續；
+    回傳 item 為 'done' / 'duplicate' 時該網址是否處理成功，其餘回傳 None
+    """
+    kind, url = item[0], item[1]
+    if kind == 'duplicate':
+        sha256 = item[2]
+        link_pdf_url(conn, url, sha256, year)
+        # 相同內容若仍在本次執行中解析，待其完成時再一併標記為已處理
+        if conn.execute("SELECT 1 FROM pdf_blobs WHERE sha256=?", (sha256,)).fetchone():
+            mark_pdf_processed(conn, url)
+        conn.commit()
+        return True
+    
+    if kind == 'reset':
+        conn.execute("DELETE FROM profiles WHERE source_pdf=?", (url,))
+        conn.execute("DELETE FROM pdf_progress WHERE source_url=?", (url,))
+        conn.commit()
+        print(f"🔄 {os.path.basename(url)} 已變更，重新解析")
+        return None
+    
+    if kind == 'range':
+        _, _, page_count, next_page, entries = item
+        save_pdf_entries(conn, url, year, entries)
+        conn.execute("""
+            INSERT OR REPLACE INTO pdf_progress (source_url, page_count, next_page, updated_at)
+            VALUES (?, ?, ?, ?)
+        """, (url, page_count, next_page, _now()))
+        conn.commit()
+        print(f"  💾 {os.path.basename(url)} 已處理 {next_page}/{page_count} 頁，提交到 DB")
+        return None
+    
+    _, _, entries_count, sha256, size = item
+    if entries_count is None:
         return False
+    conn.execute("""
+        INSERT OR IGNORE INTO pdf_blobs (sha256, size, entries_count, first_url, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (sha256, size, entries_count, url, _now()))
+    link_pdf_url(conn, url, sha256, year)
+    mark_pdf_processed(conn, url)
+    # 本次執行中內容相同、等待中的網址
+    waiting = conn.execute("SELECT source_url FROM pdf_urls WHERE sha256=? AND source_url<>?", (sha256, url)).fetchall()
+    for (other_url,) in waiting:
+        if not is_processed(conn, other_url):
+            mark_pdf_processed(conn, other_url)
+    conn.commit()
+    print(f"📝 從 {os.path.basename(url)} 提取了 {entries_count} 個條目")
+    return True
 
-    entries_count = 0
+def process_pdfs(pdf_urls, conn, year, parse_pool=None, text_store=None):
+    """併發下載 PDF、以多行程逐段解析，由目前執行緒以 conn（呼叫端持有的寫入連線）寫入 DB
+
+    parse_pool 由呼叫端提供時沿用並由呼叫端負責關閉，否則自行建立並在結束時關閉；
+    text_store 為逐頁文字的保存位置，None 時不保存
+    """
+    own_pool = False
     try:
-        print(f"🔍 解析 PDF: {os.path.basename(url)}")
-        # 處理 PDF
-        with pdfplumber.open(pdf_path) as pdf:
-            # 限制處理的頁數，避免記憶體爆炸  
-            max_pages = min(30, len(pdf.pages))  # 最多 30 頁
-            print(f"📖 PDF 共 {len(pdf.pages)} 頁，處理前 {max_pages} 頁")
-            
-            for page_num in range(max_pages):
-                page = pdf.pages[page_num]
-                text = page.extract_text() or ""
-                
-                # 立即處理當前頁面的條目
-                entries = extract_sanction_entries(text)
-                for entry in entries:
-                    if entry['name'] and entry['name'] != 'Unknown' and len(entry['name']) > 3:
-                        try:
-                            # 嘗試新資料庫結構
-                            conn.execute("""
-                                INSERT INTO profiles (year, name, nationality, passport_no, source_pdf, source_url, created_at) 
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                            """, (year, entry['name'], entry['nationality'], entry['passport_no'], url, url, _now()))
-                        except sqlite3.OperationalError:
-                            # 如果失敗，使用舊資料庫結構
-                            conn.execute("""
-                                INSERT INTO profiles (year, name, nationality, passport_no, source_pdf, created_at) 
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, (year, entry['name'], entry['nationality'], entry['passport_no'], url, _now()))
-                        entries_count += 1
-                
-                # 立即釋放當前頁面的記憶體
-                del text, entries
-                
-                # 每 10 頁提交一次，避免資料丟失
-                if (page_num + 1) % 10 == 0:
-                    conn.commit()
-                    import gc
-                    gc.collect()
-                    print(f"  💾 已處理 {page_num + 1} 頁，提交到 DB")
+        processed_count = 0
         
-        # 記錄已處理的檔案 - 兼容新舊資料庫結構
-        try:
-            conn.execute("INSERT INTO processed_files (source_pdf, source_url, processed_at) VALUES (?, ?, ?)", (url, url, _now()))
-        except sqlite3.OperationalError:
-            # 如果新欄位不存在，使用舊格式
-            conn.execute("INSERT INTO processed_files (source_pdf) VALUES (?)", (url,))
-        print(f"📝 從 {os.path.basename(url)} 提取了 {entries_count} 個條目")
-        return True
+        pending = []
+        for url in pdf_urls:
+            if is_processed(conn, url):
+                print(f"⏩ 已處理過，跳過: {os.path.basename(url)}")
+            elif url not in pending:
+                pending.append(url)
         
-    except Exception as e:
-        print(f"❌ PDF 解析錯誤 {os.path.basename(url)}: {e}")
-        return False
-    finally:
-        # 確保清理臨時檔案
-        if pdf_path and os.path.exists(pdf_path):
-            try:
-                os.remove(pdf_path)
-                print(f"🗑️ 已清理臨時檔案: {os.path.basename(pdf_path)}")
-            except:
-                pass
+        if not pending:
+            print("🎉 沒有需要處理的新 PDF")
+            return 0
         
-        # 強制垃圾回收
-        import gc
-        gc.collect()
-
-# ---------- 更新流程 ----------
-def get_existing_years(db_path):
-    conn = _connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT year FROM profiles WHERE year IS NOT NULL ORDER BY year")
-    years = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return years
+        if parse_pool is None:
+            parse_pool = create_parse_pool()
+            own_pool = True
+        print(f"📊 開始處理 {len(pending)} 個 PDF 檔案"
+              f"（{DOWNLOAD_WORKERS} 個下載執行緒，{PARSE_WORKERS if parse_pool else 0} 個解析行程）")
+        
+        # 內容雜湊的認領集合：同一份內容只由第一個下載到的執行緒解析
+        claimed = known_hashes(conn)
+        claimed_lock = threading.Lock()
+        def claim_hash(sha256):
+            with claimed_lock:
+                if sha256 in claimed:
+                    return False
+                claimed.add(sha256)
+                return True
+        
+        # 下載執行緒把頁面區段交給解析行程，結果經佇列回到本執行緒寫入 DB
+        results = queue.Queue()
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            for url in pending:
+                executor.submit(fetch_and_parse, url, results.put, claim_hash, parse_pool,
+                                load_checkpoint(conn, url), text_store)
+            
+            finished = 0
+            while finished < len(pending):
+                item = results.get()
+                ok = write_result(conn, year, item)
+                if ok is None:
+                    continue
+                finished += 1
+                if ok:
+                    processed_count += 1
+                    print(f"✅ PDF {finished}/{len(pending)} 處理完成，已存入 DB")
+                else:
+                    print(f"⏩ PDF {finished}/{len(pending)} 跳過或失敗: {os.path.basename(item[1])}")
+        
+        print(f"🎉 全部完成！共成功處理 {processed_count} 個 PDF")
+        return processed_count
+    finally:
+        # 寫入 DB 失敗等例外也要結束解析行程
+        if own_pool and parse_pool is not None:
+            parse_pool.shutdown()
 
-def run_crawler(bucket_name, db_file):
-    start_time = datetime.now()
+def process_single_pdf(url, conn, year):
+    """處理單個 PDF 檔案並存入 DB（循序版本）"""
+    if is_processed(conn, url):
+        print(f"⏩ 已處理過，跳過: {os.path.basename(url)}")
+        return False
     
-    # 1. 從雲端下載現有的 DB 檔案到本地臨時目錄
-    db_path = download_db(bucket_name, db_file)
+    outcome = []
+    def emit(item):
+        ok = write_result(conn, year, item)
+        if ok is not None:
+            outcome.append(ok)
+    
+    def claim_hash(sha256):
+        return not conn.execute("SELECT 1 FROM pdf_blobs WHERE sha256=?", (sha256,)).fetchone()
     
-    # 2. 檢查已有的年份資料
-    years = get_existing_years(db_path)
+    fetch_and_parse(url, emit, claim_hash, checkpoint=load_checkpoint(conn, url))
+    return outcome[0]
+
+# ---------- 更新流程 ----------
+# 單次執行的時間預算（秒），超過後暫停工作，下次執行從佇列中剩餘的項目繼續
+CRAWL_TIME_BUDGET = int(os.environ.get("CRAWL_TIME_BUDGET", 3000))
+# 每個項目最多嘗試次數（跨多次執行累計）
+CRAWL_MAX_ATTEMPTS = 3
+# 每批交給 process_pdfs 的 PDF 數，批次之間檢查時間並上傳 DB
+CRAWL_BATCH_SIZE = int(os.environ.get("CRAWL_BATCH_SIZE", 20))
+
+def get_existing_years(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT year FROM profiles WHERE year IS NOT NULL ORDER BY year"
+    )]
+
+def years_to_fetch(existing_years):
+    """依 DB 已有的年份決定需要檢查的年份：空 DB 檢查所有年份，否則只檢查當前年份"""
+    current_year = datetime.now().year
+    if not existing_years:
+        return list(range(2001, current_year + 1))
+    return [current_year]
+
+def plan_years(conn):
+    """決定新工作需要檢查的年份"""
+    years = get_existing_years(conn)
     current_year = datetime.now().year
     
     # 簡化邏輯：只處理當前年份（自動適應未來年份）
     # 犯罪名單不溯及過往，過去沒有的年份就永遠沒有
     # 2025年可作為測試年份，之後系統會自動處理2026、2027等
     
+    planned = years_to_fetch(years)
     if not years:
         # 空 DB，從2001年開始處理到當前年份
-        years_to_fetch = list(range(2001, current_year + 1))
-        print(f"📅 首次執行 → 處理所有年份: {len(years_to_fetch)} 年 ({min(years_to_fetch)}-{max(years_to_fetch)})")
+        print(f"📅 首次執行 → 處理所有年份: {len(planned)} 年 ({min(planned)}-{max(planned)})")
     else:
-        # 有資料，只檢查當前年份是否有新資料
-        if current_year not in years:
-            years_to_fetch = [current_year]
-            print(f"📅 DB 已有年份: {sorted(years)}")
-            print(f"📅 檢查新年份: {current_year}")
-        else:
-            years_to_fetch = [current_year]  # 即使有資料，也檢查當前年份的新檔案
-            print(f"📅 DB 已有年份: {sorted(years)}")
-            print(f"📅 檢查當前年份新檔案: {current_year}")
+        # 有資料，只檢查當前年份是否有新資料（即使有資料，也檢查當前年份的新檔案）
+        print(f"📅 DB 已有年份: {sorted(years)}")
+        print(f"📅 檢查{'當前年份新檔案' if current_year in years else '新年份'}: {current_year}")
+    return planned
+
+def active_crawl_job(conn):
+    """取得尚未完成的爬取工作 ID（上次執行被中斷或超時暫停）"""
+    row = conn.execute(
+        "SELECT id FROM crawl_jobs WHERE status IN ('running', 'paused') ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    return row[0] if row else None
+
+def create_crawl_job(conn, years):
+    """建立爬取工作，佇列中先放入每個年份頁面的列舉項目"""
+    now = _now()
+    cur = conn.execute(
+        "INSERT INTO crawl_jobs (status, years, created_at, updated_at) VALUES ('running', ?, ?, ?)",
+        (json.dumps(years), now, now)
+    )
+    job_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO crawl_items (job_id, kind, year, url, status, updated_at) VALUES (?, 'year', ?, '', 'pending', ?)",
+        [(job_id, year, now) for year in years]
+    )
+    conn.commit()
+    return job_id
+
+def set_job_status(conn, job_id, status, message=None):
+    now = _now()
+    finished_at = now if status in ('completed', 'failed') else None
+    conn.execute(
+        "UPDATE crawl_jobs SET status=?, message=?, updated_at=?, finished_at=? WHERE id=?",
+        (status, message, now, finished_at, job_id)
+    )
+    conn.commit()
+
+def finish_item(conn, item_id, ok, error=None):
+    """更新項目狀態；失敗達 CRAWL_MAX_ATTEMPTS 次後不再重試"""
+    if ok:
+        conn.execute(
+            "UPDATE crawl_items SET status='done', attempts=attempts+1, error=NULL, updated_at=? WHERE id=?",
+            (_now(), item_id)
+        )
+    else:
+        conn.execute("""
+            UPDATE crawl_items
+            SET attempts=attempts+1,
+                status=CASE WHEN attempts+1 >= ? THEN 'failed' ELSE 'pending' END,
+                error=?, updated_at=?
+            WHERE id=?
+        """, (CRAWL_MAX_ATTEMPTS, error, _now(), item_id))
+
+def next_crawl_items(conn, job_id, after_id):
+    """取得下一批待處理項目：一個年份列舉項目，或同一年份最多 CRAWL_BATCH_SIZE 個 PDF"""
+    first = conn.execute("""
+        SELECT id, kind, year, url FROM crawl_items
+        WHERE job_id=? AND status='pending' AND id>?
+        ORDER BY id LIMIT 1
+    """, (job_id, after_id)).fetchone()
+    if first is None or first[1] == 'year':
+        return [first] if first else []
+    return conn.execute("""
+        SELECT id, kind, year, url FROM crawl_items
+        WHERE job_id=? AND status='pending' AND id>=? AND kind='pdf' AND year=?
+        ORDER BY id LIMIT ?
+    """, (job_id, first[0], first[2], CRAWL_BATCH_SIZE)).fetchall()
+
+# ---------- 未變更時提早結束 ----------
+# 上次完成的爬取工作所檢查頁面的驗證資訊存放在 DB 旁的小型 GCS 物件，
+# 下次執行先以條件式請求確認頁面都未變更，不必下載整個 DB 也不建立爬取工作
+CRAWL_STATE_SUFFIX = ".crawl_state.json"
 
-    if not years_to_fetch:
-        print("📅 沒有新資料需要處理")
+def load_crawl_state(bucket_name, db_file):
+    """讀取爬取狀態物件，不存在或無法解析時回傳 None"""
+    blob = storage.Client().bucket(bucket_name).blob(db_file + CRAWL_STATE_SUFFIX)
+    try:
+        return json.loads(blob.download_as_bytes())
+    except Exception as e:
+        print(f"ℹ️ 沒有可用的爬取狀態（{e}），執行完整檢查")
+        return None
+
+def save_crawl_state(bucket_name, db_file, state):
+    """寫入爬取狀態物件，state 另記錄目前 GCS 上 DB 的 generation"""
+    bucket = storage.Client().bucket(bucket_name)
+    db_blob = bucket.get_blob(db_file)
+    if db_blob is None:
         return
+    state = dict(state, db_generation=db_blob.generation)
+    bucket.blob(db_file + CRAWL_STATE_SUFFIX).upload_from_string(
+        json.dumps(state), content_type="application/json"
+    )
+
+def db_generation(bucket_name, db_file):
+    """GCS 上 DB 目前的 generation，不存在時回傳 None"""
+    blob = storage.Client().bucket(bucket_name).get_blob(db_file)
+    return blob.generation if blob is not None else None
+
+def build_crawl_state(conn):
+    """工作完成時的爬取狀態：已有的年份、下次要檢查的年份頁面與各頁面的驗證資訊
+
+    有頁面不在 http_cache 中（例如抓取失敗）時回傳 None，下次執行完整檢查
+    """
+    existing_years = get_existing_years(conn)
+    index = conn.execute("SELECT links FROM http_cache WHERE url=?", (IA_INDEX_URL,)).fetchone()
+    if index is None:
+        return None
+    index_links = json.loads(index[0])
+    year_urls = {str(year): year_page_url(index_links, year) for year in years_to_fetch(existing_years)}
+    pages = {}
+    for url in [IA_INDEX_URL, *year_urls.values()]:
+        row = conn.execute(
+            "SELECT etag, last_modified, content_hash FROM http_cache WHERE url=?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        pages[url] = list(row)
+    return {"existing_years": existing_years, "year_urls": year_urls, "pages": pages}
 
-    print(f"🎯 計劃處理 {len(years_to_fetch)} 個年份")
+def page_unchanged(url, validators):
+    """以上次的 ETag / Last-Modified 發出條件式請求，回應 304 或內容雜湊相同時視為未變更"""
+    etag, last_modified, content_hash = validators
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    resp = _http_session().get(url, headers=headers, timeout=30)
+    if resp.status_code == 304:
+        return True
+    return resp.ok and hashlib.sha256(resp.content).hexdigest() == content_hash
+
+def crawl_unchanged(bucket_name, db_file):
+    """上次工作已完成、DB 之後未被替換，且要檢查的頁面都未變更時回傳 True（不下載 DB）"""
+    state = load_crawl_state(bucket_name, db_file)
+    if not state:
+        return False
+    if db_generation(bucket_name, db_file) != state.get("db_generation"):
+        print("ℹ️ DB 在上次爬取後已被更新，執行完整檢查")
+        return False
+    # 跨年後要檢查的年份改變，上次記錄的頁面不夠用
+    years = [str(year) for year in years_to_fetch(state["existing_years"])]
+    if set(years) != set(state["year_urls"]):
+        return False
+    try:
+        for url in [IA_INDEX_URL, *(state["year_urls"][year] for year in years)]:
+            validators = state["pages"].get(url)
+            if validators is None or not page_unchanged(url, validators):
+                return False
+    except Exception as e:
+        print(f"⚠️ 條件式請求失敗（{e}），執行完整檢查")
+        return False
+    return True
+
+def run_crawler(bucket_name, db_file):
+    """執行（或續跑）爬取工作，回傳工作摘要
+
+    上次工作已完成且頁面都未變更時直接回傳 status='unchanged'，不下載 DB、不建立工作
+    """
+    start_time = datetime.now()
+    
+    # 1. 先以條件式請求確認是否有變更，沒有時不必下載 DB
+    if crawl_unchanged(bucket_name, db_file):
+        elapsed = (datetime.now() - start_time).total_seconds()
+        print(f"✅ 所有頁面均未變更，略過本次爬取（耗時 {elapsed:.2f} 秒）")
+        return {"job_id": None, "status": "unchanged", "processed_files": 0, "remaining_items": 0}
+    
+    # 2. 從雲端下載現有的 DB 檔案到本地臨時目錄
+    db_path = download_db(bucket_name, db_file)
+    text_store = get_text_store(default_text_store_dir(db_path))
+    # 工作期間由爬蟲獨佔寫入連線；每批 commit 後 upload_db 以獨立連線執行 checkpoint
+    with get_connections(db_path).writer() as conn:
+        # 3. 有未完成的工作時從中斷處繼續，否則依已有的年份資料建立新工作
+        job_id = active_crawl_job(conn)
+        if job_id:
+            print(f"▶️ 繼續未完成的爬取工作 #{job_id}")
+            set_job_status(conn, job_id, 'running')
+        else:
+            job_id = create_crawl_job(conn, plan_years(conn))
+            print(f"🎯 建立爬取工作 #{job_id}")
     
-    total_files = 0
-    for i, y in enumerate(years_to_fetch):
-        print(f"🔄 開始處理 {y} 年 ({i+1}/{len(years_to_fetch)})...")
-        
-        # 3. 抓取該年份的所有 PDF 連結
-        pdf_urls = fetch_pdfs_for_year(y)
-        if pdf_urls:
-            print(f"📄 {y} 年找到 {len(pdf_urls)} 個 PDF 檔案")
+        total_files = 0
+        dirty = False
+        paused = False
+        last_id = 0
+        # 解析行程池在第一批 PDF 時建立並供所有批次共用，避免每批重新啟動 spawn 子行程
+        parse_pool = None
+        try:
+            while True:
+                # 檢查執行時間，避免超時
+                elapsed = (datetime.now() - start_time).total_seconds()
+                if elapsed > CRAWL_TIME_BUDGET:
+                    print(f"⏰ 執行時間過長 ({elapsed:.0f}s)，暫停工作。剩餘項目下次執行時繼續。")
+                    paused = True
+                    break
+            
+                # 每個項目在單次執行中只嘗試一次，失敗的項目留待下次執行重試
+                items = next_crawl_items(conn, job_id, last_id)
+                if not items:
+                    break
+                last_id = items[-1][0]
+            
+                if items[0][1] == 'year':
+                    item_id, _, y, _ = items[0]
+                    print(f"🔄 列舉 {y} 年 PDF...")
+                    try:
+                        # 4. 抓取該年份的所有 PDF 連結（條件式請求）
+                        pdf_urls, changed = fetch_pdfs_for_year(y, conn)
+                    except Exception as e:
+                        print(f"❌ {y} 年頁面抓取失敗: {e}")
+                        finish_item(conn, item_id, False, str(e))
+                        conn.commit()
+                        continue
+            
+                    new_urls = [url for url in dict.fromkeys(pdf_urls) if not is_processed(conn, url)]
+                    conn.executemany("""
+                        INSERT OR IGNORE INTO crawl_items (job_id, kind, year, url, status, updated_at)
+                        VALUES (?, 'pdf', ?, ?, 'pending', ?)
+                    """, [(job_id, y, url, _now()) for url in new_urls])
+                    finish_item(conn, item_id, True)
+                    conn.commit()
+                    dirty = dirty or changed or bool(new_urls)
+                    if new_urls:
+                        print(f"📄 {y} 年找到 {len(new_urls)} 個新 PDF，已加入佇列")
+                    elif pdf_urls:
+                        print(f"✅ {y} 年沒有新 PDF{'' if changed else '（頁面未變更）'}")
+                    else:
+                        print(f"⚠️ {y} 年沒有找到 PDF 檔案")
+                    continue
             
-            # 4. 逐個處理 PDF（自動跳過已處理的）
-            processed = process_pdfs(pdf_urls, db_path, y)
-            total_files += processed
-            print(f"📊 {y} 年處理完成，新增 {processed} 個檔案")
+                # 5. 處理同一年份的一批 PDF（自動跳過已處理的）
+                y = items[0][2]
+                urls = [item[3] for item in items]
+                if parse_pool is not None and not parse_pool_usable(parse_pool):
+                    print("⚠️ 解析行程池已失效，重新建立")
+                    parse_pool.shutdown(wait=False)
+                    parse_pool = None
+                if parse_pool is None:
+                    parse_pool = create_parse_pool()
+                processed = process_pdfs(urls, conn, y, parse_pool, text_store)
+                total_files += processed
+                for item_id, _, _, url in items:
+                    ok = is_processed(conn, url)
+                    finish_item(conn, item_id, ok, None if ok else "下載或解析失敗")
+                conn.commit()
+                dirty = True
+                print(f"📊 {y} 年批次完成，新增 {processed} 個檔案")
             
-            # 每年處理完後上傳一次，避免資料丟失
-            upload_db(bucket_name, db_file, db_path)
-            print(f"☁️ {y} 年資料已備份到雲端")
+                # 每批處理完後上傳一次，避免資料丟失
+                upload_db(bucket_name, db_file, db_path)
+                print(f"☁️ {y} 年資料已備份到雲端")
+        finally:
+            if parse_pool is not None:
+                parse_pool.shutdown()
+    
+        remaining = conn.execute(
+            "SELECT COUNT(*) FROM crawl_items WHERE job_id=? AND status='pending'", (job_id,)
+        ).fetchone()[0]
+        failed = conn.execute(
+            "SELECT COUNT(*) FROM crawl_items WHERE job_id=? AND status='failed'", (job_id,)
+        ).fetchone()[0]
+        if remaining:
+            status = 'paused'
+            message = f"剩餘 {remaining} 個項目待下次執行"
         else:
-            print(f"⚠️ {y} 年沒有找到 PDF 檔案")
-        
-        # 檢查執行時間，避免超時
-        elapsed = (datetime.now() - start_time).total_seconds()
-        if elapsed > 3000:  # 50分鐘後停止，避免Cloud Run超時
-            print(f"⏰ 執行時間過長 ({elapsed:.0f}s)，暫停處理。剩餘年份下次執行時繼續。")
-            break
-
-    # 5. 最終上傳
-    upload_db(bucket_name, db_file, db_path)
+            status = 'completed'
+            message = f"{failed} 個項目失敗" if failed else None
+        set_job_status(conn, job_id, status, message)
+        crawl_state = build_crawl_state(conn) if status == 'completed' else None
+    
+    # 6. 最終上傳（沒有任何變更且工作已完成時不必上傳）
+    if dirty or paused or remaining:
+        upload_db(bucket_name, db_file, db_path)
+    else:
+        print("✅ 所有頁面均未變更，略過上傳")
+    
+    # 7. 記錄本次檢查的頁面，下次執行時先以條件式請求確認是否有變更
+    if crawl_state is not None:
+        try:
+            save_crawl_state(bucket_name, db_file, crawl_state)
+        except Exception as e:
+            print(f"⚠️ 爬取狀態寫入失敗（下次執行完整檢查）: {e}")
     
     elapsed = (datetime.now() - start_time).total_seconds()
-    print(f"✅ 更新完成！共處理 {total_files} 個新檔案，耗時 {elapsed:.2f} 秒")
+    print(f"✅ 工作 #{job_id} {status}！本次處理 {total_files} 個新檔案，耗時 {elapsed:.2f} 秒")
+    return {"job_id": job_id, "status": status, "processed_files": total_files, "remaining_items": remaining}
+
+def get_crawl_status(bucket_name, db_file):
+    """最近一次爬取工作的進度"""
+    conn, _ = _query_conn(bucket_name, db_file)
+    job = conn.execute("""
+        SELECT id, status, years, message, created_at, updated_at, finished_at
+        FROM crawl_jobs ORDER BY id DESC LIMIT 1
+    """).fetchone()
+    if job is None:
+        return {"success": True, "job": None}
+    
+    counts = {}
+    for kind, status, count in conn.execute(
+        "SELECT kind, status, COUNT(*) FROM crawl_items WHERE job_id=? GROUP BY kind, status", (job[0],)
+    ):
+        counts.setdefault(kind, {"pending": 0, "done": 0, "failed": 0})[status] = count
+    failed_items = [
+        {"year": year, "url": url, "attempts": attempts, "error": error}
+        for year, url, attempts, error in conn.execute("""
+            SELECT year, url, attempts, error FROM crawl_items
+            WHERE job_id=? AND (status='failed' OR (status='pending' AND attempts>0))
+            ORDER BY id LIMIT 50
+        """, (job[0],))
+    ]
+    return {
+        "success": True,
+        "job": {
+            "id": job[0],
+            "status": job[1],
+            "years": json.loads(job[2] or "[]"),
+            "message": job[3],
+            "created_at": job[4],
+            "updated_at": job[5],
+            "finished_at": job[6]
+        },
+        "years": counts.get("year", {"pending": 0, "done": 0, "failed": 0}),
+        "pdfs": counts.get("pdf", {"pending": 0, "done": 0, "failed": 0}),
+        "failed_items": failed_items
+    }
+
+# ---------- 重新抽取 ----------
+def _texts_from_stored_pdf(pdf_store, text_store, sha256):
+    """文字快取中沒有時，由 PDF 原始檔儲存取出 PDF 擷取文字並補進快取；都沒有時回傳 None"""
+    if pdf_store is None:
+        return None
+    fd, pdf_path = tempfile.mkstemp(prefix="temp_", suffix=".pdf")
+    os.close(fd)
+    try:
+        if not pdf_store.fetch(sha256, pdf_path):
+            return None
+        texts = list(page_texts(pdf_path, 0, pdf_page_count(pdf_path)))
+        save_page_texts(text_store, sha256, texts)
+        return texts
+    finally:
+        _remove_temp(pdf_path)
+
+def reprocess_db(db_path, dry_run=False):
+    """以文字快取重新抽取所有已解析 PDF 的條目，只改寫結果有變化的 PDF
+
+    不下載也不解析 PDF：條目抽取規則修改後，用這個函式把新規則套用到所有年份的歷史資料。
+    文字快取位置依 PDF_TEXT_STORE、PDF_STORE 的順序決定，都未設定時使用 DB 所在目錄下的
+    TEXT_STORE_DIRNAME（與爬蟲相同，只有在同一台機器上爬取過的 PDF 才有文字）；
+    快取中沒有文字但 PDF 原始檔儲存（PDF_STORE）中有原檔時，會先補擷取文字。
+    內容雜湊功能之前爬取的 PDF 沒有雜湊，無法對應到快取，計入 legacy_urls，需重新爬取才能納入
+    """
+    text_store = get_text_store(default_text_store_dir(db_path))
+    pdf_store = get_pdf_store()
+    
+    with get_connections(db_path).writer() as conn:
+        blobs = conn.execute("""
+            SELECT b.sha256, b.first_url, u.year
+            FROM pdf_blobs b LEFT JOIN pdf_urls u ON u.source_url = b.first_url
+            ORDER BY u.year, b.first_url
+        """).fetchall()
+        print(f"🔁 重新抽取 {len(blobs)} 個 PDF 的條目{'（僅預覽，不寫入）' if dry_run else ''}")
+        
+        summary = {"pdfs": len(blobs), "changed": 0, "unchanged": 0, "missing_text": 0,
+                   "entries_before": 0, "entries_after": 0}
+        for sha256, url, year in blobs:
+            texts = load_page_texts(text_store, sha256)
+            if texts is None:
+                texts = _texts_from_stored_pdf(pdf_store, text_store, sha256)
+            if texts is None:
+                summary["missing_text"] += 1
+                print(f"⚠️ 沒有快取文字，略過: {os.path.basename(url)}")
+                continue
+            
+            entries = entry_tuples(texts)
+            existing = conn.execute(
+                "SELECT name, nationality, passport_no, year FROM profiles WHERE source_pdf=? ORDER BY id", (url,)
+            ).fetchall()
+            summary["entries_before"] += len(existing)
+            summary["entries_after"] += len(entries)
+            if [row[:3] for row in existing] == entries:
+                summary["unchanged"] += 1
+                continue
+            
+            summary["changed"] += 1
+            print(f"✏️ {os.path.basename(url)}: {len(existing)} → {len(entries)} 個條目")
+            if dry_run:
+                continue
+            if year is None and existing:
+                year = existing[0][3]
+            conn.execute("DELETE FROM profiles WHERE source_pdf=?", (url,))
+            save_pdf_entries(conn, url, year, entries)
+            conn.execute("UPDATE pdf_blobs SET entries_count=? WHERE sha256=?", (len(entries), sha256))
+            conn.commit()
+        
+        # 去重功能之前處理的 PDF 沒有內容雜湊，需重新爬取一次才能納入文字快取
+        summary["legacy_urls"] = conn.execute("""
+            SELECT COUNT(*) FROM processed_files f
+            WHERE NOT EXISTS (SELECT 1 FROM pdf_urls u WHERE u.source_url = f.source_pdf)
+        """).fetchone()[0]
+    
+    print(f"✅ 重新抽取完成：{summary['changed']} 個 PDF 有變更，{summary['unchanged']} 個不變，"
+          f"{summary['missing_text']} 個沒有快取文字")
+    summary["success"] = True
+    return summary
+
+def reprocess(bucket_name, db_file, dry_run=False):
+    """下載 DB、以文字快取重新抽取條目，有變更時上傳"""
+    start_time = datetime.now()
+    db_path = download_db(bucket_name, db_file)
+    summary = reprocess_db(db_path, dry_run)
+    if summary["success"] and summary["changed"] and not dry_run:
+        upload_db(bucket_name, db_file, db_path)
+    summary["elapsed_seconds"] = round((datetime.now() - start_time).total_seconds(), 2)
+    return summary
 
 # ---------- 查詢 ----------
 def query_name(bucket_name, db_file, name):
-    db_path = download_db(bucket_name, db_file)
-    conn = _connect(db_path)
+    conn, schema = _query_conn(bucket_name, db_file)
     cursor = conn.cursor()
-    cursor.execute("SELECT name, nationality, passport_no FROM profiles WHERE name LIKE ? COLLATE NOCASE", (f"%{name}%",))
+    if _use_name_fts(schema, name):
+        cursor.execute("""
+            SELECT name, nationality, passport_no FROM profiles
+            WHERE id IN (SELECT rowid FROM profiles_fts WHERE name LIKE ?)
+            ORDER BY id
+        """, (f"%{name}%",))
+    else:
+        cursor.execute("SELECT name, nationality, passport_no FROM profiles WHERE name LIKE ? COLLATE NOCASE", (f"%{name}%",))
     rows = cursor.fetchall()
-    conn.close()
     formatted = [f"{r[0]} | {r[1]} | {r[2]}" for r in rows]
     return (len(formatted) > 0, formatted)
 
-def get_profiles_paginated(bucket_name, db_file, page=1, per_page=20, nationality=None, search_name=None):
-    """分頁獲取制裁名單"""
-    db_path = download_db(bucket_name, db_file)
+def _keyset_after(year, name, row_id):
+    """依 (year DESC, name, rowid) 排序時，位於游標之後的條件與參數
+
+    SQLite 中 NULL 最小：year DESC 時 NULL 年份排在最後，name 升冪時 NULL 姓名排在最前。
+    游標年份不為 NULL 時，以 year <= ? 讓查詢能從索引中直接定位；
+    NULL 年份的記錄不在此條件內，由呼叫端在最後另外查詢
+    """
+    if name is None:
+        name_after, name_params = "(name IS NOT NULL OR (name IS NULL AND rowid > ?))", [row_id]
+    else:
+        name_after, name_params = "(name > ? OR (name = ? AND rowid > ?))", [name, name, row_id]
+    if year is None:
+        return f"year IS NULL AND {name_after}", name_params
+    return f"year <= ? AND (year < ? OR {name_after})", [year, year] + name_params
+
+def get_profiles_paginated(bucket_name, db_file, page=1, per_page=20, nationality=None, search_name=None, cursor=None):
+    """分頁獲取制裁名單
+
+    依 (year DESC, name, rowid) 排序；cursor 為前一頁回應中的 next_cursor，
+    以鍵集分頁從索引直接定位；未提供時以 page 頁碼定位（OFFSET）。
+    多讀取一筆判斷是否還有下一頁，has_next / next_cursor 不依賴頁碼；
+    無效的 cursor 回傳 success=False 與錯誤訊息
+    """
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return _empty_profiles_page(page, per_page, str(e))
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 檢查表名 - 新版本用aml_profiles，舊版本用profiles
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [table[0] for table in cursor.fetchall()]
-        table_name = 'aml_profiles' if 'aml_profiles' in tables else 'profiles'
+        conn, schema = _query_conn(bucket_name, db_file)
+        db_cursor = conn.cursor()
+        table_name = schema['table']
         
         # 構建查詢條件
         where_conditions = []
@@ -362,47 +1268,51 @@ def get_profiles_paginated(bucket_name, db_file, page=1, per_page=20, nationalit
             params.append(nationality)
             
         if search_name:
-            where_conditions.append("name LIKE ?")
+            if table_name == 'profiles' and _use_name_fts(schema, search_name):
+                where_conditions.append("id IN (SELECT rowid FROM profiles_fts WHERE name LIKE ?)")
+            else:
+                where_conditions.append("name LIKE ?")
             params.append(f"%{search_name}%")
         
         where_clause = " WHERE " + " AND ".join(where_conditions) if where_conditions else ""
         
-        # 查詢總數
-        count_query = f"SELECT COUNT(*) FROM {table_name}{where_clause}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()[0]
+        # 查詢總數 - 沒有姓名搜尋時使用觸發器維護的計數
+        if not search_name and schema['profile_counts']:
+            total = counted_profiles(conn, nationality)
+        else:
+            count_query = f"SELECT COUNT(*) FROM {table_name}{where_clause}"
+            db_cursor.execute(count_query, params)
+            total = db_cursor.fetchone()[0]
         
         # 計算分頁
         total_pages = (total + per_page - 1) // per_page
         offset = (page - 1) * per_page
         
-        # 查詢數據 - 先檢查欄位是否存在
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [col[1] for col in cursor.fetchall()]
-        has_source_fields = 'source_pdf' in columns and 'source_url' in columns
+        has_source_fields = schema['has_source_fields']
         
-        if has_source_fields:
-            query = f"""
-            SELECT name, nationality, passport_no, year, source_pdf, source_url
-            FROM {table_name}{where_clause}
-            ORDER BY year DESC, name
-            LIMIT ? OFFSET ?
-            """
+        def select_page(conditions, condition_params, limit, offset=0):
+            sql = _page_sql(table_name, schema['select_columns'], tuple(conditions))
+            db_cursor.execute(sql, condition_params + [limit, offset])
+            return db_cursor.fetchall()
+        
+        # 多讀取一筆，有第 per_page + 1 筆時才有下一頁
+        limit = per_page + 1
+        if position:
+            year, name, row_id = position
+            after_sql, after_params = _keyset_after(year, name, row_id)
+            rows = select_page(where_conditions + [after_sql], params + after_params, limit)
+            if year is not None and len(rows) < limit:
+                # NULL 年份排在最後，定位條件不包含這些記錄
+                rows += select_page(where_conditions + ["year IS NULL"], params, limit - len(rows))
         else:
-            query = f"""
-            SELECT name, nationality, passport_no, year
-            FROM {table_name}{where_clause}
-            ORDER BY year DESC, name
-            LIMIT ? OFFSET ?
-            """
-            
-        cursor.execute(query, params + [per_page, offset])
-        rows = cursor.fetchall()
+            rows = select_page(where_conditions, params, limit, offset)
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
         
         profiles = []
         for row in rows:
             if has_source_fields:
-                name, nationality, passport_no, year, source_pdf, source_url = row
+                _, name, nationality, passport_no, year, source_pdf, source_url = row
                 profiles.append({
                     'name': name,
                     'nationality': nationality,
@@ -412,7 +1322,7 @@ def get_profiles_paginated(bucket_name, db_file, page=1, per_page=20, nationalit
                     'source_url': source_url or ''
                 })
             else:
-                name, nationality, passport_no, year = row
+                _, name, nationality, passport_no, year = row
                 profiles.append({
                     'name': name,
                     'nationality': nationality,
@@ -422,61 +1332,68 @@ def get_profiles_paginated(bucket_name, db_file, page=1, per_page=20, nationalit
                     'source_url': ''
                 })
         
-        conn.close()
+        next_cursor = None
+        if has_next:
+            last = rows[-1]
+            next_cursor = encode_cursor(last[4], last[1], last[0])
         
         return {
+            'success': True,
             'profiles': profiles,
             'total': total,
             'page': page,
             'per_page': per_page,
             'total_pages': total_pages,
-            'has_prev': page > 1,
-            'has_next': page < total_pages
+            # 以游標定位時一定是從前一頁翻過來的
+            'has_prev': position is not None or page > 1,
+            'has_next': has_next,
+            'next_cursor': next_cursor
         }
         
     except Exception as e:
         print(f"分頁查詢錯誤: {e}")
-        return {
-            'profiles': [],
-            'total': 0,
-            'page': 1,
-            'per_page': per_page,
-            'total_pages': 0,
-            'has_prev': False,
-            'has_next': False
-        }
+        return _empty_profiles_page(page, per_page, f"分頁查詢失敗: {e}")
+
+def _empty_profiles_page(page, per_page, error):
+    """分頁查詢失敗時的回應"""
+    return {
+        'success': False,
+        'error': error,
+        'profiles': [],
+        'total': 0,
+        'page': page,
+        'per_page': per_page,
+        'total_pages': 0,
+        'has_prev': False,
+        'has_next': False,
+        'next_cursor': None
+    }
 
 def get_stats(bucket_name, db_file):
     """獲取統計信息"""
-    db_path = download_db(bucket_name, db_file)
-    
     try:
-        conn = sqlite3.connect(db_path)
+        conn, schema = _query_conn(bucket_name, db_file)
         cursor = conn.cursor()
         
-        # 檢查表名 - 新版本用aml_profiles，舊版本用profiles
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [table[0] for table in cursor.fetchall()]
-        table_name = 'aml_profiles' if 'aml_profiles' in tables else 'profiles'
-        
         # 總數統計
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        total_profiles = cursor.fetchone()[0]
+        if schema['profile_counts']:
+            total_profiles = counted_profiles(conn)
+        else:
+            cursor.execute(schema['count_sql'])
+            total_profiles = cursor.fetchone()[0]
         
         # 年份統計
-        cursor.execute(f"SELECT year, COUNT(*) as count FROM {table_name} GROUP BY year ORDER BY year DESC")
+        cursor.execute(schema['year_stats_sql'])
         year_stats = cursor.fetchall()
         
         # 國籍統計
-        cursor.execute(f"SELECT nationality, COUNT(*) as count FROM {table_name} GROUP BY nationality ORDER BY count DESC LIMIT 10")
+        cursor.execute(schema['nationality_stats_sql'])
         nationality_stats = cursor.fetchall()
         
         # 最新數據年份
-        cursor.execute(f"SELECT MAX(year) FROM {table_name}")
+        cursor.execute(schema['latest_year_sql'])
         latest_year = cursor.fetchone()[0]
         
-        conn.close()
-        
         return {
             'total_profiles': total_profiles,
             'latest_year': latest_year,
@@ -500,23 +1417,56 @@ def _rand_passport():
 def _now():
     return datetime.utcnow().isoformat(timespec="seconds") + "Z"
 
+# 條目解析用的正規表示式（模組載入時編譯一次）
+_ENTRY_START_RE = re.compile(r'^QDi\.\d+')
+
+# (pattern, 是否為多組姓名)；依序嘗試，第一個符合者為準
+_NAME_PATTERNS_FIRST_LINE = (
+    (re.compile(r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|$)'), True),
+    (re.compile(r'Name:\s*1:\s*(\w+)\s*2:\s*(\w*)\s*3:\s*(\w*)\s*4:\s*(\w*)'), True),
+    (re.compile(r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|$)'), False),
+)
+_NAME_PATTERNS_CONTINUATION = (
+    (re.compile(r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|Nationality:|$)'), True),
+    (re.compile(r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|Nationality:|$)'), False),
+)
+_NATIONALITY_RE = re.compile(r'Nationality:\s*([A-Za-z\s]+?)(?:\s+Passport|\s+National|\s+Address|\s+Listed|$)')
+
+# 護照號碼 (多種格式)；三個格式都以 passport 開頭，先以同樣的大小寫規則過濾
+_PASSPORT_HINT_RE = re.compile(r'passport', re.IGNORECASE)
+_PASSPORT_PATTERNS = (
+    re.compile(r'Passport no:\s*([^\s]+(?:\s+number\s+[^\s]+)?)', re.IGNORECASE),
+    re.compile(r'Passport number\s*([^\s]+)', re.IGNORECASE),
+    re.compile(r'Passport:\s*([^\s]+)', re.IGNORECASE),
+)
+_PASSPORT_EMPTY_VALUES = frozenset(('na', 'n/a', ''))
+
+def _match_name(line, patterns):
+    """依序嘗試姓名格式，回傳姓名；都不符合時回傳 None"""
+    for pattern, multi in patterns:
+        name_match = pattern.search(line)
+        if name_match:
+            if multi:
+                return ' '.join(part.strip() for part in name_match.groups() if part and part.strip())
+            return name_match.group(1).strip()
+    return None
+
 def extract_sanction_entries(text):
-    """從 PDF 文字中提取制裁名單條目"""
-    import re
-    
+    """從 PDF 文字中提取制裁名單條目（單次掃描，只對含關鍵字的行執行對應的正規表示式）"""
     entries = []
-    lines = text.split('\n')
     current_entry = None
+    raw_parts = None
     
-    for line in lines:
+    for line in text.split('\n'):
         line = line.strip()
         if not line:
             continue
         
         # 檢查是否是新條目開始 (QDi.XXX 格式)
-        if re.match(r'^QDi\.\d+', line):
+        if line.startswith('QDi.') and _ENTRY_START_RE.match(line):
             # 保存前一個條目
-            if current_entry:
+            if current_entry is not None:
+                current_entry['raw_text'] = ' '.join(raw_parts)
                 entries.append(finalize_entry(current_entry))
             
             # 開始新條目
@@ -526,67 +1476,42 @@ def extract_sanction_entries(text):
                 'passport_no': 'na',
                 'raw_text': line
             }
+            raw_parts = [line]
             
-            # 提取姓名 - 更靈活的模式
-            name_patterns = [
-                r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|$)',
-                r'Name:\s*1:\s*(\w+)\s*2:\s*(\w*)\s*3:\s*(\w*)\s*4:\s*(\w*)',
-                r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|$)'
-            ]
-            
-            for pattern in name_patterns:
-                name_match = re.search(pattern, line)
-                if name_match:
-                    if len(name_match.groups()) > 1:
-                        # 多個組的情況
-                        name_parts = [part.strip() for part in name_match.groups() if part and part.strip()]
-                        current_entry['name'] = ' '.join(name_parts)
-                    else:
-                        # 單個組的情況
-                        current_entry['name'] = name_match.group(1).strip()
-                    break
+            if 'Name:' in line:
+                name = _match_name(line, _NAME_PATTERNS_FIRST_LINE)
+                if name is not None:
+                    current_entry['name'] = name
         
-        elif current_entry:
+        elif current_entry is not None:
             # 繼續處理當前條目的其他資訊
-            current_entry['raw_text'] += ' ' + line
+            raw_parts.append(line)
             
             # 如果姓名還沒找到，繼續嘗試
-            if not current_entry['name']:
-                name_patterns = [
-                    r'Name:\s*1:\s*([A-Z\s]+?)\s*2:\s*([A-Z\s]*?)\s*3:\s*([A-Z\s]*?)\s*4:\s*([A-Z\s]*?)(?:\s*Title:|DOB:|Designation:|Nationality:|$)',
-                    r'Name:\s*([A-Z][A-Z\s]+?)(?:Title:|DOB:|Designation:|Nationality:|$)'
-                ]
-                for pattern in name_patterns:
-                    name_match = re.search(pattern, line)
-                    if name_match:
-                        if len(name_match.groups()) > 1:
-                            name_parts = [part.strip() for part in name_match.groups() if part and part.strip()]
-                            current_entry['name'] = ' '.join(name_parts)
-                        else:
-                            current_entry['name'] = name_match.group(1).strip()
-                        break
+            if not current_entry['name'] and 'Name:' in line:
+                name = _match_name(line, _NAME_PATTERNS_CONTINUATION)
+                if name is not None:
+                    current_entry['name'] = name
             
             # 提取國籍
-            nationality_match = re.search(r'Nationality:\s*([A-Za-z\s]+?)(?:\s+Passport|\s+National|\s+Address|\s+Listed|$)', line)
-            if nationality_match:
-                current_entry['nationality'] = nationality_match.group(1).strip()
+            if 'Nationality:' in line:
+                nationality_match = _NATIONALITY_RE.search(line)
+                if nationality_match:
+                    current_entry['nationality'] = nationality_match.group(1).strip()
             
-            # 提取護照號碼 (多種格式)
-            passport_patterns = [
-                r'Passport no:\s*([^\s]+(?:\s+number\s+[^\s]+)?)',
-                r'Passport number\s*([^\s]+)',
-                r'Passport:\s*([^\s]+)'
-            ]
-            for pattern in passport_patterns:
-                passport_match = re.search(pattern, line, re.IGNORECASE)
-                if passport_match:
-                    passport_value = passport_match.group(1).strip()
-                    if passport_value.lower() not in ['na', 'n/a', '']:
-                        current_entry['passport_no'] = passport_value
-                    break
+            # 提取護照號碼
+            if _PASSPORT_HINT_RE.search(line):
+                for pattern in _PASSPORT_PATTERNS:
+                    passport_match = pattern.search(line)
+                    if passport_match:
+                        passport_value = passport_match.group(1).strip()
+                        if passport_value.lower() not in _PASSPORT_EMPTY_VALUES:
+                            current_entry['passport_no'] = passport_value
+                        break
     
     # 處理最後一個條目
-    if current_entry:
+    if current_entry is not None:
+        current_entry['raw_text'] = ' '.join(raw_parts)
         entries.append(finalize_entry(current_entry))
     
     return entries
@@ -606,3 +1531,16 @@ def finalize_entry(entry):
         entry['name'] = 'Unknown'
     
     return entry
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "reprocess":
+        print("用法: python takepdf.py reprocess [--dry-run]")
+        sys.exit(1)
+
+    result = reprocess(
+        os.environ.get("BUCKET_NAME", "hk-ia-db"),
+        os.environ.get("DB_FILE", "aml_profiles.db"),
+        dry_run="--dry-run" in sys.argv[2:]
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(0 if result["success"] else 1)
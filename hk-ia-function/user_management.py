@@ -1,18 +1,21 @@
-import sqlite3
 import hashlib
 import secrets
 from datetime import datetime, timedelta
+from sqlite_connections import get_connections
 
 class UserManager:
     def __init__(self, db_path='aml_profiles.db'):
         self.db_path = db_path
+        # 讀取使用各執行緒重複使用的唯讀連線，寫入經由唯一的寫入連線
+        self.db = get_connections(db_path)
         self.init_tables()
 
     def init_tables(self):
         """初始化用戶管理相關的資料表"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self.db.writer() as conn:
+            self._create_tables(conn.cursor())
+
+    def _create_tables(self, cursor):
         # 用戶表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -62,9 +65,6 @@ class UserManager:
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         ''')
-        
-        conn.commit()
-        conn.close()
 
     def hash_password(self, password):
         """密碼哈希"""
@@ -77,26 +77,24 @@ class UserManager:
     def register_user(self, email, password, membership_level='basic', is_admin=False):
         """註冊新用戶"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 檢查email是否已存在
-            cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-            if cursor.fetchone():
-                return {'success': False, 'message': '此 Email 已被註冊'}
-            
-            # 創建新用戶
-            password_hash = self.hash_password(password)
-            cursor.execute('''
-            INSERT INTO users (email, password_hash, membership_level, is_admin)
-            VALUES (?, ?, ?, ?)
-            ''', (email, password_hash, membership_level, is_admin))
-            
-            user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '註冊成功', 'user_id': user_id}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                # 檢查email是否已存在
+                cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
+                if cursor.fetchone():
+                    return {'success': False, 'message': '此 Email 已被註冊'}
+                
+                # 創建新用戶
+                password_hash = self.hash_password(password)
+                cursor.execute('''
+                INSERT INTO users (email, password_hash, membership_level, is_admin)
+                VALUES (?, ?, ?, ?)
+                ''', (email, password_hash, membership_level, is_admin))
+                
+                user_id = cursor.lastrowid
+                
+                return {'success': True, 'message': '註冊成功', 'user_id': user_id}
             
         except Exception as e:
             return {'success': False, 'message': f'註冊失敗: {str(e)}'}
@@ -104,49 +102,45 @@ class UserManager:
     def login_user(self, email, password):
         """用戶登入"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(password)
-            cursor.execute('''
-            SELECT id, email, membership_level, is_admin FROM users 
-            WHERE email = ? AND password_hash = ? AND is_active = 1
-            ''', (email, password_hash))
-            
-            user = cursor.fetchone()
-            if not user:
-                conn.close()
-                return {'success': False, 'message': '帳號或密碼錯誤'}
-            
-            user_id, email, membership_level, is_admin = user
-            
-            # 創建會話
-            session_token = self.generate_session_token()
-            expires_at = datetime.now() + timedelta(hours=24)  # 24小時有效
-            
-            cursor.execute('''
-            INSERT INTO user_sessions (user_id, session_token, expires_at)
-            VALUES (?, ?, ?)
-            ''', (user_id, session_token, expires_at))
-            
-            # 更新最後登入時間
-            cursor.execute('''
-            UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
-            ''', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            return {
-                'success': True,
-                'session_token': session_token,
-                'user': {
-                    'id': user_id,
-                    'email': email,
-                    'membership_level': membership_level,
-                    'is_admin': is_admin
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                password_hash = self.hash_password(password)
+                cursor.execute('''
+                SELECT id, email, membership_level, is_admin FROM users 
+                WHERE email = ? AND password_hash = ? AND is_active = 1
+                ''', (email, password_hash))
+                
+                user = cursor.fetchone()
+                if not user:
+                    return {'success': False, 'message': '帳號或密碼錯誤'}
+                
+                user_id, email, membership_level, is_admin = user
+                
+                # 創建會話
+                session_token = self.generate_session_token()
+                expires_at = datetime.now() + timedelta(hours=24)  # 24小時有效
+                
+                cursor.execute('''
+                INSERT INTO user_sessions (user_id, session_token, expires_at)
+                VALUES (?, ?, ?)
+                ''', (user_id, session_token, expires_at))
+                
+                # 更新最後登入時間
+                cursor.execute('''
+                UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
+                ''', (user_id,))
+                
+                return {
+                    'success': True,
+                    'session_token': session_token,
+                    'user': {
+                        'id': user_id,
+                        'email': email,
+                        'membership_level': membership_level,
+                        'is_admin': is_admin
+                    }
                 }
-            }
             
         except Exception as e:
             return {'success': False, 'message': f'登入失敗: {str(e)}'}
@@ -154,7 +148,7 @@ class UserManager:
     def verify_session(self, session_token):
         """驗證會話"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.db.reader()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -166,7 +160,6 @@ class UserManager:
             
             result = cursor.fetchone()
             if not result:
-                conn.close()
                 return {'valid': False, 'message': '無效的會話'}
             
             user_id, email, membership_level, is_admin, expires_at = result
@@ -175,13 +168,10 @@ class UserManager:
             expires_at_dt = datetime.fromisoformat(expires_at.replace('Z', '+00:00')) if isinstance(expires_at, str) else expires_at
             if datetime.now() > expires_at_dt:
                 # 刪除過期的會話
-                cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
-                conn.commit()
-                conn.close()
+                with self.db.writer() as writer:
+                    writer.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
                 return {'valid': False, 'message': '會話已過期'}
             
-            conn.close()
-            
             return {
                 'valid': True,
                 'user': {
@@ -199,14 +189,12 @@ class UserManager:
     def logout_user(self, session_token):
         """用戶登出"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '登出成功'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
+                
+                return {'success': True, 'message': '登出成功'}
             
         except Exception as e:
             return {'success': False, 'message': f'登出失敗: {str(e)}'}
@@ -214,33 +202,28 @@ class UserManager:
     def change_password(self, user_id, old_password, new_password):
         """更改密碼"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 驗證舊密碼
-            old_password_hash = self.hash_password(old_password)
-            cursor.execute('SELECT id FROM users WHERE id = ? AND password_hash = ?', (user_id, old_password_hash))
-            
-            if not cursor.fetchone():
-                conn.close()
-                return {'success': False, 'message': '舊密碼錯誤'}
-            
-            # 密碼強度檢查
-            if len(new_password) < 6:
-                conn.close()
-                return {'success': False, 'message': '新密碼長度至少需要6個字符'}
-            
-            # 更新密碼
-            new_password_hash = self.hash_password(new_password)
-            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, user_id))
-            
-            # 清除該用戶的所有會話（強制重新登入）
-            cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '密碼更改成功，請重新登入'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                # 驗證舊密碼
+                old_password_hash = self.hash_password(old_password)
+                cursor.execute('SELECT id FROM users WHERE id = ? AND password_hash = ?', (user_id, old_password_hash))
+                
+                if not cursor.fetchone():
+                    return {'success': False, 'message': '舊密碼錯誤'}
+                
+                # 密碼強度檢查
+                if len(new_password) < 6:
+                    return {'success': False, 'message': '新密碼長度至少需要6個字符'}
+                
+                # 更新密碼
+                new_password_hash = self.hash_password(new_password)
+                cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, user_id))
+                
+                # 清除該用戶的所有會話（強制重新登入）
+                cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
+                
+                return {'success': True, 'message': '密碼更改成功，請重新登入'}
             
         except Exception as e:
             return {'success': False, 'message': f'密碼更改失敗: {str(e)}'}
@@ -248,7 +231,7 @@ class UserManager:
     def check_query_limit(self, user_id):
         """檢查用戶查詢限制"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.db.reader()
             cursor = conn.cursor()
             
             # 獲取用戶會員等級
@@ -266,7 +249,6 @@ class UserManager:
                 daily_limit = 100  # 付費會員
             elif membership_level == 'super':
                 # 超級會員無限制
-                conn.close()
                 return {
                     'allowed': True,
                     'used': 0,
@@ -284,7 +266,6 @@ class UserManager:
             ''', (user_id, today))
             
             today_queries = cursor.fetchone()[0]
-            conn.close()
             
             if today_queries >= daily_limit:
                 return {
@@ -308,18 +289,15 @@ class UserManager:
     def log_query(self, user_id, query_type, query_params=None):
         """記錄查詢"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            INSERT INTO query_logs (user_id, query_type, query_params)
-            VALUES (?, ?, ?)
-            ''', (user_id, query_type, str(query_params) if query_params else None))
-            
-            conn.commit()
-            conn.close()
-            
-            return True
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                INSERT INTO query_logs (user_id, query_type, query_params)
+                VALUES (?, ?, ?)
+                ''', (user_id, query_type, str(query_params) if query_params else None))
+                
+                return True
             
         except Exception as e:
             print(f"記錄查詢錯誤: {e}")
@@ -330,7 +308,7 @@ class UserManager:
     def get_all_users(self):
         """獲取所有用戶（管理員功能）"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.db.reader()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -350,7 +328,6 @@ class UserManager:
                     'is_admin': bool(row[6])
                 })
             
-            conn.close()
             return {'success': True, 'users': users}
             
         except Exception as e:
@@ -363,21 +340,17 @@ class UserManager:
             if new_membership_level not in valid_levels:
                 return {'success': False, 'message': '無效的會員等級'}
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            UPDATE users SET membership_level = ? WHERE id = ?
-            ''', (new_membership_level, user_id))
-            
-            if cursor.rowcount == 0:
-                conn.close()
-                return {'success': False, 'message': '用戶不存在'}
-            
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '會員等級更新成功'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                UPDATE users SET membership_level = ? WHERE id = ?
+                ''', (new_membership_level, user_id))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': '用戶不存在'}
+                
+                return {'success': True, 'message': '會員等級更新成功'}
             
         except Exception as e:
             return {'success': False, 'message': f'更新會員等級失敗: {str(e)}'}
@@ -385,22 +358,18 @@ class UserManager:
     def deactivate_user(self, user_id):
         """停用用戶（管理員功能）"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('UPDATE users SET is_active = 0 WHERE id = ?', (user_id,))
-            
-            if cursor.rowcount == 0:
-                conn.close()
-                return {'success': False, 'message': '用戶不存在'}
-            
-            # 清除該用戶的所有會話
-            cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '用戶已停用'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('UPDATE users SET is_active = 0 WHERE id = ?', (user_id,))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': '用戶不存在'}
+                
+                # 清除該用戶的所有會話
+                cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
+                
+                return {'success': True, 'message': '用戶已停用'}
             
         except Exception as e:
             return {'success': False, 'message': f'停用用戶失敗: {str(e)}'}
@@ -408,19 +377,15 @@ class UserManager:
     def activate_user(self, user_id):
         """啟用用戶（管理員功能）"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('UPDATE users SET is_active = 1 WHERE id = ?', (user_id,))
-            
-            if cursor.rowcount == 0:
-                conn.close()
-                return {'success': False, 'message': '用戶不存在'}
-            
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '用戶已啟用'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('UPDATE users SET is_active = 1 WHERE id = ?', (user_id,))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': '用戶不存在'}
+                
+                return {'success': True, 'message': '用戶已啟用'}
             
         except Exception as e:
             return {'success': False, 'message': f'啟用用戶失敗: {str(e)}'}
@@ -428,7 +393,7 @@ class UserManager:
     def get_user_query_stats(self, user_id):
         """獲取用戶查詢統計（管理員功能）"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.db.reader()
             cursor = conn.cursor()
             
             # 今日查詢次數
@@ -451,7 +416,6 @@ class UserManager:
             last_query = cursor.fetchone()
             last_query_time = last_query[0] if last_query else None
             
-            conn.close()
             
             return {
                 'success': True,
@@ -468,23 +432,19 @@ class UserManager:
     def reset_user_password(self, user_id, new_password):
         """重置用戶密碼（管理員功能）"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(new_password)
-            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
-            
-            if cursor.rowcount == 0:
-                conn.close()
-                return {'success': False, 'message': '用戶不存在'}
-            
-            # 清除該用戶的所有會話，強制重新登入
-            cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            return {'success': True, 'message': '密碼重置成功'}
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                password_hash = self.hash_password(new_password)
+                cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+                
+                if cursor.rowcount == 0:
+                    return {'success': False, 'message': '用戶不存在'}
+                
+                # 清除該用戶的所有會話，強制重新登入
+                cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
+                
+                return {'success': True, 'message': '密碼重置成功'}
             
         except Exception as e:
             return {'success': False, 'message': f'重置密碼失敗: {str(e)}'}
@@ -502,31 +462,27 @@ class UserManager:
     def forgot_password(self, email):
         """忘記密碼功能 - 生成隨機密碼並發送 email"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 檢查用戶是否存在
-            cursor.execute('SELECT id, email FROM users WHERE email = ? AND is_active = 1', (email,))
-            user = cursor.fetchone()
-            
-            if not user:
-                conn.close()
-                return {'success': False, 'message': '找不到此電子郵件的用戶'}
-            
-            user_id, user_email = user
-            
-            # 生成隨機密碼（8位英數字組合）
-            new_password = self.generate_random_password()
-            password_hash = self.hash_password(new_password)
-            
-            # 更新密碼
-            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
-            
-            # 清除該用戶的所有會話，強制重新登入
-            cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                
+                # 檢查用戶是否存在
+                cursor.execute('SELECT id, email FROM users WHERE email = ? AND is_active = 1', (email,))
+                user = cursor.fetchone()
+                
+                if not user:
+                    return {'success': False, 'message': '找不到此電子郵件的用戶'}
+                
+                user_id, user_email = user
+                
+                # 生成隨機密碼（8位英數字組合）
+                new_password = self.generate_random_password()
+                password_hash = self.hash_password(new_password)
+                
+                # 更新密碼
+                cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+                
+                # 清除該用戶的所有會話，強制重新登入
+                cursor.execute('DELETE FROM user_sessions WHERE user_id = ?', (user_id,))
             
             # 發送 email（實際實現）
             email_sent = self.send_password_email(user_email, new_password)
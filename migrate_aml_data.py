@@ -10,6 +10,11 @@ import sys
 from datetime import datetime
 from google.cloud import firestore
 
+# 與查詢引擎共用姓名標準化邏輯，確保寫入與查詢的三元組一致
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "hk-ia-function"))
+from aml_name_index import profile_query_fields, backfill_query_fields
+from aml_stats import record_profiles_added
+
 class AMLDataMigrator:
     def __init__(self, use_emulator=True):
         """初始化遷移器"""
@@ -66,11 +71,16 @@ class AMLDataMigrator:
             'created_at': record_dict['created_at'] or '',
             'migrated_at': datetime.utcnow().isoformat()
         }
+        converted.update(self.derived_fields(converted))
         
         return converted
     
-    def batch_upload(self, records, column_names, batch_size=500):
-        """批次上傳資料到 Firestore"""
+    def derived_fields(self, data):
+        """由原始欄位推導、供查詢使用的欄位"""
+        return profile_query_fields(data)
+    
+    def batch_upload(self, records, column_names, batch_size=499):
+        """批次上傳資料到 Firestore（每批保留一個寫入名額給統計摘要）"""
         total_records = len(records)
         print(f"🚀 開始批次上傳 {total_records} 筆記錄...")
         
@@ -82,10 +92,19 @@ class AMLDataMigrator:
             
             print(f"⬆️ 上傳批次 {i//batch_size + 1}: 記錄 {i+1}-{min(i+batch_size, total_records)}")
             
+            year_counts = {}
+            nationality_counts = {}
             for record in batch_records:
                 converted = self.convert_record(record, column_names)
                 doc_ref = collection_ref.document(converted['id'])
                 batch.set(doc_ref, converted)
+                if converted['year']:
+                    year_counts[converted['year']] = year_counts.get(converted['year'], 0) + 1
+                code = converted['nationality_code']
+                nationality_counts[code] = nationality_counts.get(code, 0) + 1
+            
+            # 統計摘要與記錄在同一批次提交（遷移目標為空集合）
+            record_profiles_added(batch, self.db, len(batch_records), year_counts, nationality_counts)
             
             # 執行批次寫入
             batch.commit()
@@ -93,6 +112,15 @@ class AMLDataMigrator:
         
         print(f"🎉 所有資料上傳完成！總共 {total_records} 筆記錄")
     
+    def backfill_search_fields(self, batch_size=500):
+        """為既有文件補寫 name_normalized / name_trigrams / nationality_code 查詢欄位"""
+        print("🔄 補寫查詢欄位...")
+        
+        updated = backfill_query_fields(self.db, self.collection_name, batch_size)
+        
+        print(f"🎉 查詢欄位補寫完成，共更新 {updated} 筆記錄")
+        return updated
+    
     def verify_migration(self, expected_count):
         """驗證遷移結果"""
         print("🔍 驗證遷移結果...")
@@ -165,7 +193,7 @@ if __name__ == "__main__":
     
     # 檢查模式
     use_emulator = True
-    if len(sys.argv) > 1 and sys.argv[1] == "--production":
+    if "--production" in sys.argv[1:]:
         use_emulator = False
         print("⚠️ 警告：將遷移到生產環境！")
         confirm = input("確定要繼續嗎？(yes/no): ")
@@ -173,8 +201,14 @@ if __name__ == "__main__":
             print("🛑 遷移已取消")
             sys.exit(0)
     
-    # 執行遷移
     migrator = AMLDataMigrator(use_emulator=use_emulator)
+    
+    # 只補寫既有文件的查詢欄位
+    if "--backfill-search-fields" in sys.argv[1:]:
+        migrator.backfill_search_fields()
+        sys.exit(0)
+    
+    # 執行遷移
     success = migrator.migrate()
     
     sys.exit(0 if success else 1)